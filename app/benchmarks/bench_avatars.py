@@ -0,0 +1,84 @@
+"""
+Micro-benchmark for default avatar generation.
+
+Compares the per-avatar rendering time of the original approach (resolve the
+font and rasterize the letter for every avatar) with the cached one (a
+colour fill plus a paste of a pre-rendered glyph mask). PNG encoding, which
+both approaches share, is reported separately.
+
+Usage:
+    python benchmarks/bench_avatars.py --count 2000
+"""
+
+import argparse
+import os
+import random
+import string
+import sys
+import time
+from io import BytesIO
+
+from PIL import Image, ImageDraw
+
+# Add project root to path to allow imports
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from services import avatar_service
+
+
+def render_uncached(username: str) -> Image.Image:
+    """Rendering as it was done before fonts and glyphs were cached."""
+    image = Image.new(
+        "RGB",
+        (avatar_service.AVATAR_SIZE, avatar_service.AVATAR_SIZE),
+        color=avatar_service.avatar_color(username),
+    )
+    font = avatar_service.get_font.__wrapped__(avatar_service.FONT_SIZE)
+    ImageDraw.Draw(image).text(
+        (100, 100), username[0].upper(), fill="white", font=font, anchor="mm"
+    )
+    return image
+
+
+def encode(image: Image.Image) -> bytes:
+    buffer = BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def timed(func, usernames) -> float:
+    start = time.perf_counter()
+    for username in usernames:
+        func(username)
+    return (time.perf_counter() - start) / len(usernames)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--count", type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    alphabet = string.ascii_letters + "абвгдежзийклмнопрстуфхцчшщэюя"
+    usernames = [
+        "".join(rng.choice(alphabet) for _ in range(8)) for _ in range(args.count)
+    ]
+
+    avatar_service.get_font.cache_clear()
+    avatar_service.get_glyph_mask.cache_clear()
+
+    uncached = timed(render_uncached, usernames)
+    cached = timed(avatar_service.render_avatar, usernames)
+    encoding = timed(lambda name: encode(avatar_service.render_avatar(name)), usernames)
+
+    print(f"Avatars rendered: {args.count}\n")
+    print(f"{'variant':<24}{'us/avatar':>12}")
+    print(f"{'uncached render':<24}{uncached * 1e6:>12.1f}")
+    print(f"{'cached render':<24}{cached * 1e6:>12.1f}")
+    print(f"{'cached render + PNG':<24}{encoding * 1e6:>12.1f}")
+    print(f"\nSpeedup of rendering: {uncached / cached:.1f}x")
+    print(f"Glyph cache: {avatar_service.get_glyph_mask.cache_info()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Benchmark for at-rest compression of uploaded CSV tables.
+
+For every available codec it stores the same synthetic CSV the way an
+upload does (`compress_chunks` into `LocalStorage.save`), then reports the
+on-disk size ratio and the read throughput of both a raw decompressing
+stream (`iter_bytes` + `decompress_chunks`) and a full parse through
+`table_service`, as table previews and queries load files.
+
+Usage:
+    python benchmarks/bench_compression.py --rows 200000
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+# Add project root to path to allow imports
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from core.config import settings
+from services import compression, table_service
+from services.storage import LocalStorage, get_storage, path_from_key
+
+
+def make_csv(path: str, rows: int) -> None:
+    rng = np.random.default_rng(42)
+    df = pd.DataFrame(
+        {
+            "id": np.arange(rows),
+            "amount": rng.normal(1000, 250, rows).round(2),
+            "quantity": rng.integers(0, 500, rows),
+            "city": rng.choice(["Moscow", "Kazan", "Tver", "Omsk", "Perm"], rows),
+            "comment": rng.choice(["ok", "late", "returned", "damaged"], rows),
+        }
+    )
+    df.to_csv(path, index=False)
+
+
+async def file_chunks(path: str):
+    with open(path, "rb") as f:
+        while chunk := f.read(compression.CHUNK_SIZE):
+            yield chunk
+
+
+async def write(storage: LocalStorage, source: str, key: str, codec) -> None:
+    await storage.save(key, compression.compress_chunks(file_chunks(source), codec))
+
+
+async def stream(storage: LocalStorage, key: str) -> None:
+    chunks = compression.decompress_chunks(
+        storage.iter_bytes(key), compression.codec_for_path(key)
+    )
+    async for _ in chunks:
+        pass
+
+
+async def parse(key: str) -> None:
+    file_path = path_from_key(key)
+    with await table_service._download_table(file_path) as spool:
+        table_service._read_dataframe(spool, compression.strip_codec_suffix(key))
+
+
+def timed(func, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    codecs = [None, "gzip"]
+    if compression.zstandard is not None:
+        codecs.append("zstd")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # table_service reads through the configured storage backend
+        settings.STORAGE_BACKEND = "local"
+        settings.UPLOADS_DIR = os.path.join(tmp, "uploads")
+        get_storage.cache_clear()
+        storage = get_storage()
+        source = os.path.join(tmp, "source.csv")
+        make_csv(source, args.rows)
+        raw_size = os.path.getsize(source)
+        print(f"Synthetic CSV: {args.rows} rows, {raw_size / 2**20:.1f} MiB\n")
+        print(
+            f"{'codec':<8}{'size MiB':>10}{'ratio':>8}"
+            f"{'write s':>10}{'stream MiB/s':>14}{'read_csv s':>12}"
+        )
+
+        for codec in codecs:
+            key = "tables/1/table.csv" + compression.codec_suffix(codec)
+            write_time = timed(
+                lambda: asyncio.run(write(storage, source, key, codec)), args.repeat
+            )
+            stream_time = timed(lambda: asyncio.run(stream(storage, key)), args.repeat)
+            parse_time = timed(lambda: asyncio.run(parse(key)), args.repeat)
+            size = os.path.getsize(storage.path(key))
+            print(
+                f"{codec or 'none':<8}{size / 2**20:>10.2f}{raw_size / size:>8.2f}"
+                f"{write_time:>10.3f}{raw_size / 2**20 / stream_time:>14.1f}"
+                f"{parse_time:>12.3f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
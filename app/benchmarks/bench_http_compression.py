@@ -0,0 +1,96 @@
+"""
+Benchmark for HTTP response compression.
+
+Reports bytes on the wire and CPU cost per response for every supported
+content coding: once for the precompressed static assets under `static/`
+(a one-time cost at startup) and once for a JSON table preview of the
+given size, compressed per request by `CompressionMiddleware` settings.
+
+Usage:
+    python benchmarks/bench_http_compression.py --rows 1000
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+# Add project root to path to allow imports
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from core.http_compression import CODINGS, CompressionMiddleware, _StreamCompressor
+from core.static_assets import StaticAssets
+
+
+def timed(func, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def make_preview(rows: int) -> bytes:
+    rng = np.random.default_rng(42)
+    records = [
+        {
+            "id": i,
+            "amount": round(float(rng.normal(1000, 250)), 2),
+            "city": str(rng.choice(["Moscow", "Kazan", "Tver", "Omsk", "Perm"])),
+            "created": f"2024-01-{i % 28 + 1:02d}T12:00:00",
+        }
+        for i in range(rows)
+    ]
+    columns = list(records[0])
+    return json.dumps(
+        {"preview": records, "columns": columns, "total_rows": rows}
+    ).encode()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    static_dir = os.path.join(os.path.dirname(__file__), "..", "static")
+    start = time.perf_counter()
+    assets = StaticAssets(directory=static_dir)
+    load_time = time.perf_counter() - start
+
+    print(f"Static assets (precompressed at startup in {load_time * 1000:.1f} ms)\n")
+    totals = dict.fromkeys((None, *CODINGS), 0)
+    print(f"{'asset':<22}" + "".join(f"{c or 'identity':>12}" for c in totals))
+    for path, asset in sorted(assets.assets.items()):
+        sizes = {
+            c: len(asset.variants.get(c, asset.variants[None]).body) for c in totals
+        }
+        for coding, size in sizes.items():
+            totals[coding] += size
+        print(f"{path:<22}" + "".join(f"{sizes[c]:>12}" for c in totals))
+    print(f"{'total':<22}" + "".join(f"{totals[c]:>12}" for c in totals))
+
+    defaults = CompressionMiddleware(app=None)
+    body = make_preview(args.rows)
+    print(f"\nJSON preview: {args.rows} rows, {len(body)} bytes\n")
+    print(f"{'coding':<10}{'bytes':>10}{'ratio':>8}{'ms/response':>14}")
+    print(f"{'identity':<10}{len(body):>10}{1:>8.2f}{0:>14.3f}")
+    for coding in CODINGS:
+
+        def run():
+            compressor = _StreamCompressor(
+                coding, defaults.gzip_level, defaults.brotli_quality
+            )
+            return compressor(body, final=True)
+
+        size = len(run())
+        elapsed = timed(run, args.repeat)
+        print(f"{coding:<10}{size:>10}{len(body) / size:>8.2f}{elapsed * 1000:>14.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,470 @@
+"""
+Load test of the full application with simulated users.
+
+Virtual users replay the flows of the web UI (`static/js/main.js`,
+`settings.js`) in a loop for `--duration` seconds:
+- browse: log in, load the page, the profile, the avatar, the table list
+  and the preview of a stored table
+- tables: preview an upload, upload it, list, preview, rename, delete
+- settings: load the page and profile, check a username, upload and
+  delete an avatar
+
+Each configuration runs against a fresh uvicorn server with an empty
+temporary database and uploads directory (or `--url` for a running
+server, or `--asgi` in-process without networking). Latency percentiles,
+requests per second and error rates are reported per step and in total.
+
+Configurations to compare are given as `name:KEY=VALUE,...`, where keys
+are application settings (environment variables) plus WORKERS for the
+uvicorn worker count.
+
+Usage:
+    python benchmarks/bench_load.py --users 20 --duration 30
+    python benchmarks/bench_load.py --users 50 --config 1w:WORKERS=1 --config 4w:WORKERS=4
+    python benchmarks/bench_load.py --config cache:WORKERS=1 --config nocache:AVATAR_CACHE_SIZE=0
+    python benchmarks/bench_load.py --url http://127.0.0.1:8000 --scenarios browse
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+
+import httpx
+
+APP_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# Add project root to path to allow imports
+sys.path.insert(0, APP_DIR)
+
+API = "/api/v1"
+PASSWORD = "loadtest-password"
+SCENARIOS = ("browse", "tables", "settings")
+# Relative frequency of the scenarios, browsing dominates real traffic
+DEFAULT_WEIGHTS = {"browse": 6, "tables": 2, "settings": 1}
+
+
+class Stats:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+
+    def record(self, step: str, latency: float, ok: bool) -> None:
+        self.latencies[step].append(latency)
+        if not ok:
+            self.errors[step] += 1
+
+    def summary(self, elapsed: float) -> dict:
+        steps = {
+            name: self._summarize(values, self.errors[name], elapsed)
+            for name, values in sorted(self.latencies.items())
+        }
+        everything = [value for values in self.latencies.values() for value in values]
+        total = self._summarize(everything, sum(self.errors.values()), elapsed)
+        return {"total": total, "steps": steps}
+
+    @staticmethod
+    def _summarize(values: List[float], errors: int, elapsed: float) -> dict:
+        if not values:
+            return {"requests": 0, "errors": 0}
+        ordered = sorted(values)
+
+        def percentile(p: float) -> float:
+            return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+        return {
+            "requests": len(values),
+            "errors": errors,
+            "error_rate": errors / len(values),
+            "rps": len(values) / elapsed,
+            "mean": statistics.fmean(values),
+            "p50": percentile(50),
+            "p95": percentile(95),
+            "p99": percentile(99),
+        }
+
+
+def make_csv(rows: int) -> bytes:
+    lines = ["id,city,amount,created"]
+    cities = ["Moscow", "Kazan", "Tver", "Omsk", "Perm"]
+    for i in range(rows):
+        lines.append(f"{i},{cities[i % 5]},{i * 1.5:.2f},2024-01-{i % 28 + 1:02d}")
+    return ("\n".join(lines) + "\n").encode()
+
+
+def make_avatar() -> bytes:
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (400, 400), (40, 120, 200)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class VirtualUser:
+    def __init__(
+        self, client: httpx.AsyncClient, stats: Stats, index: int, files: dict
+    ):
+        self.client = client
+        self.stats = stats
+        self.username = f"load{index}_{uuid.uuid4().hex[:6]}"
+        self.files = files
+        self.headers: Dict[str, str] = {}
+        self.avatar_url: Optional[str] = None
+        self.table_id: Optional[int] = None
+
+    async def request(
+        self, step: str, method: str, url: str, **kwargs
+    ) -> Optional[httpx.Response]:
+        start = time.perf_counter()
+        try:
+            response = await self.client.request(
+                method, url, headers=self.headers, **kwargs
+            )
+        except httpx.HTTPError:
+            self.stats.record(step, time.perf_counter() - start, ok=False)
+            return None
+        self.stats.record(
+            step, time.perf_counter() - start, ok=response.status_code < 400
+        )
+        return response
+
+    async def register(self) -> None:
+        await self.request(
+            "register",
+            "POST",
+            f"{API}/users/register",
+            json={"username": self.username, "password": PASSWORD},
+        )
+        await self.login()
+        # A stored table for the browse scenario to preview
+        response = await self.upload_table("seed")
+        if response is not None and response.status_code == 201:
+            self.table_id = response.json()["id"]
+
+    async def login(self) -> None:
+        self.headers = {}
+        response = await self.request(
+            "login",
+            "POST",
+            f"{API}/users/login/access-token",
+            data={"username": self.username, "password": PASSWORD},
+        )
+        if response is not None and response.status_code == 200:
+            self.headers = {
+                "Authorization": f"Bearer {response.json()['access_token']}"
+            }
+
+    async def me(self) -> None:
+        response = await self.request("me", "GET", f"{API}/users/me")
+        if response is not None and response.status_code == 200:
+            self.avatar_url = response.json()["avatar_url"]
+
+    async def upload_table(self, prefix: str) -> Optional[httpx.Response]:
+        name = f"{prefix}_{uuid.uuid4().hex[:8]}"
+        return await self.request(
+            "upload",
+            "POST",
+            f"{API}/tables/upload",
+            files={"file": (f"{name}.csv", self.files["csv"], "text/csv")},
+        )
+
+    async def browse(self) -> None:
+        await self.login()
+        await self.request("page", "GET", "/queries")
+        await self.me()
+        if self.avatar_url:
+            await self.request("avatar", "GET", self.avatar_url, params={"size": 72})
+        await self.request("list tables", "GET", f"{API}/tables/")
+        if self.table_id is not None:
+            await self.request(
+                "table preview", "GET", f"{API}/tables/{self.table_id}/preview"
+            )
+
+    async def tables(self) -> None:
+        await self.request(
+            "upload preview",
+            "POST",
+            f"{API}/tables/preview",
+            files={"file": ("preview.csv", self.files["csv"], "text/csv")},
+            data={"preview_rows": "10"},
+        )
+        response = await self.upload_table("load")
+        if response is None or response.status_code != 201:
+            return
+        table_id = response.json()["id"]
+        await self.request("list tables", "GET", f"{API}/tables/")
+        await self.request("table preview", "GET", f"{API}/tables/{table_id}/preview")
+        await self.request(
+            "rename",
+            "PUT",
+            f"{API}/tables/{table_id}",
+            json={"table_name": f"renamed_{uuid.uuid4().hex[:8]}"},
+        )
+        await self.request("delete", "DELETE", f"{API}/tables/{table_id}")
+
+    async def settings(self) -> None:
+        await self.request("page", "GET", "/settings")
+        await self.me()
+        await self.request(
+            "check username",
+            "GET",
+            f"{API}/users/check-username",
+            params={"username": f"free_{uuid.uuid4().hex[:8]}"},
+        )
+        await self.request(
+            "avatar upload",
+            "PUT",
+            f"{API}/users/me/avatar",
+            files={"file": ("avatar.png", self.files["avatar"], "image/png")},
+        )
+        await self.me()
+        await self.request("avatar delete", "DELETE", f"{API}/users/me/avatar")
+
+    async def run(self, deadline: float, weights: Dict[str, int]) -> None:
+        names, counts = zip(*weights.items())
+        while time.perf_counter() < deadline:
+            scenario = random.choices(names, counts)[0]
+            await getattr(self, scenario)()
+
+
+async def run_load(client: httpx.AsyncClient, args, weights: Dict[str, int]) -> dict:
+    files = {"csv": make_csv(args.table_rows), "avatar": make_avatar()}
+    users = [VirtualUser(client, Stats(), i, files) for i in range(args.users)]
+    # Registration is setup, it is not part of the measured load
+    await asyncio.gather(*(user.register() for user in users))
+
+    stats = Stats()
+    for user in users:
+        user.stats = stats
+
+    async def start(user: VirtualUser, delay: float, deadline: float) -> None:
+        await asyncio.sleep(delay)
+        await user.run(deadline, weights)
+
+    begin = time.perf_counter()
+    deadline = begin + args.duration
+    await asyncio.gather(
+        *(
+            start(user, args.ramp_up * i / args.users, deadline)
+            for i, user in enumerate(users)
+        )
+    )
+    return stats.summary(time.perf_counter() - begin)
+
+
+def make_workdir(tmp: str) -> None:
+    """
+    Working directory for the server. Stored file paths double as URLs
+    under /uploads, so uploads stay in `./uploads` of the temporary
+    directory; static files and templates are linked from the project.
+    """
+    for name in ("static", "templates"):
+        os.symlink(os.path.join(APP_DIR, name), os.path.join(tmp, name))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@asynccontextmanager
+async def local_server(overrides: Dict[str, str]):
+    """Starts uvicorn on a fresh database; yields its base URL."""
+    overrides = dict(overrides)
+    workers = overrides.pop("WORKERS", "1")
+    with tempfile.TemporaryDirectory() as tmp:
+        make_workdir(tmp)
+        env = {
+            **os.environ,
+            "DATABASE_URL": f"sqlite:///{os.path.join(tmp, 'load.db')}",
+            "DB_MIGRATIONS": "check",
+            **overrides,
+        }
+        # Migrate once up front, workers only check the revision
+        subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                "from db import migrations; from db.session import engine; "
+                "migrations.upgrade(engine)",
+            ],
+            cwd=APP_DIR,
+            env=env,
+            check=True,
+        )
+        port = free_port()
+        server = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "uvicorn",
+                "main:app",
+                "--app-dir",
+                APP_DIR,
+                "--port",
+                str(port),
+                "--workers",
+                workers,
+                "--log-level",
+                "warning",
+                "--no-access-log",
+            ],
+            cwd=tmp,
+            env=env,
+        )
+        url = f"http://127.0.0.1:{port}"
+        try:
+            async with httpx.AsyncClient(base_url=url) as probe:
+                for _ in range(200):
+                    try:
+                        await probe.get("/login")
+                        break
+                    except httpx.TransportError:
+                        await asyncio.sleep(0.1)
+                else:
+                    raise RuntimeError("uvicorn did not start")
+            yield url
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+
+
+@asynccontextmanager
+async def asgi_client(overrides: Dict[str, str]):
+    """In-process client; settings are read once, so this is single-config only."""
+    tmp = tempfile.mkdtemp()
+    make_workdir(tmp)
+    os.chdir(tmp)
+    os.environ.update(
+        {
+            "DATABASE_URL": f"sqlite:///{os.path.join(tmp, 'load.db')}",
+            "DB_MIGRATIONS": "upgrade",
+            **overrides,
+        }
+    )
+    import main
+
+    async with main.app.router.lifespan_context(main.app):
+        # Unhandled errors count as 500 responses, like behind a server
+        transport = httpx.ASGITransport(app=main.app, raise_app_exceptions=False)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://load"
+        ) as client:
+            yield client
+
+
+async def run_config(name: str, overrides: Dict[str, str], args, weights) -> dict:
+    limits = httpx.Limits(max_connections=args.users)
+    timeout = httpx.Timeout(args.timeout)
+    if args.asgi:
+        async with asgi_client(overrides) as client:
+            return await run_load(client, args, weights)
+    if args.url:
+        async with httpx.AsyncClient(
+            base_url=args.url, limits=limits, timeout=timeout
+        ) as client:
+            return await run_load(client, args, weights)
+    async with local_server(overrides) as url:
+        async with httpx.AsyncClient(
+            base_url=url, limits=limits, timeout=timeout
+        ) as client:
+            return await run_load(client, args, weights)
+
+
+def parse_config(value: str):
+    name, _, assignments = value.partition(":")
+    overrides = dict(item.split("=", 1) for item in assignments.split(",") if item)
+    return name, overrides
+
+
+def print_summary(name: str, summary: dict) -> None:
+    print(f"\n== {name}")
+    print(
+        f"{'step':<18}{'requests':>10}{'errors':>8}{'rps':>9}"
+        f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+    )
+    rows = list(summary["steps"].items()) + [("TOTAL", summary["total"])]
+    for step, result in rows:
+        if not result["requests"]:
+            continue
+        print(
+            f"{step:<18}{result['requests']:>10}{result['errors']:>8}{result['rps']:>9.1f}"
+            f"{result['p50'] * 1000:>9.1f}{result['p95'] * 1000:>9.1f}"
+            f"{result['p99'] * 1000:>9.1f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--users", type=int, default=10, help="concurrent virtual users"
+    )
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds of load")
+    parser.add_argument(
+        "--ramp-up", type=float, default=2.0, help="seconds to start all users"
+    )
+    parser.add_argument(
+        "--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS)
+    )
+    parser.add_argument(
+        "--table-rows", type=int, default=1000, help="rows of uploaded CSVs"
+    )
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument(
+        "--config",
+        action="append",
+        default=[],
+        help="name:KEY=VALUE,... (settings as env vars, WORKERS for uvicorn)",
+    )
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--url", help="load an already running server instead")
+    target.add_argument("--asgi", action="store_true", help="run the app in-process")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    configs = [parse_config(value) for value in args.config] or [("default", {})]
+    if (args.url or args.asgi) and len(configs) > 1:
+        parser.error("comparing configurations needs locally started servers")
+    weights = {name: DEFAULT_WEIGHTS[name] for name in args.scenarios}
+
+    results = {}
+    for name, overrides in configs:
+        results[name] = asyncio.run(run_config(name, overrides, args, weights))
+        print_summary(name, results[name])
+
+    if len(results) > 1:
+        print(
+            f"\n{'config':<18}{'rps':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>9}"
+        )
+        for name, summary in results.items():
+            total = summary["total"]
+            print(
+                f"{name:<18}{total['rps']:>9.1f}{total['p50'] * 1000:>9.1f}"
+                f"{total['p95'] * 1000:>9.1f}{total['p99'] * 1000:>9.1f}"
+                f"{total['error_rate']:>9.1%}"
+            )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {"users": args.users, "duration": args.duration, "results": results},
+                f,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Benchmark for application startup.
+
+Every run starts a fresh interpreter and measures the import of `main`, the
+lifespan startup (schema creation, background queue) and the latency of the
+first requests, including the ones that pull in lazily imported Pillow and
+pandas. `--eager` imports those dependencies up front, as the application
+did before they were made lazy, for comparison.
+
+Usage:
+    python benchmarks/bench_startup.py --runs 5
+    python benchmarks/bench_startup.py --runs 5 --eager
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+APP_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+PROBE = """
+import json, sys, time
+sys.path.insert(0, {app_dir!r})
+timings = {{}}
+start = time.perf_counter()
+if {eager!r}:
+    import numpy, pandas, PIL.Image
+import main
+timings["import"] = time.perf_counter() - start
+
+from fastapi.testclient import TestClient
+
+start = time.perf_counter()
+with TestClient(main.app) as client:
+    timings["lifespan startup"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    client.get("/login")
+    timings["first page"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    client.get("/uploads/avatars/default/0041-1a2b3c.png")
+    timings["first avatar (Pillow)"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    from services import table_dtypes
+    table_dtypes.pd.DataFrame({{"a": [1, 2]}})
+    timings["first DataFrame (pandas)"] = time.perf_counter() - start
+print(json.dumps(timings))
+"""
+
+
+def run_once(eager: bool, database_url: str) -> dict:
+    env = {**os.environ, "DATABASE_URL": database_url, "DB_MIGRATIONS": "upgrade"}
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE.format(app_dir=APP_DIR, eager=eager)],
+        cwd=APP_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument(
+        "--eager", action="store_true", help="import pandas/numpy/Pillow up front"
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database_url = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        runs = [run_once(args.eager, database_url) for _ in range(args.runs)]
+
+    mode = "eager" if args.eager else "lazy"
+    print(f"Startup ({mode} heavy imports), median of {args.runs} runs\n")
+    print(f"{'phase':<28}{'ms':>10}")
+    for phase in runs[0]:
+        median = statistics.median(run[phase] for run in runs)
+        print(f"{phase:<28}{median * 1000:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,329 @@
+"""
+Benchmark suite for the table ingest and preview hot paths.
+
+Generates synthetic CSV/XLSX tables (seeded, so every run sees the same
+bytes) in narrow and wide shapes and measures, for each of them:
+- upload: `table_service.process_and_save_table` (store file + DB row)
+- preview_upload: `table_service.get_preview_from_upload`
+- process: `table_processing.process_table` (the background pipeline)
+- load: `table_service.load_table_dataframe` from the columnar snapshot
+- preview: `table_service.get_table_preview`
+
+Every case runs in a fresh interpreter against a temporary database and
+uploads directory, so peak RSS and caches are not shared between cases.
+Results (best and median latency, rows/s, MB/s, peak RSS per operation)
+are written as JSON; `--compare` checks them against a previous run and
+exits with status 1 on regressions above `--threshold`.
+
+Usage:
+    python benchmarks/bench_tables.py --rows 1000 100000 --output base.json
+    python benchmarks/bench_tables.py --rows 1000 100000 --compare base.json
+    python benchmarks/bench_tables.py --rows 10000000 --shapes narrow --formats csv
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+APP_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# Add project root to path to allow imports
+sys.path.insert(0, APP_DIR)
+
+SHAPES = ("narrow", "wide")
+FORMATS = ("csv", "xlsx")
+# Excel sheets hold at most 2**20 rows including the header
+XLSX_MAX_ROWS = 2**20 - 1
+WIDE_COLUMNS = 100
+
+
+def make_frame(shape: str, rows: int):
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(42)
+    if shape == "narrow":
+        return pd.DataFrame(
+            {
+                "id": np.arange(rows),
+                "amount": rng.normal(1000, 250, rows).round(2),
+                "quantity": rng.integers(0, 500, rows),
+                "city": rng.choice(["Moscow", "Kazan", "Tver", "Omsk", "Perm"], rows),
+                "created": pd.Timestamp("2024-01-01")
+                + pd.to_timedelta(rng.integers(0, 365, rows), unit="D"),
+            }
+        )
+    columns = {}
+    for i in range(WIDE_COLUMNS):
+        if i % 4 == 0:
+            columns[f"label_{i}"] = rng.choice(["a", "b", "c", "d"], rows)
+        elif i % 4 == 1:
+            columns[f"count_{i}"] = rng.integers(0, 1000, rows)
+        else:
+            columns[f"value_{i}"] = rng.random(rows).round(4)
+    return pd.DataFrame(columns)
+
+
+def data_file(data_dir: str, shape: str, file_format: str, rows: int) -> str:
+    """Generates the input file once; later runs reuse it."""
+    path = os.path.join(data_dir, f"{shape}_{rows}.{file_format}")
+    if not os.path.exists(path):
+        df = make_frame(shape, rows)
+        # pandas picks the writer by extension, so it has to stay last
+        tmp_path = os.path.join(data_dir, f".partial_{shape}_{rows}.{file_format}")
+        if file_format == "csv":
+            df.to_csv(tmp_path, index=False)
+        else:
+            df.to_excel(tmp_path, index=False, engine="xlsxwriter")
+        os.replace(tmp_path, path)
+    return path
+
+
+class PeakRSS:
+    """Highest resident set size seen while the block runs, in bytes."""
+
+    interval = 0.005
+
+    def __init__(self):
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @staticmethod
+    def current() -> int:
+        try:
+            with open("/proc/self/statm") as statm:
+                return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except OSError:
+            # No procfs: fall back to the process high-water mark
+            scale = 1 if sys.platform == "darwin" else 1024
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, self.current())
+
+    def __enter__(self) -> "PeakRSS":
+        self.peak = self.current()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.current())
+
+
+async def measure(operation, repeat: int, setup=None) -> dict:
+    timings = []
+    with PeakRSS() as rss:
+        for i in range(repeat):
+            args = setup(i) if setup else ()
+            start = time.perf_counter()
+            await operation(*args)
+            timings.append(time.perf_counter() - start)
+    return {
+        "best": min(timings),
+        "median": statistics.median(timings),
+        "peak_rss": rss.peak,
+    }
+
+
+async def run_case(path: str, rows: int, repeat: int) -> dict:
+    """Runs all operations for one input file. Executed in a child process."""
+    from starlette.datastructures import UploadFile
+
+    from db.base import Base
+    from db.session import SessionLocal, engine
+    from features.tables.models import Table
+    from features.users.models import User
+    from services import table_processing, table_service
+
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    user = User(username="bench", hashed_password="-")
+    db.add(user)
+    db.commit()
+    filename = os.path.basename(path)
+    table_ids = []
+
+    def upload_file(i):
+        return (UploadFile(open(path, "rb"), filename=filename),)
+
+    async def upload(file):
+        table = await table_service.process_and_save_table(
+            db, file=file, user=user, custom_table_name=f"bench_{len(table_ids)}"
+        )
+        table_ids.append(table.id)
+
+    async def preview_upload(file):
+        try:
+            await table_service.get_preview_from_upload(file)
+        finally:
+            file.file.close()
+
+    async def process(table_id):
+        await table_processing.process_table(table_id)
+
+    async def load():
+        table = table_service.get_user_table_or_404(db, table_ids[0], user.id)
+        await table_service.load_table_dataframe(table)
+
+    async def preview():
+        db.expire_all()
+        await table_service.get_table_preview(db, table_ids[0], user.id)
+
+    results = {
+        "upload": await measure(upload, repeat, upload_file),
+        "preview_upload": await measure(preview_upload, repeat, upload_file),
+        # Each repetition processes a different uploaded copy
+        "process": await measure(process, repeat, lambda i: (table_ids[i],)),
+    }
+    table = db.get(Table, table_ids[0])
+    db.refresh(table)
+    if table.processing_status != "ready":
+        raise RuntimeError(f"Processing failed for {filename}")
+    results["load"] = await measure(load, repeat)
+    results["preview"] = await measure(preview, repeat)
+    db.close()
+
+    size = os.path.getsize(path)
+    for result in results.values():
+        result["rows_per_s"] = rows / result["median"]
+        result["mb_per_s"] = size / 2**20 / result["median"]
+    return results
+
+
+def run_in_child(path: str, rows: int, repeat: int) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {
+            **os.environ,
+            "DATABASE_URL": f"sqlite:///{os.path.join(tmp, 'bench.db')}",
+            "UPLOADS_DIR": os.path.join(tmp, "uploads"),
+            "STORAGE_BACKEND": "local",
+        }
+        result = subprocess.run(
+            [sys.executable, __file__, "--case", path, str(rows), str(repeat)],
+            cwd=APP_DIR,
+            env=env,
+            capture_output=True,
+            text=True,
+        )
+    if result.returncode != 0:
+        raise RuntimeError(f"{os.path.basename(path)} failed:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def git_commit() -> str:
+    result = subprocess.run(
+        ["git", "rev-parse", "--short", "HEAD"],
+        cwd=APP_DIR,
+        capture_output=True,
+        text=True,
+    )
+    return result.stdout.strip() or "unknown"
+
+
+def case_key(result: dict) -> tuple:
+    return result["shape"], result["format"], result["rows"], result["operation"]
+
+
+def compare(results: list, baseline_path: str, threshold: float) -> int:
+    with open(baseline_path) as f:
+        baseline = {case_key(result): result for result in json.load(f)["results"]}
+    regressions = 0
+    # Best-of-N latency is compared, it is far less noisy than the median
+    print(f"\nComparison with {baseline_path} (best latency, peak RSS)")
+    print(f"{'case':<40}{'time':>10}{'rss':>10}")
+    for result in results:
+        base = baseline.get(case_key(result))
+        if base is None:
+            continue
+        time_ratio = result["best"] / base["best"]
+        rss_ratio = result["peak_rss"] / base["peak_rss"]
+        regressed = time_ratio > 1 + threshold or rss_ratio > 1 + threshold
+        regressions += regressed
+        name = "/".join(str(part) for part in case_key(result))
+        flag = "  REGRESSION" if regressed else ""
+        print(f"{name:<40}{time_ratio:>9.2f}x{rss_ratio:>9.2f}x{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, nargs="+", default=[1_000, 100_000])
+    parser.add_argument("--shapes", nargs="+", choices=SHAPES, default=list(SHAPES))
+    parser.add_argument("--formats", nargs="+", choices=FORMATS, default=list(FORMATS))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--data-dir",
+        default=os.path.join(tempfile.gettempdir(), "bench_tables"),
+        help="where generated input files are cached between runs",
+    )
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--compare", help="JSON results of a previous run")
+    parser.add_argument(
+        "--threshold", type=float, default=0.1, help="allowed slowdown, 0.1 = 10%%"
+    )
+    parser.add_argument("--case", nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        path, rows, repeat = args.case
+        print(json.dumps(asyncio.run(run_case(path, int(rows), int(repeat)))))
+        return
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    results = []
+    print(f"{'case':<40}{'median ms':>12}{'rows/s':>14}{'MB/s':>10}{'RSS MB':>10}")
+    for file_format in args.formats:
+        for shape in args.shapes:
+            for rows in args.rows:
+                if file_format == "xlsx" and rows > XLSX_MAX_ROWS:
+                    print(f"{shape}/xlsx/{rows}: skipped, exceeds the sheet limit")
+                    continue
+                path = data_file(args.data_dir, shape, file_format, rows)
+                for operation, result in run_in_child(path, rows, args.repeat).items():
+                    result = {
+                        "shape": shape,
+                        "format": file_format,
+                        "rows": rows,
+                        "operation": operation,
+                        **result,
+                    }
+                    results.append(result)
+                    name = "/".join(str(part) for part in case_key(result))
+                    print(
+                        f"{name:<40}{result['median'] * 1000:>12.1f}"
+                        f"{result['rows_per_s']:>14,.0f}{result['mb_per_s']:>10.1f}"
+                        f"{result['peak_rss'] / 2**20:>10.1f}"
+                    )
+
+    if args.output:
+        report = {
+            "meta": {
+                "commit": git_commit(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "repeat": args.repeat,
+            },
+            "results": results,
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare and compare(results, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 from pydantic_settings import BaseSettings, SettingsConfigDict
+from typing import Optional
 import os
 
 
@@ -9,9 +10,63 @@ class Settings(BaseSettings):
 
     # Use aiosqlite for async support
     DATABASE_URL: str = "sqlite+aiosqlite:///./sql_app.db"
+    # Schema migrations on startup: "check" (fail unless at the head
+    # revision), "upgrade" (apply pending revisions) or "off"
+    DB_MIGRATIONS: str = "check"
 
     UPLOADS_DIR: str = "uploads"
     AVATARS_DIR: str = os.path.join(UPLOADS_DIR, "avatars")
+    # At-rest compression for uploaded CSV tables: "gzip", "zstd" or None
+    TABLES_COMPRESSION: Optional[str] = None
+
+    # File storage backend: "local" (UPLOADS_DIR) or "s3"
+    STORAGE_BACKEND: str = "local"
+    S3_ENDPOINT_URL: Optional[str] = None
+    S3_BUCKET: str = "uploads"
+    S3_ACCESS_KEY: Optional[str] = None
+    S3_SECRET_KEY: Optional[str] = None
+    S3_REGION: str = "us-east-1"
+
+    # Background processing of uploaded tables
+    TABLE_PROCESSING_CONCURRENCY: int = 2
+    TABLE_PROCESSING_QUEUE_SIZE: int = 1000
+
+    # In-memory cache of typed DataFrames used by table queries, in bytes
+    TABLE_CACHE_SIZE: int = 256 * 1024 * 1024
+    # Most rows a single table query may return
+    TABLE_QUERY_MAX_ROWS: int = 10_000
+
+    # Pending storage intents younger than this (seconds) may belong to
+    # uploads still in flight and are left alone by the sync tool
+    STORAGE_JOURNAL_GRACE_PERIOD: int = 3600
+
+    # Re-read HTML templates and static files when they change (development)
+    TEMPLATES_AUTO_RELOAD: bool = False
+
+    # JSON responses at least this large are compressed (gzip or brotli)
+    COMPRESSION_MINIMUM_SIZE: int = 1024
+
+    # Request, database and cache metrics in Prometheus format at GET /metrics
+    METRICS_ENABLED: bool = True
+    # Statements slower than this (seconds) are logged with redacted parameters
+    DB_SLOW_QUERY_THRESHOLD: float = 0.1
+    # A statement run this many times in one request is logged as a likely N+1
+    DB_REPEATED_STATEMENT_THRESHOLD: int = 10
+
+    # Sampling profiler for superuser requests with an `X-Profile` header or
+    # picked at random with PROFILING_SAMPLE_RATE; results at /api/v1/admin/profiles
+    PROFILING_ENABLED: bool = False
+    PROFILING_SAMPLE_RATE: float = 0.0
+    PROFILING_INTERVAL: float = 0.005
+    PROFILING_MAX_PROFILES: int = 20
+    # `X-Profile: <token>` is honoured without a superuser bearer token
+    PROFILING_TOKEN: Optional[str] = None
+
+    # In-memory cache of rendered and resized avatars, in bytes
+    AVATAR_CACHE_SIZE: int = 32 * 1024 * 1024
+    # Limits for uploaded avatars, checked before the image is decoded
+    AVATAR_MAX_BYTES: int = 10 * 1024 * 1024
+    AVATAR_MAX_PIXELS: int = 40_000_000
     TEST_DATABASE_URL: str = "sqlite:///./test.db"
     ALGORITHM: str = "HS256"
 
@@ -9,7 +9,7 @@ from sqlalchemy.orm import Session
 from core.config import settings
 from features.users import crud as users_crud
 from features.users.models import User
-from db.session import get_db
+from db.session import SessionLocal, get_db
 from features.users.schemas import TokenData
 
 
@@ -58,3 +58,24 @@ def get_current_active_superuser(
             status_code=403, detail="The user doesn't have enough privileges"
         )
     return current_user
+
+
+def is_superuser_token(token: str) -> bool:
+    """
+    Whether a bearer token belongs to an active superuser. For code outside
+    of the dependency system, such as middleware; blocking.
+    """
+    try:
+        payload = jwt.decode(
+            token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM]
+        )
+        user_id = int(TokenData(**payload).sub)
+    except (jwt.JWTError, ValidationError, ValueError, TypeError):
+        return False
+    with SessionLocal() as db:
+        user = users_crud.user.get(db, id=user_id)
+        return (
+            user is not None
+            and users_crud.user.is_active(user)
+            and users_crud.user.is_superuser(user)
+        )
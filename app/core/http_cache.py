@@ -0,0 +1,40 @@
+import hashlib
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Optional
+
+# For URLs whose content never changes (the name carries a hash or a uuid)
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def make_etag(body: bytes) -> str:
+    """Strong ETag derived from the response body."""
+    return f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Evaluates an `If-None-Match` header against the current ETag.
+    The comparison is weak, as RFC 9110 requires for this header.
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = (tag.strip() for tag in if_none_match.split(","))
+    return etag.removeprefix("W/") in (tag.removeprefix("W/") for tag in candidates)
+
+
+def http_date(timestamp: float) -> str:
+    return formatdate(timestamp, usegmt=True)
+
+
+def not_modified_since(if_modified_since: Optional[str], timestamp: float) -> bool:
+    """Evaluates an `If-Modified-Since` header against a modification time."""
+    if not if_modified_since:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    # HTTP dates have a one-second resolution
+    return int(timestamp) <= since.timestamp()
@@ -0,0 +1,196 @@
+"""
+HTTP response compression.
+
+Static assets and pages are compressed once, when they are loaded, into
+per-coding variants (`precompress`) and picked by content negotiation.
+Dynamic JSON responses go through `CompressionMiddleware`, a pure ASGI
+middleware that compresses incrementally and flushes every chunk, so
+streaming responses keep streaming.
+
+Brotli is used when the optional `brotli` package is installed, gzip
+otherwise.
+"""
+
+import gzip
+import zlib
+from typing import Dict, Iterable, NamedTuple, Optional, Tuple
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from core.http_cache import make_etag
+
+try:
+    import brotli
+except ImportError:  # brotli is an optional dependency
+    brotli = None
+
+# Preferred content codings, best first
+CODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+COMPRESSIBLE_MEDIA_TYPES = (
+    "application/javascript",
+    "application/json",
+    "image/svg+xml",
+)
+JSON_MEDIA_TYPES = ("application/json",)
+
+
+def is_compressible(media_type: str) -> bool:
+    media_type = media_type.split(";")[0].strip().lower()
+    return media_type.startswith("text/") or media_type in COMPRESSIBLE_MEDIA_TYPES
+
+
+def accepts_encoding(accept_encoding: Optional[str], coding: str) -> bool:
+    """Checks whether `Accept-Encoding` allows a content coding (q > 0)."""
+    for item in (accept_encoding or "").split(","):
+        name, _, params = item.partition(";")
+        if name.strip().lower() in (coding, "*"):
+            q = params.strip().removeprefix("q=")
+            try:
+                return not params.strip() or float(q) > 0
+            except ValueError:
+                return False
+    return False
+
+
+def choose_encoding(
+    accept_encoding: Optional[str], available: Iterable[str] = CODINGS
+) -> Optional[str]:
+    """Best content coding accepted by the client, or None for identity."""
+    for coding in CODINGS:
+        if coding in available and accepts_encoding(accept_encoding, coding):
+            return coding
+    return None
+
+
+def gzip_compress(body: bytes) -> bytes:
+    """Deterministic gzip (no timestamp), so equal inputs give equal ETags."""
+    return gzip.compress(body, compresslevel=9, mtime=0)
+
+
+def compress(body: bytes, coding: str) -> bytes:
+    """Compresses a whole body ahead of time, with the strongest settings."""
+    if coding == "br":
+        return brotli.compress(body, quality=11)
+    return gzip_compress(body)
+
+
+class Variant(NamedTuple):
+    body: bytes
+    etag: str
+
+
+def precompress(body: bytes, media_type: str) -> Dict[Optional[str], Variant]:
+    """
+    Builds the identity variant of a body and, for compressible media types,
+    a variant per supported coding that is actually smaller.
+    """
+    variants = {None: Variant(body, make_etag(body))}
+    if is_compressible(media_type):
+        for coding in CODINGS:
+            compressed = compress(body, coding)
+            if len(compressed) < len(body):
+                variants[coding] = Variant(compressed, make_etag(compressed))
+    return variants
+
+
+def negotiate(
+    variants: Dict[Optional[str], Variant], accept_encoding: Optional[str]
+) -> Tuple[Optional[str], Variant]:
+    coding = choose_encoding(accept_encoding, [c for c in variants if c])
+    return coding, variants[coding]
+
+
+class _StreamCompressor:
+    def __init__(self, coding: str, gzip_level: int, brotli_quality: int):
+        if coding == "br":
+            self._brotli = brotli.Compressor(quality=brotli_quality)
+        else:
+            self._brotli = None
+            self._zlib = zlib.compressobj(gzip_level, zlib.DEFLATED, 31)
+
+    def __call__(self, data: bytes, final: bool) -> bytes:
+        if self._brotli is not None:
+            out = self._brotli.process(data)
+            return out + (self._brotli.finish() if final else self._brotli.flush())
+        out = self._zlib.compress(data)
+        return out + self._zlib.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+
+class CompressionMiddleware:
+    """
+    Compresses responses of the given media types (JSON by default) when the
+    body is at least `minimum_size` bytes or is streamed. Responses that
+    already carry a Content-Encoding are passed through untouched.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: int = 1024,
+        media_types: Tuple[str, ...] = JSON_MEDIA_TYPES,
+        gzip_level: int = 6,
+        brotli_quality: int = 4,
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.media_types = media_types
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        coding = choose_encoding(Headers(scope=scope).get("accept-encoding"))
+        if coding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start: Optional[Message] = None
+        compressor: Optional[_StreamCompressor] = None
+
+        async def send_compressed(message: Message) -> None:
+            nonlocal start, compressor
+            if message["type"] == "http.response.start":
+                # Headers are held back until the first body chunk shows
+                # whether the response is worth compressing
+                start = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if start is not None:
+                headers = MutableHeaders(scope=start)
+                media_type = headers.get("content-type", "").split(";")[0].strip()
+                if (
+                    media_type in self.media_types
+                    and "content-encoding" not in headers
+                    and (more_body or len(body) >= self.minimum_size)
+                ):
+                    compressor = _StreamCompressor(
+                        coding, self.gzip_level, self.brotli_quality
+                    )
+                    body = compressor(body, final=not more_body)
+                    headers["Content-Encoding"] = coding
+                    headers.add_vary_header("Accept-Encoding")
+                    etag = headers.get("etag")
+                    if etag and not etag.startswith("W/"):
+                        # The compressed bytes differ, so the tag is only weak
+                        headers["ETag"] = f"W/{etag}"
+                    if more_body:
+                        del headers["Content-Length"]
+                    else:
+                        headers["Content-Length"] = str(len(body))
+                    message = {**message, "body": body}
+                await send(start)
+                start = None
+            elif compressor is not None:
+                message = {**message, "body": compressor(body, final=not more_body)}
+            await send(message)
+
+        await self.app(scope, receive, send_compressed)
@@ -0,0 +1,39 @@
+import importlib
+import sys
+import types
+
+
+class LazyModule(types.ModuleType):
+    """
+    Placeholder for a module that is imported on first attribute access.
+
+    Heavy dependencies (pandas, numpy, Pillow) are only needed by a few
+    endpoints, so importing them at application import would slow down
+    every worker start and test run.
+    """
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self.__dict__["_lazy_loaded"] = False
+
+    def _load(self) -> types.ModuleType:
+        module = importlib.import_module(self.__name__)
+        # Later lookups hit the copied attributes and skip __getattr__
+        self.__dict__.update(module.__dict__)
+        self.__dict__["_lazy_loaded"] = True
+        return module
+
+    def __getattr__(self, attr: str):
+        return getattr(self._load(), attr)
+
+    def __repr__(self) -> str:
+        state = "loaded" if self.__dict__["_lazy_loaded"] else "not loaded"
+        return f"<lazy module {self.__name__!r} ({state})>"
+
+
+def lazy_import(name: str) -> types.ModuleType:
+    """Returns the module if it is already imported, a `LazyModule` otherwise."""
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    return LazyModule(name)
@@ -0,0 +1,61 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Callable, Hashable, Optional
+
+
+class LRUCache:
+    """
+    Thread-safe in-memory LRU cache bounded by the total size of its values.
+
+    `sizeof` returns the weight of a value (bytes for binary payloads); the
+    least recently used entries are evicted once `max_size` is exceeded.
+    Hit and miss counters are kept for monitoring.
+    """
+
+    def __init__(self, max_size: int, sizeof: Callable[[Any], int] = len):
+        self.max_size = max_size
+        self.sizeof = sizeof
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        weight = self.sizeof(value)
+        if weight > self.max_size:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= self.sizeof(old)
+            self._entries[key] = value
+            self.size += weight
+            while self.size > self.max_size:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= self.sizeof(evicted)
+
+    def pop(self, key: Hashable) -> None:
+        with self._lock:
+            value = self._entries.pop(key, None)
+            if value is not None:
+                self.size -= self.sizeof(value)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+            self.hits = self.misses = 0
@@ -0,0 +1,439 @@
+"""
+In-process metrics in the Prometheus text exposition format.
+
+`MetricsMiddleware` is a pure ASGI middleware recording per-route request
+counts, latency and response size histograms and in-flight requests.
+Database statements are counted and timed by the engine hooks in
+`db.instrumentation`, both globally and per request. Gauges that are cheap
+to read on demand (threadpool usage, cache hit counters, queue depth) are
+registered as collectors and evaluated at scrape time. Everything is
+served by `GET /metrics`.
+"""
+
+import abc
+import bisect
+import collections
+import contextvars
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+from typing import Counter as CounterType
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+logger = logging.getLogger(__name__)
+
+LabelValues = Tuple[str, ...]
+Sample = Tuple[str, Dict[str, str], float]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    pairs = (f'{name}="{_escape(value)}"' for name, value in labels.items())
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric(abc.ABC):
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _labels(self, key: LabelValues) -> Dict[str, str]:
+        return dict(zip(self.labelnames, key))
+
+    @abc.abstractmethod
+    def samples(self) -> Iterable[Sample]:
+        """Yields `(name, labels, value)` for every exposed series."""
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> Iterable[Sample]:
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield f"{self.name}_total", self._labels(key), value
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[LabelValues, float] = {}
+
+    def set(self, value: float, **labels: str) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> Iterable[Sample]:
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield self.name, self._labels(key), value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, *args, buckets: Sequence[float] = LATENCY_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(buckets)
+        # Per label set: counts per bucket (non-cumulative), sum, count
+        self._values: Dict[LabelValues, Tuple[List[int], float, int]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total, count = self._values.get(
+                key, ([0] * (len(self.buckets) + 1), 0.0, 0)
+            )
+            counts[index] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    def count(self, **labels: str) -> int:
+        return self._values.get(self._key(labels), (None, 0.0, 0))[2]
+
+    def sum(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), (None, 0.0, 0))[1]
+
+    def samples(self) -> Iterable[Sample]:
+        with self._lock:
+            items = [(key, (list(c), s, n)) for key, (c, s, n) in self._values.items()]
+        for key, (counts, total, count) in items:
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, float("inf")), counts):
+                cumulative += bucket_count
+                yield (
+                    f"{self.name}_bucket",
+                    {**labels, "le": _format_value(float(bound))},
+                    cumulative,
+                )
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, count
+
+
+Collector = Callable[[], Iterable[Tuple[Dict[str, str], float]]]
+# name -> function returning (hits, misses, entries)
+CacheStats = Callable[[], Tuple[int, int, int]]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        # Metrics computed at scrape time: name -> (help, type, collector)
+        self._collectors: Dict[str, Tuple[str, str, Collector]] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames=()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames=()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self, name: str, documentation: str, labelnames=(), buckets=LATENCY_BUCKETS
+    ) -> Histogram:
+        return self.register(
+            Histogram(name, documentation, labelnames, buckets=buckets)
+        )
+
+    def collector(self, name: str, documentation: str, type: str = "gauge"):
+        """Registers a function returning (labels, value) pairs of a metric."""
+
+        def decorator(func: Collector) -> Collector:
+            self._collectors[name] = (documentation, type, func)
+            return func
+
+        return decorator
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        for name, (documentation, type, collect) in self._collectors.items():
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {type}")
+            for labels, value in collect():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_requests = registry.counter(
+    "http_requests", "HTTP requests handled.", ("method", "route", "status")
+)
+http_request_duration = registry.histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency.",
+    ("method", "route"),
+)
+http_response_size = registry.histogram(
+    "http_response_size_bytes",
+    "HTTP response body size (after compression).",
+    ("method", "route"),
+    buckets=SIZE_BUCKETS,
+)
+http_requests_in_flight = registry.gauge(
+    "http_requests_in_flight", "HTTP requests currently being handled."
+)
+http_request_db_queries = registry.histogram(
+    "http_request_db_queries",
+    "Database statements executed per HTTP request.",
+    ("route",),
+    buckets=COUNT_BUCKETS,
+)
+http_request_db_time = registry.histogram(
+    "http_request_db_seconds",
+    "Time spent executing database statements per HTTP request.",
+    ("route",),
+    buckets=LATENCY_BUCKETS,
+)
+http_request_db_duplicates = registry.counter(
+    "http_request_db_duplicate_statements",
+    "Statements re-executed with the same parameters within one request.",
+    ("route",),
+)
+http_request_db_repeated = registry.counter(
+    "http_request_db_repeated_statements",
+    "Requests executing one statement at least N times (N+1 pattern).",
+    ("route",),
+)
+db_queries = registry.counter("db_queries", "Database statements executed.")
+db_query_duration = registry.histogram(
+    "db_query_duration_seconds", "Database statement execution time."
+)
+db_slow_queries = registry.counter(
+    "db_slow_queries", "Database statements slower than the slow query threshold."
+)
+
+
+@dataclass
+class RequestStats:
+    """Per-request counters, filled in by instrumentation hooks."""
+
+    db_queries: int = 0
+    db_time: float = 0.0
+    # Executions per SQL text, and per SQL text and parameters (hashed)
+    statements: CounterType[str] = field(default_factory=collections.Counter)
+    executions: CounterType[Tuple[str, int]] = field(
+        default_factory=collections.Counter
+    )
+
+    def record_statement(self, statement: str, parameters, elapsed: float) -> None:
+        self.db_queries += 1
+        self.db_time += elapsed
+        self.statements[statement] += 1
+        self.executions[statement, hash(repr(parameters))] += 1
+
+    def duplicate_statements(self) -> Dict[str, int]:
+        """Statements executed more than once with the same parameters."""
+        duplicates: Dict[str, int] = {}
+        for (statement, _), count in self.executions.items():
+            if count > 1:
+                duplicates[statement] = duplicates.get(statement, 0) + count - 1
+        return duplicates
+
+    def repeated_statements(self, threshold: int) -> Dict[str, int]:
+        """Statements executed at least `threshold` times (N+1 patterns)."""
+        return {
+            statement: count
+            for statement, count in self.statements.items()
+            if count >= threshold
+        }
+
+
+request_stats: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar(
+    "request_stats", default=None
+)
+
+
+def route_label(scope: Scope, root_path: str) -> str:
+    """
+    The route template (`/api/v1/tables/{table_id}`) rather than the raw
+    path, so label cardinality stays bounded.
+    """
+    route = scope.get("route")
+    if route is not None:
+        return route.path
+    mount_path = scope.get("root_path", root_path)
+    if mount_path != root_path:
+        return f"{mount_path[len(root_path):]}/{{path}}"
+    return "<unmatched>"
+
+
+def _shorten(statement: str, limit: int = 200) -> str:
+    statement = " ".join(statement.split())
+    return statement if len(statement) <= limit else statement[:limit] + "..."
+
+
+def check_statements(stats: RequestStats, route: str, repeated_threshold: int) -> None:
+    """Records and logs redundant statements of a finished request."""
+    duplicates = stats.duplicate_statements()
+    for statement, count in duplicates.items():
+        logger.warning(
+            f"{route}: statement re-executed {count} times with the same "
+            f"parameters: {_shorten(statement)}"
+        )
+    if duplicates:
+        http_request_db_duplicates.inc(sum(duplicates.values()), route=route)
+
+    repeated = stats.repeated_statements(repeated_threshold)
+    for statement, count in repeated.items():
+        logger.warning(
+            f"{route}: statement executed {count} times (N+1?): {_shorten(statement)}"
+        )
+    if repeated:
+        http_request_db_repeated.inc(route=route)
+
+
+class MetricsMiddleware:
+    def __init__(self, app: ASGIApp, repeated_statement_threshold: int = 10):
+        self.app = app
+        self.repeated_statement_threshold = repeated_statement_threshold
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        root_path = scope.get("root_path", "")
+        status_code = 500
+        response_size = 0
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code, response_size
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            elif message["type"] == "http.response.body":
+                response_size += len(message.get("body", b""))
+            await send(message)
+
+        stats = RequestStats()
+        token = request_stats.set(stats)
+        http_requests_in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration = time.perf_counter() - start
+            http_requests_in_flight.dec()
+            request_stats.reset(token)
+
+            method, route = scope["method"], route_label(scope, root_path)
+            http_requests.inc(method=method, route=route, status=str(status_code))
+            http_request_duration.observe(duration, method=method, route=route)
+            http_response_size.observe(response_size, method=method, route=route)
+            http_request_db_queries.observe(stats.db_queries, route=route)
+            http_request_db_time.observe(stats.db_time, route=route)
+            check_statements(stats, route, self.repeated_statement_threshold)
+
+
+_caches: Dict[str, CacheStats] = {}
+
+
+def register_cache(name: str, stats: CacheStats) -> None:
+    """Exposes the hit/miss counters of an in-memory cache."""
+    _caches[name] = stats
+
+
+def register_lru_cache(name: str, func: Callable) -> None:
+    """Exposes the counters of a `functools.lru_cache`-decorated function."""
+
+    def stats():
+        info = func.cache_info()
+        return info.hits, info.misses, info.currsize
+
+    register_cache(name, stats)
+
+
+def _cache_samples(index: int):
+    return [({"cache": name}, stats()[index]) for name, stats in _caches.items()]
+
+
+registry.collector("cache_hits_total", "Cache lookups served from memory.", "counter")(
+    lambda: _cache_samples(0)
+)
+registry.collector("cache_misses_total", "Cache lookups that missed.", "counter")(
+    lambda: _cache_samples(1)
+)
+registry.collector("cache_entries", "Entries currently held by a cache.")(
+    lambda: _cache_samples(2)
+)
+
+
+@registry.collector(
+    "threadpool_threads", "Worker threads of the default threadpool, by state."
+)
+def _threadpool_threads():
+    import anyio.to_thread
+
+    try:
+        limiter = anyio.to_thread.current_default_thread_limiter()
+    except RuntimeError:  # no running event loop
+        return []
+    statistics = limiter.statistics()
+    return [
+        ({"state": "busy"}, statistics.borrowed_tokens),
+        ({"state": "limit"}, limiter.total_tokens),
+        ({"state": "waiting"}, statistics.tasks_waiting),
+    ]
@@ -0,0 +1,120 @@
+"""
+In-memory cache of the HTML pages under `templates/`.
+
+Pages are read once at startup, rendered with fingerprinted static URLs and
+compressed ahead of time, so serving a page involves no file I/O and
+no per-request compression. Responses carry ETag and Last-Modified and are
+answered with 304 when the browser copy is current. With `auto_reload`
+(development) the files are re-read whenever a template or static file
+changes on disk.
+"""
+
+import os
+from typing import Dict, NamedTuple, Optional
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+from core.http_cache import etag_matches, http_date, not_modified_since
+from core.http_compression import Variant, negotiate, precompress
+from core.static_assets import StaticAssets
+
+# Pages are not versioned by URL, so browsers always revalidate them
+PAGE_CACHE_CONTROL = "no-cache"
+
+
+class Page(NamedTuple):
+    # Identity and precompressed bodies, keyed by content coding
+    variants: Dict[Optional[str], Variant]
+    # The template or a static file it links to, whichever changed last
+    last_modified: float
+
+
+class PageCache:
+    def __init__(
+        self,
+        directory: str,
+        static_assets: Optional[StaticAssets] = None,
+        auto_reload: bool = False,
+    ):
+        self.directory = directory
+        self.static_assets = static_assets
+        self.auto_reload = auto_reload
+        self.pages: Dict[str, Page] = {}
+        self._signature = None
+        self.load()
+
+    def _watched_files(self):
+        directories = [self.directory]
+        if self.static_assets is not None:
+            directories.append(self.static_assets.directory)
+        for directory in directories:
+            for root, _, files in os.walk(directory):
+                for name in files:
+                    yield os.path.join(root, name)
+
+    def _current_signature(self) -> tuple:
+        return tuple(
+            (path, os.stat(path).st_mtime_ns) for path in sorted(self._watched_files())
+        )
+
+    def load(self) -> None:
+        """Reads and pre-renders all pages."""
+        pages = {}
+        # Pages link hashed asset URLs, which change with the static files
+        assets_modified = (
+            self.static_assets.last_modified if self.static_assets is not None else 0.0
+        )
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if not name.endswith(".html") or not os.path.isfile(path):
+                continue
+            with open(path, encoding="utf-8") as f:
+                html = f.read()
+            if self.static_assets is not None:
+                html = self.static_assets.rewrite(html)
+            pages[name] = Page(
+                precompress(html.encode("utf-8"), "text/html"),
+                max(os.path.getmtime(path), assets_modified),
+            )
+        self.pages = pages
+        if self.auto_reload:
+            self._signature = self._current_signature()
+
+    def _reload_if_changed(self) -> None:
+        signature = self._current_signature()
+        if signature != self._signature:
+            # Changed static files get new hashed URLs, so pages are re-rendered
+            if self.static_assets is not None:
+                self.static_assets.load()
+            self.load()
+
+    def response(self, name: str, request: Request) -> Response:
+        if self.auto_reload:
+            self._reload_if_changed()
+        page = self.pages[name]
+
+        coding, variant = negotiate(
+            page.variants, request.headers.get("accept-encoding")
+        )
+        etag = variant.etag
+        headers = {
+            "Cache-Control": PAGE_CACHE_CONTROL,
+            "ETag": etag,
+            "Last-Modified": http_date(page.last_modified),
+            "Vary": "Accept-Encoding",
+        }
+
+        # If-None-Match takes precedence over If-Modified-Since (RFC 9110)
+        if_none_match = request.headers.get("if-none-match")
+        if etag_matches(if_none_match, etag) or (
+            if_none_match is None
+            and not_modified_since(
+                request.headers.get("if-modified-since"), page.last_modified
+            )
+        ):
+            return Response(status_code=304, headers=headers)
+
+        if coding:
+            headers["Content-Encoding"] = coding
+        return Response(variant.body, media_type="text/html", headers=headers)
@@ -0,0 +1,237 @@
+"""
+Opt-in sampling profiler for individual HTTP requests.
+
+A request is profiled when it is picked by `PROFILING_SAMPLE_RATE` or
+carries the `X-Profile` header together with the bearer token of a
+superuser, or with `PROFILING_TOKEN` as its value; the header is ignored
+otherwise, so clients cannot make the server profile their requests. While it runs, a background thread snapshots
+the Python stacks of all busy threads every `PROFILING_INTERVAL` seconds,
+so time spent in the event loop and in threadpool workers (pandas, SQLite,
+serialization) is captured alike. Stacks are stored in the folded format
+read by flamegraph.pl, speedscope and similar tools.
+
+Samples are taken process-wide, so only one request is profiled at a time;
+requests arriving meanwhile run unprofiled. The slowest profiles are kept
+in memory and served by the admin API.
+"""
+
+import heapq
+import hmac
+import itertools
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from core.config import settings
+from core.metrics import route_label
+
+PROFILE_HEADER = b"x-profile"
+
+# Innermost frames of threads that are blocked waiting for work
+IDLE_FRAMES = {
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+}
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return (
+        f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    )
+
+
+def _fold(frame) -> Optional[str]:
+    """Folds a stack into `root;...;leaf`, or None for an idle thread."""
+    code = frame.f_code
+    if (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES:
+        return None
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+class StackSampler:
+    """Collects folded stacks of all threads until stopped."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.samples = 0
+        self.stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            self.samples += 1
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = _fold(frame)
+                if stack is None:
+                    continue
+                if thread_id not in names:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                self.stacks[f"{names.get(thread_id, thread_id)};{stack}"] += 1
+
+
+@dataclass
+class Profile:
+    id: str
+    method: str
+    path: str
+    route: str
+    status_code: int
+    duration: float
+    started_at: datetime
+    samples: int
+    stacks: Dict[str, int] = field(repr=False)
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.items())
+
+    def top_functions(self, limit: int = 10) -> List[Tuple[str, int]]:
+        """Functions by the number of samples they were executing in (self time)."""
+        leaves: Counter = Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        return leaves.most_common(limit)
+
+
+class ProfileStore:
+    """Keeps the `max_profiles` slowest profiles."""
+
+    def __init__(self, max_profiles: int):
+        self.max_profiles = max_profiles
+        # Min-heap on duration, so the fastest kept profile is evicted first
+        self._heap: List[Tuple[float, int, Profile]] = []
+        self._order = itertools.count()
+        self._lock = threading.Lock()
+
+    def add(self, profile: Profile) -> None:
+        entry = (profile.duration, next(self._order), profile)
+        with self._lock:
+            if len(self._heap) < self.max_profiles:
+                heapq.heappush(self._heap, entry)
+            elif self._heap and profile.duration > self._heap[0][0]:
+                heapq.heapreplace(self._heap, entry)
+
+    def list(self) -> List[Profile]:
+        """Profiles from the slowest to the fastest."""
+        with self._lock:
+            return [profile for _, _, profile in sorted(self._heap, reverse=True)]
+
+    def get(self, profile_id: str) -> Optional[Profile]:
+        return next((p for p in self.list() if p.id == profile_id), None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._heap.clear()
+
+
+profiles = ProfileStore(settings.PROFILING_MAX_PROFILES)
+
+
+class ProfilingMiddleware:
+    def __init__(
+        self,
+        app: ASGIApp,
+        store: ProfileStore,
+        sample_rate: float = 0.0,
+        interval: float = 0.005,
+        token: Optional[str] = None,
+        authorize: Optional[Callable[[str], bool]] = None,
+    ):
+        """
+        `X-Profile` is honoured when its value is `token`, or when `authorize`
+        accepts the bearer token of the request. `authorize` is blocking and
+        runs in the threadpool, only for requests carrying the header.
+        """
+        self.app = app
+        self.store = store
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.token = token.encode() if token else None
+        self.authorize = authorize
+        self._active = threading.Lock()
+
+    async def _authorized(self, value: bytes, headers: Dict[bytes, bytes]) -> bool:
+        if self.token is not None and hmac.compare_digest(value, self.token):
+            return True
+        scheme, _, credentials = headers.get(b"authorization", b"").partition(b" ")
+        if self.authorize is None or scheme.lower() != b"bearer" or not credentials:
+            return False
+        return await run_in_threadpool(self.authorize, credentials.decode("latin-1"))
+
+    async def _requested(self, scope: Scope) -> bool:
+        headers = dict(scope["headers"])
+        value = headers.get(PROFILE_HEADER)
+        if value is not None and value.lower() not in (b"0", b"false", b""):
+            return await self._authorized(value, headers)
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not await self._requested(scope):
+            await self.app(scope, receive, send)
+            return
+        if not self._active.acquire(blocking=False):
+            # Another request is being profiled
+            await self.app(scope, receive, send)
+            return
+
+        root_path = scope.get("root_path", "")
+        status_code = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        sampler = StackSampler(self.interval)
+        started_at = datetime.now(timezone.utc)
+        start = time.perf_counter()
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration = time.perf_counter() - start
+            # Joins the sampler thread, which may wait for a sampling interval
+            await run_in_threadpool(sampler.stop)
+            self._active.release()
+            self.store.add(
+                Profile(
+                    id=uuid.uuid4().hex,
+                    method=scope["method"],
+                    path=scope["path"],
+                    route=route_label(scope, root_path),
+                    status_code=status_code,
+                    duration=duration,
+                    started_at=started_at,
+                    samples=sampler.samples,
+                    stacks=dict(sampler.stacks),
+                )
+            )
@@ -0,0 +1,136 @@
+"""
+Content-hashed static assets.
+
+At startup every file under `static/` is read once and gets a fingerprinted
+URL (`/static/css/styles.css` -> `/static/css/styles.3f2a9c1b04de.css`).
+HTML pages are rendered with those URLs, so hashed assets can be cached by
+browsers and proxies forever: a changed file gets a new URL. Requests for
+the plain URLs still work and are revalidated with ETags.
+"""
+
+import hashlib
+import mimetypes
+import os
+import re
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.responses import Response
+from starlette.staticfiles import StaticFiles
+from starlette.types import Scope
+
+from core.http_cache import IMMUTABLE_CACHE_CONTROL, etag_matches
+from core.http_compression import Variant, negotiate, precompress
+
+HASH_LENGTH = 12
+# Unhashed URLs may change content at any time, so browsers must revalidate
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+
+class StaticAsset(NamedTuple):
+    # Identity and precompressed bodies, keyed by content coding
+    variants: Dict[Optional[str], Variant]
+    media_type: str
+    hashed_path: str
+
+
+def hashed_name(path: str, body: bytes) -> str:
+    digest = hashlib.sha256(body).hexdigest()[:HASH_LENGTH]
+    root, extension = os.path.splitext(path)
+    return f"{root}.{digest}{extension}"
+
+
+class StaticAssets(StaticFiles):
+    """
+    `StaticFiles` that serves files from an in-memory manifest built at
+    startup. Fingerprinted paths get `immutable` caching, plain paths get
+    ETag revalidation; anything else falls back to `StaticFiles`.
+    """
+
+    def __init__(self, directory: str, prefix: str = "/static", **kwargs):
+        super().__init__(directory=directory, **kwargs)
+        self.prefix = prefix.rstrip("/")
+        self.assets: Dict[str, StaticAsset] = {}
+        self.hashed: Dict[str, StaticAsset] = {}
+        # Latest change to the files, as a timestamp
+        self.last_modified = 0.0
+        self._reference_re = re.compile(
+            rf"""(["'(]){re.escape(self.prefix)}/([^"')?#]+)"""
+        )
+        self.load()
+
+    def load(self) -> None:
+        """(Re)builds the manifest from the files on disk."""
+        assets = {}
+        last_modified = 0.0
+        for root, _, files in os.walk(self.directory):
+            # Directories change when files are added or removed
+            last_modified = max(last_modified, os.path.getmtime(root))
+            for name in files:
+                full_path = os.path.join(root, name)
+                last_modified = max(last_modified, os.path.getmtime(full_path))
+                path = os.path.relpath(full_path, self.directory).replace(os.sep, "/")
+                with open(full_path, "rb") as f:
+                    body = f.read()
+                media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+                assets[path] = StaticAsset(
+                    precompress(body, media_type), media_type, hashed_name(path, body)
+                )
+        self.assets = assets
+        self.hashed = {asset.hashed_path: asset for asset in assets.values()}
+        self.last_modified = last_modified
+
+    def url(self, path: str) -> str:
+        """Fingerprinted URL of an asset, or the plain URL if it is unknown."""
+        path = path.lstrip("/")
+        asset = self.assets.get(path)
+        return f"{self.prefix}/{asset.hashed_path if asset else path}"
+
+    def rewrite(self, html: str) -> str:
+        """Replaces static asset references in an HTML page with hashed URLs."""
+        return self._reference_re.sub(
+            lambda m: f"{m.group(1)}{self.url(m.group(2))}", html
+        )
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        path = path.replace(os.sep, "/")
+        if scope["method"] not in ("GET", "HEAD"):
+            return await super().get_response(path, scope)
+        if path in self.hashed:
+            asset, cache_control = self.hashed[path], IMMUTABLE_CACHE_CONTROL
+        elif path in self.assets:
+            asset, cache_control = self.assets[path], REVALIDATE_CACHE_CONTROL
+        else:
+            return await super().get_response(path, scope)
+
+        request_headers = Headers(scope=scope)
+        coding, variant = negotiate(
+            asset.variants, request_headers.get("accept-encoding")
+        )
+        headers = {"Cache-Control": cache_control, "ETag": variant.etag}
+        if len(asset.variants) > 1:
+            headers["Vary"] = "Accept-Encoding"
+        if etag_matches(request_headers.get("if-none-match"), variant.etag):
+            return Response(status_code=304, headers=headers)
+        if coding:
+            headers["Content-Encoding"] = coding
+        return Response(variant.body, media_type=asset.media_type, headers=headers)
+
+
+class UploadedFiles(StaticFiles):
+    """
+    Serves the local uploads directory, except for files whose paths
+    relative to it contain one of `hidden` (e.g. uploaded tables, which are
+    only downloaded through the authenticated API).
+    """
+
+    def __init__(self, *, hidden: Tuple[str, ...] = (), **kwargs):
+        super().__init__(**kwargs)
+        self.hidden = hidden
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        relative = os.path.normpath(path).replace(os.sep, "/").lower() + "/"
+        if any(marker in relative for marker in self.hidden):
+            raise HTTPException(status_code=404)
+        return await super().get_response(path, scope)
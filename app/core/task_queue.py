@@ -0,0 +1,87 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+Job = Callable[..., Awaitable[Any]]
+
+
+class TaskQueue:
+    """
+    In-process queue of async jobs executed by a fixed number of workers.
+
+    The queue is bounded, so producers wait (backpressure) instead of piling
+    up unbounded work. It has to be started inside the running event loop,
+    typically from the application lifespan.
+    """
+
+    def __init__(self, name: str, concurrency: int = 2, maxsize: int = 1000):
+        self.name = name
+        self.concurrency = concurrency
+        self.maxsize = maxsize
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+
+    @property
+    def running(self) -> bool:
+        return bool(self._workers)
+
+    @property
+    def pending(self) -> int:
+        """Jobs waiting for a worker."""
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def start(self) -> None:
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        self._workers = [
+            asyncio.create_task(self._worker(), name=f"{self.name}-worker-{i}")
+            for i in range(self.concurrency)
+        ]
+        logger.info(
+            f"Started task queue '{self.name}' with {self.concurrency} workers."
+        )
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Waits for queued jobs to finish (up to `timeout`), then stops the workers."""
+        if not self.running:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(
+                f"Task queue '{self.name}' stopped with {self._queue.qsize()} pending jobs."
+            )
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queue = None
+
+    async def submit(self, job: Job, *args: Any) -> bool:
+        """
+        Enqueues a job, waiting if the queue is full. Returns False if the
+        queue is not running; the caller is then responsible for retrying.
+        """
+        if not self.running:
+            logger.warning(f"Task queue '{self.name}' is not running, job dropped.")
+            return False
+        await self._queue.put((job, args))
+        return True
+
+    async def join(self) -> None:
+        """Waits until all submitted jobs have been processed."""
+        if self.running:
+            await self._queue.join()
+
+    async def _worker(self) -> None:
+        while True:
+            job, args = await self._queue.get()
+            try:
+                await job(*args)
+            except Exception:
+                logger.exception(f"Job {getattr(job, '__name__', job)} failed.")
+            finally:
+                self._queue.task_done()
@@ -0,0 +1,86 @@
+"""
+SQLAlchemy engine hooks feeding `core.metrics`.
+
+Every statement executed through an instrumented engine is counted and
+timed globally and, when it runs on behalf of an HTTP request, added to
+that request's `RequestStats`, which flags statements repeated within the
+request. Statements slower than `DB_SLOW_QUERY_THRESHOLD` are logged with
+their parameters redacted to their types.
+
+`capture_statements` collects the same statistics for a block of code
+regardless of the thread it runs in, for assertions in tests.
+"""
+
+import logging
+import time
+from contextlib import contextmanager
+from typing import Iterator, List
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from core import metrics
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+_START_TIMES = "query_start_times"
+
+_captures: List[metrics.RequestStats] = []
+
+
+def redact(parameters, executemany: bool = False):
+    """Replaces bound values by their type names."""
+    if executemany:
+        return f"<{len(parameters)} parameter sets>"
+    if isinstance(parameters, dict):
+        return {name: type(value).__name__ for name, value in parameters.items()}
+    return tuple(type(value).__name__ for value in parameters or ())
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault(_START_TIMES, []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info[_START_TIMES].pop()
+    metrics.db_queries.inc()
+    metrics.db_query_duration.observe(elapsed)
+    if elapsed >= settings.DB_SLOW_QUERY_THRESHOLD:
+        metrics.db_slow_queries.inc()
+        logger.warning(
+            f"Slow query ({elapsed * 1000:.1f} ms): {' '.join(statement.split())} "
+            f"parameters={redact(parameters, executemany)}"
+        )
+    stats = metrics.request_stats.get()
+    if stats is not None:
+        stats.record_statement(statement, parameters, elapsed)
+    for capture in _captures:
+        capture.record_statement(statement, parameters, elapsed)
+
+
+def _handle_error(exception_context):
+    # A failed statement never reaches after_cursor_execute
+    conn = exception_context.connection
+    if conn is not None and conn.info.get(_START_TIMES):
+        conn.info[_START_TIMES].pop()
+
+
+def instrument_engine(engine: Engine) -> Engine:
+    """Registers the metrics hooks on an engine (idempotent)."""
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(engine, "handle_error", _handle_error)
+    return engine
+
+
+@contextmanager
+def capture_statements() -> Iterator[metrics.RequestStats]:
+    """Collects statistics of all statements executed within the block."""
+    stats = metrics.RequestStats()
+    _captures.append(stats)
+    try:
+        yield stats
+    finally:
+        _captures.remove(stats)
@@ -0,0 +1,78 @@
+"""
+Schema migrations with Alembic.
+
+The schema is owned by the revisions in `migrations/versions`. On startup
+the application only verifies that the database is at the head revision
+(`DB_MIGRATIONS="check"`), so several workers can start without racing to
+create tables, and schema changes are rolled out with `alembic upgrade head`
+ahead of a deploy. `DB_MIGRATIONS="upgrade"` applies pending revisions on
+startup instead, which is convenient for local development.
+"""
+
+import os
+from typing import Optional
+
+from sqlalchemy.engine import Connection, Engine
+
+ALEMBIC_INI = os.path.join(os.path.dirname(os.path.dirname(__file__)), "alembic.ini")
+
+
+# Created with raw DDL, so they are unknown to the models: the FTS5 search
+# index and the shadow tables SQLite keeps its data in
+UNMAPPED_TABLES = ("table_search",)
+
+
+class SchemaOutdatedError(RuntimeError):
+    pass
+
+
+def include_name(name: Optional[str], type_: str, parent_names: dict) -> bool:
+    """Leaves unmapped tables out of autogenerate comparisons."""
+    if type_ == "table" and name:
+        return not any(
+            name == table or name.startswith(f"{table}_") for table in UNMAPPED_TABLES
+        )
+    return True
+
+
+def alembic_config(connection: Optional[Connection] = None):
+    # Alembic is only needed at startup and in scripts, so it is imported here
+    from alembic.config import Config
+
+    config = Config(ALEMBIC_INI)
+    # Keep the application's logging configuration
+    config.attributes["configure_logger"] = False
+    if connection is not None:
+        config.attributes["connection"] = connection
+    return config
+
+
+def head_revision() -> Optional[str]:
+    from alembic.script import ScriptDirectory
+
+    return ScriptDirectory.from_config(alembic_config()).get_current_head()
+
+
+def current_revision(engine: Engine) -> Optional[str]:
+    from alembic.runtime.migration import MigrationContext
+
+    with engine.connect() as connection:
+        return MigrationContext.configure(connection).get_current_revision()
+
+
+def check_revision(engine: Engine) -> None:
+    """Raises SchemaOutdatedError unless the database is at the head revision."""
+    current, head = current_revision(engine), head_revision()
+    if current != head:
+        raise SchemaOutdatedError(
+            f"Database schema is at revision {current}, expected {head}. "
+            "Run `alembic upgrade head` (after `alembic stamp 0001` for a database "
+            "created before migrations were introduced)."
+        )
+
+
+def upgrade(engine: Engine, revision: str = "head") -> None:
+    from alembic import command
+
+    with engine.begin() as connection:
+        command.upgrade(alembic_config(connection), revision)
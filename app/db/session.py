@@ -1,8 +1,10 @@
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from core.config import settings
+from db.instrumentation import instrument_engine
 
 engine = create_engine(settings.DATABASE_URL, connect_args={"check_same_thread": False})
+instrument_engine(engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 
@@ -0,0 +1,108 @@
+from dataclasses import asdict
+from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import PlainTextResponse
+from typing import List
+
+from core.deps import get_current_active_superuser
+from core.profiling import Profile, profiles
+from features.admin.schemas import (
+    BulkUserDeletion,
+    FunctionSamples,
+    ProfileSummary,
+    UserDeletionStatus,
+)
+from features.users.models import User
+from services import user_deletion
+
+router = APIRouter(dependencies=[Depends(get_current_active_superuser)])
+
+
+def _summary(profile: Profile) -> ProfileSummary:
+    return ProfileSummary(
+        id=profile.id,
+        method=profile.method,
+        path=profile.path,
+        route=profile.route,
+        status_code=profile.status_code,
+        duration=profile.duration,
+        started_at=profile.started_at,
+        samples=profile.samples,
+        top_functions=[
+            FunctionSamples(function=function, samples=samples)
+            for function, samples in profile.top_functions()
+        ],
+    )
+
+
+@router.get("/profiles", response_model=List[ProfileSummary])
+def list_profiles():
+    """
+    List the slowest profiled requests, slowest first. Profiling is enabled
+    with PROFILING_ENABLED; a request is profiled when a superuser sends the
+    `X-Profile: 1` header, when `X-Profile` carries PROFILING_TOKEN, or when
+    it is sampled with PROFILING_SAMPLE_RATE.
+    """
+    return [_summary(profile) for profile in profiles.list()]
+
+
+@router.get("/profiles/{profile_id}", response_class=PlainTextResponse)
+def get_profile(profile_id: str):
+    """
+    Return the stacks of a profile in the folded format
+    (`frame;frame;frame count` per line), ready for flamegraph.pl or speedscope.
+    """
+    profile = profiles.get(profile_id)
+    if profile is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Profile not found"
+        )
+    return PlainTextResponse(profile.folded())
+
+
+@router.delete("/profiles", status_code=status.HTTP_204_NO_CONTENT)
+def clear_profiles():
+    """Drop all stored profiles."""
+    profiles.clear()
+
+
+def _deletion_status(job: user_deletion.UserDeletionJob) -> UserDeletionStatus:
+    return UserDeletionStatus(
+        id=job.id, state=job.state, error=job.error, **asdict(job.report)
+    )
+
+
+@router.post(
+    "/users/deletions",
+    response_model=UserDeletionStatus,
+    status_code=status.HTTP_202_ACCEPTED,
+)
+async def delete_users(
+    deletion: BulkUserDeletion,
+    current_user: User = Depends(get_current_active_superuser),
+):
+    """
+    Delete users matching the filter (or all of them) together with their
+    tables, table files and avatars. The deletion runs in the background in
+    batches; poll `GET /users/deletions/{id}` for its progress. The calling
+    user and, unless `include_superusers` is set, other superusers are kept.
+    """
+    where = user_deletion.user_filter(
+        user_ids=deletion.user_ids,
+        username_prefix=deletion.username_prefix,
+        inactive_only=deletion.inactive_only,
+        include_superusers=deletion.include_superusers,
+        exclude_ids=[current_user.id],
+    )
+    job = await user_deletion.submit_deletion(where, dry_run=deletion.dry_run)
+    return _deletion_status(job)
+
+
+@router.get("/users/deletions/{job_id}", response_model=UserDeletionStatus)
+def get_user_deletion(job_id: str):
+    """Progress of a bulk user deletion."""
+    job = user_deletion.jobs.get(job_id)
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Deletion not found"
+        )
+    return _deletion_status(job)
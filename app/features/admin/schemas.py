@@ -0,0 +1,58 @@
+from datetime import datetime
+from typing import List, Optional
+
+from pydantic import BaseModel, model_validator
+
+
+# Number of samples a function was executing in (its own time, not callees).
+class FunctionSamples(BaseModel):
+    function: str
+    samples: int
+
+
+# A captured request profile without its stacks.
+class ProfileSummary(BaseModel):
+    id: str
+    method: str
+    path: str
+    route: str
+    status_code: int
+    duration: float
+    started_at: datetime
+    samples: int
+    top_functions: List[FunctionSamples]
+
+
+# Users to delete in bulk; all criteria have to match.
+class BulkUserDeletion(BaseModel):
+    all: bool = False
+    user_ids: Optional[List[int]] = None
+    username_prefix: Optional[str] = None
+    inactive_only: bool = False
+    include_superusers: bool = False
+    # Only count the matching users and tables
+    dry_run: bool = False
+
+    @model_validator(mode="after")
+    def require_filter(self):
+        filtered = (
+            self.user_ids is not None or self.username_prefix or self.inactive_only
+        )
+        if not (self.all or filtered):
+            raise ValueError("Pass a filter or set `all` to delete every user.")
+        return self
+
+
+# Progress of a bulk user deletion job.
+class UserDeletionStatus(BaseModel):
+    id: str
+    state: str
+    error: Optional[str] = None
+    dry_run: bool
+    users_matched: int
+    tables_matched: int
+    users_deleted: int
+    tables_deleted: int
+    files_deleted: int
+    failed_deletions: int
+    elapsed: float
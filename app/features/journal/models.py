@@ -0,0 +1,40 @@
+from datetime import datetime, timezone
+
+from sqlalchemy import Column, DateTime, Integer, String
+
+from db.base import Base
+
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class StorageIntent(Base):
+    """
+    Journal entry for a file written to or deleted from storage. It is
+    committed before the side effect and marked done after it, so the sync
+    tool can find half-finished operations without scanning everything.
+    """
+
+    __tablename__ = "storage_intents"
+    # Ids are never reused, even after pruning, the checkpoint relies on it
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    id = Column(Integer, primary_key=True)
+    created_at = Column(DateTime, nullable=False, default=utcnow)
+    # "write" or "delete"
+    operation = Column(String, nullable=False)
+    # "table", "snapshot" or "avatar"
+    kind = Column(String, nullable=False)
+    key = Column(String, index=True, nullable=False)
+    # "pending" until the storage operation has finished, then "done"
+    status = Column(String, nullable=False, default="pending")
+
+
+class JournalCheckpoint(Base):
+    """Highest journal id whose entries have been reconciled."""
+
+    __tablename__ = "journal_checkpoints"
+
+    name = Column(String, primary_key=True)
+    position = Column(Integer, nullable=False)
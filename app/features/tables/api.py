@@ -1,12 +1,39 @@
-from fastapi import APIRouter, Depends, UploadFile, File, HTTPException, status, Form
+from fastapi import (
+    APIRouter,
+    Depends,
+    UploadFile,
+    File,
+    HTTPException,
+    status,
+    Form,
+    Header,
+    Query,
+)
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Literal, Optional
 
 from core.deps import get_db, get_current_active_user
 from features.users.models import User
 from features.tables import crud
-from features.tables.schemas import Table, TableUpdate
-from services import table_service
+from features.tables.schemas import (
+    Table,
+    TableExportQuery,
+    TableMemoryReport,
+    TableQuery,
+    TableQueryResult,
+    TableSearchResult,
+    TableUpdate,
+)
+from services import (
+    search_index,
+    table_export,
+    table_processing,
+    table_query,
+    table_service,
+)
+
+ExportFormat = Literal["csv", "xlsx", "parquet"]
 
 router = APIRouter()
 
@@ -36,11 +63,15 @@ async def upload_table_file(
     """
     Handle the upload of a .csv or .xlsx file, save it, and create a
     corresponding entry in the database for the user's table.
-    A custom table name can be provided.
+    A custom table name can be provided. The response is returned as soon
+    as the file is stored; poll `processing_status` until it is "ready".
     """
-    return await table_service.process_and_save_table(
+    table = await table_service.process_and_save_table(
         db=db, file=file, user=current_user, custom_table_name=table_name
     )
+    # Stats, snapshots and the schema index are computed in the background
+    await table_processing.submit_table(table.id)
+    return table
 
 
 @router.get("/", response_model=List[Table])
@@ -54,8 +85,25 @@ def get_user_tables(
     return crud.get_tables_by_user(db=db, user_id=current_user.id)
 
 
+@router.get("/search", response_model=List[TableSearchResult])
+def search_tables(
+    q: str = Query(..., min_length=1),
+    limit: int = Query(50, ge=1, le=search_index.MAX_RESULTS),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user),
+):
+    """
+    Find the user's tables whose names or cell values contain all words of
+    `q` (`word*` matches a prefix), with the matching columns, values and
+    row positions, most relevant first.
+    """
+    return search_index.search_tables(
+        db=db, user_id=current_user.id, query=q, limit=limit
+    )
+
+
 @router.delete("/{table_id}", response_model=Table)
-def delete_table(
+async def delete_table(
     table_id: int,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_active_user),
@@ -64,7 +112,7 @@ def delete_table(
     Delete a user's table. This removes the file from storage and the
     entry from the database.
     """
-    deleted_table = table_service.delete_table_file_and_db_entry(
+    deleted_table = await table_service.delete_table_file_and_db_entry(
         db=db, table_id=table_id, user_id=current_user.id
     )
     if not deleted_table:
@@ -98,7 +146,7 @@ def update_table_name(
 
 
 @router.get("/{table_id}/preview")
-def get_table_preview(
+async def get_table_preview(
     table_id: int,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_active_user),
@@ -108,6 +156,87 @@ def get_table_preview(
     column names, and total row count.
     """
     # The service function will handle user ownership check and exceptions
-    return table_service.get_table_preview(
+    return await table_service.get_table_preview(
+        db=db, table_id=table_id, user_id=current_user.id
+    )
+
+
+@router.get("/{table_id}/memory", response_model=TableMemoryReport)
+async def get_table_memory_report(
+    table_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user),
+):
+    """
+    Get the memory footprint of a table loaded with pandas default dtypes
+    versus the compact dtypes inferred at upload, per column and in total.
+    """
+    return await table_service.get_table_memory_report(
         db=db, table_id=table_id, user_id=current_user.id
     )
+
+
+@router.post("/{table_id}/query", response_model=TableQueryResult)
+async def query_table(
+    table_id: int,
+    query: TableQuery,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user),
+):
+    """
+    Filter, sort, group and aggregate a table on the server and return one
+    page of the result. Filters are applied first, then group-by with
+    aggregates, then sorting, offset and limit; `total_rows` is the number
+    of matching rows (or groups) before paging.
+    """
+    return await table_query.query_table(
+        db=db, table_id=table_id, user_id=current_user.id, query=query
+    )
+
+
+@router.get("/{table_id}/export", response_class=StreamingResponse)
+async def export_table(
+    table_id: int,
+    format: ExportFormat = Query("csv"),
+    range_header: Optional[str] = Header(None, alias="Range"),
+    if_range: Optional[str] = Header(None),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user),
+):
+    """
+    Download a table as CSV, XLSX or Parquet. The file is generated and
+    streamed in chunks; CSV downloads can be resumed with `Range` requests.
+    """
+    return await table_export.export_table(
+        db=db,
+        table_id=table_id,
+        user_id=current_user.id,
+        export_format=format,
+        range_header=range_header,
+        if_range=if_range,
+    )
+
+
+@router.post("/{table_id}/export", response_class=StreamingResponse)
+async def export_table_query(
+    table_id: int,
+    query: TableExportQuery,
+    format: ExportFormat = Query("csv"),
+    range_header: Optional[str] = Header(None, alias="Range"),
+    if_range: Optional[str] = Header(None),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user),
+):
+    """
+    Download the result of a query (see `POST /{table_id}/query`) as CSV,
+    XLSX or Parquet. All matching rows are exported unless `limit` is set.
+    """
+    return await table_export.export_table(
+        db=db,
+        table_id=table_id,
+        user_id=current_user.id,
+        export_format=format,
+        query=query,
+        range_header=range_header,
+        if_range=if_range,
+    )
@@ -45,6 +45,15 @@ def get_table_by_name(db: Session, user_id: int, table_name: str) -> Optional[Ta
     )
 
 
+def get_user_table(db: Session, table_id: int, user_id: int) -> Optional[Table]:
+    """
+    Get a table by its ID, ensuring it belongs to the user.
+    """
+    return (
+        db.query(Table).filter(Table.id == table_id, Table.user_id == user_id).first()
+    )
+
+
 def get_tables_by_user(db: Session, user_id: int) -> list[Table]:
     """
     Get all tables owned by a specific user.
@@ -67,9 +76,7 @@ def delete_table(db: Session, table_id: int, user_id: int) -> Optional[Table]:
     """
     Delete a table from the database by its ID, ensuring it belongs to the user.
     """
-    db_table = (
-        db.query(Table).filter(Table.id == table_id, Table.user_id == user_id).first()
-    )
+    db_table = get_user_table(db, table_id=table_id, user_id=user_id)
     if db_table:
         db.delete(db_table)
         db.commit()
@@ -82,9 +89,7 @@ def update_table_name(
     """
     Update the name of a table, ensuring it belongs to the user.
     """
-    db_table = (
-        db.query(Table).filter(Table.id == table_id, Table.user_id == user_id).first()
-    )
+    db_table = get_user_table(db, table_id=table_id, user_id=user_id)
     if db_table:
         db_table.table_name = new_name
         db.commit()
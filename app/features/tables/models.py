@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey
+from sqlalchemy import DDL, Column, Integer, String, ForeignKey, JSON, event
 from sqlalchemy.orm import relationship
 
 from db.base import Base
@@ -12,6 +12,66 @@ class Table(Base):
     original_file_name = Column(String, nullable=False)
     file_path = Column(String, nullable=False, unique=True)
     description = Column(String, nullable=True)
+    # Compact dtypes inferred at upload, applied on every load of the file
+    column_types = Column(JSON, nullable=True)
+    memory_report = Column(JSON, nullable=True)
+    # Encoding, delimiter, quote char and header presence sniffed at upload
+    csv_dialect = Column(JSON, nullable=True)
+
+    # Filled in by the background processing pipeline after upload
+    processing_status = Column(String, nullable=False, default="pending")
+    column_stats = Column(JSON, nullable=True)
+    preview = Column(JSON, nullable=True)
+    snapshot_path = Column(String, index=True, nullable=True)
 
     user_id = Column(Integer, ForeignKey("users.id"))
     owner = relationship("User", back_populates="tables")
+    columns = relationship(
+        "TableColumn",
+        back_populates="table",
+        cascade="all, delete-orphan",
+        order_by="TableColumn.position",
+    )
+
+
+class TableColumn(Base):
+    """Schema index entry: one row per column of an uploaded table."""
+
+    __tablename__ = "table_columns"
+
+    id = Column(Integer, primary_key=True, index=True)
+    table_id = Column(Integer, ForeignKey("tables.id"), index=True, nullable=False)
+    position = Column(Integer, nullable=False)
+    name = Column(String, index=True, nullable=False)
+    dtype = Column(String, nullable=False)
+
+    table = relationship("Table", back_populates="columns")
+
+
+# Full-text index of table names and cell values, see services.search_index.
+# FTS5 virtual tables cannot be mapped, so it is created with raw DDL by
+# migration 0004 and together with `tables` by `create_all`.
+SEARCH_INDEX_TABLE = "table_search"
+SEARCH_INDEX_DDL = f"""
+CREATE VIRTUAL TABLE {SEARCH_INDEX_TABLE} USING fts5(
+    value,
+    ref,
+    table_id UNINDEXED,
+    column_name UNINDEXED,
+    positions UNINDEXED,
+    row_count UNINDEXED,
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3'
+)
+"""
+
+event.listen(
+    Table.__table__,
+    "after_create",
+    DDL(SEARCH_INDEX_DDL).execute_if(dialect="sqlite"),
+)
+event.listen(
+    Table.__table__,
+    "after_drop",
+    DDL(f"DROP TABLE IF EXISTS {SEARCH_INDEX_TABLE}").execute_if(dialect="sqlite"),
+)
@@ -1,5 +1,5 @@
-from pydantic import BaseModel, ConfigDict, constr, field_validator
-from typing import Optional
+from pydantic import BaseModel, ConfigDict, Field, constr, field_validator
+from typing import Any, Dict, List, Literal, Optional
 import re
 
 # Здесь будут схемы для таблиц, например, для их переименования или отображения.
@@ -21,6 +21,9 @@ class TableCreate(TableBase):
     original_file_name: str
     file_path: str
     user_id: int
+    column_types: Optional[Dict[str, str]] = None
+    memory_report: Optional[dict] = None
+    csv_dialect: Optional[dict] = None
 
 
 # Schema for updating an existing table's metadata (e.g., renaming).
@@ -55,9 +58,113 @@ class TableInDBBase(TableBase):
 
 # The schema that will be returned to the client in API responses.
 class Table(TableInDBBase):
-    pass
+    # "pending", "processing", "ready" or "failed", the UI polls it after upload
+    processing_status: Optional[str] = None
 
 
 # Properties stored in DB
 class TableInDB(TableInDBBase):
     pass
+
+
+# Memory usage of a single column, with pandas defaults and with inferred dtypes.
+class ColumnMemory(BaseModel):
+    name: str
+    dtype: str
+    raw_bytes: int
+    bytes: int
+
+
+# Memory report of a table loaded with its inferred column types.
+class TableMemoryReport(BaseModel):
+    table_id: int
+    columns: List[ColumnMemory]
+    raw_bytes: int
+    bytes: int
+    reduction: float
+
+
+# --- Schemas for table queries ---
+
+FilterOp = Literal[
+    "eq",
+    "ne",
+    "lt",
+    "le",
+    "gt",
+    "ge",
+    "in",
+    "not_in",
+    "contains",
+    "startswith",
+    "is_null",
+    "not_null",
+]
+AggregateFunc = Literal["count", "sum", "mean", "median", "min", "max", "nunique"]
+
+
+# A predicate on one column; `value` is a list for "in"/"not_in" and unused
+# for "is_null"/"not_null".
+class QueryFilter(BaseModel):
+    column: str
+    op: FilterOp = "eq"
+    value: Any = None
+
+
+class QuerySort(BaseModel):
+    column: str
+    descending: bool = False
+
+
+# `count` without a column counts rows; the result column is named `alias`,
+# by default "<func>_<column>".
+class QueryAggregate(BaseModel):
+    func: AggregateFunc
+    column: Optional[str] = None
+    alias: Optional[str] = None
+
+    @property
+    def name(self) -> str:
+        if self.alias:
+            return self.alias
+        return f"{self.func}_{self.column}" if self.column else self.func
+
+
+# Evaluated in order: filters, group-by/aggregates, sort, offset and limit.
+# Without aggregates `columns` selects the returned columns (all by default).
+class TableQuery(BaseModel):
+    columns: Optional[List[str]] = None
+    filters: List[QueryFilter] = []
+    group_by: List[str] = []
+    aggregates: List[QueryAggregate] = []
+    sort: List[QuerySort] = []
+    limit: int = Field(100, ge=0)
+    offset: int = Field(0, ge=0)
+
+
+# Exports every matching row unless `limit` is set.
+class TableExportQuery(TableQuery):
+    limit: Optional[int] = Field(None, ge=0)
+
+
+class TableQueryResult(BaseModel):
+    columns: List[str]
+    rows: List[Dict[str, Any]]
+    # Rows (or groups) matching the query before offset and limit
+    total_rows: int
+
+
+# A value found in a table; `column` is None when the table name matched.
+# `rows` holds the first row positions (0-based) of the value, `row_count`
+# the number of rows holding it.
+class SearchMatch(BaseModel):
+    column: Optional[str] = None
+    value: str
+    rows: List[int]
+    row_count: int
+
+
+class TableSearchResult(BaseModel):
+    table_id: int
+    table_name: str
+    matches: List[SearchMatch]
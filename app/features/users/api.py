@@ -9,13 +9,12 @@ from fastapi import (
 )
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 from typing import Any
 from datetime import timedelta
-import shutil
-import os
+import logging
 import re
 from pathlib import Path
-import uuid
 
 from features.users import crud
 from features.users.schemas import (
@@ -30,7 +29,17 @@ from .models import User as UserModel
 from core import security
 from core.deps import get_db, get_current_active_user
 from core.config import settings
-from services.avatar_service import generate_avatar
+from services.avatar_service import (
+    delete_avatar_file,
+    generate_avatar,
+    is_shared_default_avatar,
+    new_custom_avatar_key,
+    save_custom_avatar,
+)
+from services import journal
+from services.storage import key_from_path, path_from_key
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
@@ -59,7 +68,7 @@ def login_access_token(
 
 
 @router.post("/register", response_model=User)
-def register(
+async def register(
     *,
     db: Session = Depends(get_db),
     user_in: UserCreate,
@@ -84,14 +93,21 @@ def register(
             detail="Username can only contain alphanumeric characters and underscores.",
         )
 
-    user = crud.user.get_by_username(db, username=user_in.username)
+    # The session and bcrypt block, so they run in a worker thread
+    user = await run_in_threadpool(
+        crud.user.get_by_username, db, username=user_in.username
+    )
     if user:
         raise HTTPException(
             status_code=400,
             detail="The user with this username already exists in the system.",
         )
 
-    user = crud.user.create(db, obj_in=user_in)
+    # Generate default avatar before creating the user object
+    avatar_url = await generate_avatar(user_in.username)
+    user = await run_in_threadpool(
+        crud.user.create, db, obj_in=user_in, avatar_url=avatar_url
+    )
     return user
 
 
@@ -108,7 +124,7 @@ def read_user_me(
 
 
 @router.put("/me", response_model=User)
-def update_user_me(
+async def update_user_me(
     *,
     db: Session = Depends(get_db),
     user_in: UserUpdate,
@@ -131,7 +147,9 @@ def update_user_me(
             )
 
         # Check if new username is already taken
-        existing_user = crud.user.get_by_username(db, username=new_username)
+        existing_user = await run_in_threadpool(
+            crud.user.get_by_username, db, username=new_username
+        )
         if existing_user and existing_user.id != current_user.id:
             raise HTTPException(
                 status_code=400,
@@ -140,23 +158,24 @@ def update_user_me(
 
         # If the user has a default avatar, it should be regenerated
         if current_user.is_default_avatar:
-            old_avatar_path_str = current_user.avatar_url.lstrip("/")
-            old_avatar_path = Path(old_avatar_path_str)
-
-            # Generate a new default avatar and delete the old one
-            new_avatar_url = generate_avatar(new_username)
+            # Default avatars are shared, so the old one is kept for other users
+            new_avatar_url = await generate_avatar(new_username)
             update_data["avatar_url"] = new_avatar_url
-            if old_avatar_path.exists():
-                os.remove(old_avatar_path)
+            if current_user.avatar_url and not is_shared_default_avatar(
+                current_user.avatar_url
+            ):
+                await delete_avatar_file(current_user.avatar_url)
         # If the avatar is custom, we do nothing to it. It's filename is not tied to the username.
 
-    updated_user = crud.user.update(db, db_obj=current_user, obj_in=update_data)
+    updated_user = await run_in_threadpool(
+        crud.user.update, db, db_obj=current_user, obj_in=update_data
+    )
 
     return updated_user
 
 
 @router.put("/me/username", response_model=User)
-def update_username(
+async def update_username(
     *,
     db: Session = Depends(get_db),
     user_in: UserUpdate,
@@ -177,7 +196,9 @@ def update_username(
         )
 
     # Check if new username is already taken
-    existing_user = crud.user.get_by_username(db, username=new_username)
+    existing_user = await run_in_threadpool(
+        crud.user.get_by_username, db, username=new_username
+    )
     if existing_user:
         raise HTTPException(
             status_code=400,
@@ -187,26 +208,29 @@ def update_username(
     update_data = {"username": new_username}
 
     # If the user has a default avatar, it should be regenerated
-    if current_user.is_default_avatar and current_user.avatar_url:
-        old_avatar_path_str = current_user.avatar_url.lstrip("/")
-        old_avatar_path = Path(old_avatar_path_str)
-        if old_avatar_path.exists():
+    if current_user.is_default_avatar:
+        # Default avatars are shared, only legacy per-user files are removed
+        if current_user.avatar_url and not is_shared_default_avatar(
+            current_user.avatar_url
+        ):
             try:
-                os.remove(old_avatar_path)
+                await delete_avatar_file(current_user.avatar_url)
             except OSError as e:
                 # Log the error, but don't block the username change
-                print(f"Error removing old avatar: {e}")
+                logger.warning(f"Error removing old avatar: {e}")
 
-        new_avatar_url = generate_avatar(new_username)
+        new_avatar_url = await generate_avatar(new_username)
         update_data["avatar_url"] = new_avatar_url
 
-    updated_user = crud.user.update(db, db_obj=current_user, obj_in=update_data)
+    updated_user = await run_in_threadpool(
+        crud.user.update, db, db_obj=current_user, obj_in=update_data
+    )
 
     return updated_user
 
 
 @router.put("/me/avatar", response_model=User)
-def upload_avatar(
+async def upload_avatar(
     file: UploadFile = File(...),
     current_user: UserModel = Depends(get_current_active_user, use_cache=False),
     db: Session = Depends(get_db),
@@ -214,38 +238,59 @@ def upload_avatar(
     """
     Upload a user avatar.
     """
-    # Delete old avatar if it exists
-    if current_user.avatar_url:
-        old_avatar_path = current_user.avatar_url.lstrip("/")
-        if os.path.exists(old_avatar_path):
-            os.remove(old_avatar_path)
-
     file_extension = Path(file.filename).suffix
-    if file_extension.lower() not in [".png", ".jpg", ".jpeg"]:
+    if file_extension.lower() not in [".png", ".jpg", ".jpeg", ".webp"]:
         raise HTTPException(
-            status_code=400, detail="Invalid image format. Use PNG, JPG, or JPEG."
+            status_code=400,
+            detail="Invalid image format. Use PNG, JPG, JPEG or WEBP.",
         )
 
-    # Save new avatar with a unique filename
-    unique_filename = f"{uuid.uuid4()}{file_extension}"
-    file_path = f"uploads/avatars/{unique_filename}"
+    # The intent is durable before any file is written
+    key = new_custom_avatar_key()
+    write_intents = await run_in_threadpool(
+        journal.record_and_commit, db, journal.WRITE, [(journal.AVATAR, key)]
+    )
 
+    # Decode once and store re-encoded copies in all avatar sizes
     try:
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        avatar_url = await save_custom_avatar(file, key)
     except Exception as e:
+        # Rejected or failed uploads leave neither files nor a pending intent
+        await delete_avatar_file(f"/{path_from_key(key)}")
+        await run_in_threadpool(journal.mark_done_and_commit, db, write_intents)
+        if isinstance(e, HTTPException):
+            raise
         raise HTTPException(status_code=500, detail=f"Could not save file: {e}")
 
-    avatar_url = f"/{file_path}"
+    old_avatar_url = current_user.avatar_url
+    if old_avatar_url and is_shared_default_avatar(old_avatar_url):
+        old_avatar_url = None
     update_data = {"avatar_url": avatar_url, "is_default_avatar": False}
 
-    updated_user = crud.user.update(db, db_obj=current_user, obj_in=update_data)
+    def point_to_new_avatar():
+        # One transaction: the new row, the finished write and the deletion
+        delete_intents = journal.record(
+            db,
+            journal.DELETE,
+            [(journal.AVATAR, key_from_path(old_avatar_url))] if old_avatar_url else [],
+        )
+        journal.mark_done(db, write_intents)
+        return delete_intents, crud.user.update(
+            db, db_obj=current_user, obj_in=update_data
+        )
+
+    delete_intents, updated_user = await run_in_threadpool(point_to_new_avatar)
+
+    # Delete old avatar only after the user points to the new one
+    if old_avatar_url:
+        await delete_avatar_file(old_avatar_url)
+        await run_in_threadpool(journal.mark_done_and_commit, db, delete_intents)
 
     return updated_user
 
 
 @router.delete("/me/avatar", response_model=User)
-def delete_avatar(
+async def delete_avatar(
     current_user: UserModel = Depends(get_current_active_user, use_cache=False),
     db: Session = Depends(get_db),
 ):
@@ -256,16 +301,30 @@ def delete_avatar(
     if current_user.is_default_avatar:
         return current_user
 
-    # Delete old custom avatar if it exists
-    if current_user.avatar_url:
-        old_avatar_path = current_user.avatar_url.lstrip("/")
-        if os.path.exists(old_avatar_path):
-            os.remove(old_avatar_path)
+    old_avatar_url = current_user.avatar_url
 
     # Generate a new default avatar
-    default_avatar_path = generate_avatar(current_user.username)
+    default_avatar_path = await generate_avatar(current_user.username)
     update_data = {"avatar_url": default_avatar_path, "is_default_avatar": True}
-    updated_user = crud.user.update(db, db_obj=current_user, obj_in=update_data)
+
+    def point_to_default_avatar():
+        # The intent is committed with the update, no transaction stays open
+        # while the avatar is generated
+        delete_intents = journal.record(
+            db,
+            journal.DELETE,
+            [(journal.AVATAR, key_from_path(old_avatar_url))] if old_avatar_url else [],
+        )
+        return delete_intents, crud.user.update(
+            db, db_obj=current_user, obj_in=update_data
+        )
+
+    delete_intents, updated_user = await run_in_threadpool(point_to_default_avatar)
+
+    # Delete old custom avatar if it exists
+    if old_avatar_url:
+        await delete_avatar_file(old_avatar_url)
+        await run_in_threadpool(journal.mark_done_and_commit, db, delete_intents)
 
     return updated_user
 
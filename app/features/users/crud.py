@@ -5,17 +5,15 @@ from core.security import get_password_hash, verify_password
 from db.base_crud import CRUDBase
 from features.users.models import User
 from .schemas import UserCreate, UserUpdate
-from services.avatar_service import generate_avatar
 
 
 class CRUDUser(CRUDBase[User, UserCreate, UserUpdate]):
     def get_by_username(self, db: Session, *, username: str) -> Optional[User]:
         return db.query(User).filter(User.username == username).first()
 
-    def create(self, db: Session, *, obj_in: UserCreate) -> User:
-        # Generate default avatar before creating the user object
-        avatar_url = generate_avatar(obj_in.username)
-
+    def create(
+        self, db: Session, *, obj_in: UserCreate, avatar_url: Optional[str] = None
+    ) -> User:
         db_obj = User(
             username=obj_in.username,
             hashed_password=get_password_hash(obj_in.password),
@@ -13,7 +13,7 @@ class User(Base):
     hashed_password = Column(String, nullable=False)
     is_active = Column(Boolean, default=True)
     is_superuser = Column(Boolean, default=False)
-    avatar_url = Column(String, nullable=True)
+    avatar_url = Column(String, index=True, nullable=True)
     is_default_avatar = Column(Boolean, default=True)
 
     tables = relationship("Table", back_populates="owner", cascade="all, delete-orphan")
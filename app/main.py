@@ -1,46 +1,62 @@
-from fastapi import FastAPI, Request, HTTPException
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, RedirectResponse, HTMLResponse
+from fastapi import Depends, FastAPI, Request, HTTPException
+from fastapi.responses import (
+    RedirectResponse,
+    HTMLResponse,
+    Response,
+)
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
 import os
+from typing import Optional
 
 from api.v1.api import api_router
-from core.middleware import CacheBustingMiddleware
 from core.config import settings
-from db.base import Base
-from db.session import engine
+from core.deps import is_superuser_token
+from core.http_cache import IMMUTABLE_CACHE_CONTROL, etag_matches
+from core import metrics
+from core.http_compression import CompressionMiddleware
+from core.pages import PageCache
+from core.profiling import ProfilingMiddleware, profiles
+from core.static_assets import StaticAssets, UploadedFiles
+from db import migrations
+from db.session import engine, get_db
+from services import table_processing, user_deletion
+from services.avatar_service import AVATAR_VARIANT_SIZES, get_avatar_variant
 from services.text_to_sql_service import convert_text_to_sql
 
-# Create all tables in the database
-Base.metadata.create_all(bind=engine)
-
 # Create uploads directory if it doesn't exist
 os.makedirs(settings.UPLOADS_DIR, exist_ok=True)
 os.makedirs(os.path.join(settings.UPLOADS_DIR, "avatars"), exist_ok=True)
 os.makedirs(os.path.join(settings.UPLOADS_DIR, "tables"), exist_ok=True)
 
 
-def create_tables():
-    print("Creating tables...")
-    Base.metadata.create_all(bind=engine)
-    print("Tables created.")
-
-
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Code to run on startup
     avatars_dir = os.path.join(settings.UPLOADS_DIR, "avatars")
     os.makedirs(avatars_dir, exist_ok=True)
-    # create_tables()
+    # The schema is owned by Alembic; workers only verify the revision
+    if settings.DB_MIGRATIONS == "upgrade":
+        await run_in_threadpool(migrations.upgrade, engine)
+    elif settings.DB_MIGRATIONS == "check":
+        await run_in_threadpool(migrations.check_revision, engine)
+    await table_processing.queue.start()
+    await table_processing.resume_pending_tables()
+    await user_deletion.queue.start()
     yield
     # Code to run on shutdown
+    await user_deletion.queue.stop()
+    await table_processing.queue.stop()
 
 
 def create_app() -> FastAPI:
     app = FastAPI(title="Text-to-SQL Service", lifespan=lifespan)
 
-    app.add_middleware(CacheBustingMiddleware)
+    app.add_middleware(
+        CompressionMiddleware, minimum_size=settings.COMPRESSION_MINIMUM_SIZE
+    )
 
     app.add_middleware(
         CORSMiddleware,
@@ -50,39 +66,83 @@ def create_app() -> FastAPI:
         allow_headers=["*"],
     )
 
-    app.mount("/static", StaticFiles(directory="static"), name="static")
-    app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
-
+    if settings.PROFILING_ENABLED:
+        app.add_middleware(
+            ProfilingMiddleware,
+            store=profiles,
+            sample_rate=settings.PROFILING_SAMPLE_RATE,
+            interval=settings.PROFILING_INTERVAL,
+            token=settings.PROFILING_TOKEN,
+            authorize=is_superuser_token,
+        )
+
+    if settings.METRICS_ENABLED:
+        # Added last, so it is the outermost middleware and times everything
+        app.add_middleware(
+            metrics.MetricsMiddleware,
+            repeated_statement_threshold=settings.DB_REPEATED_STATEMENT_THRESHOLD,
+        )
+
+        @app.get("/metrics", include_in_schema=False)
+        async def get_metrics():
+            return Response(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
+    # Avatars are served from an in-memory cache in front of the storage
+    # backend, so the route has to be registered before the /uploads mount
+    # which would otherwise shadow it. Avatar file names are never reused
+    # (content-addressed defaults, uuid custom uploads), so responses are
+    # cached by browsers indefinitely.
     @app.get("/uploads/avatars/{filename:path}")
-    async def get_avatar(filename: str):
-        file_path = f"uploads/avatars/{filename}"
-        if not os.path.exists(file_path):
+    async def get_avatar(
+        request: Request,
+        filename: str,
+        size: Optional[int] = None,
+        db: Session = Depends(get_db),
+    ):
+        if size is not None and size not in AVATAR_VARIANT_SIZES:
+            raise HTTPException(status_code=400, detail="Unsupported avatar size")
+        try:
+            avatar = await get_avatar_variant(db, f"avatars/{filename}", size)
+        except (FileNotFoundError, ValueError):
             raise HTTPException(status_code=404, detail="File not found")
 
-        headers = {
-            "Cache-Control": "no-cache, no-store, must-revalidate",
-            "Pragma": "no-cache",
-            "Expires": "0",
-        }
-        return FileResponse(file_path, headers=headers)
+        headers = {"Cache-Control": IMMUTABLE_CACHE_CONTROL, "ETag": avatar.etag}
+        if etag_matches(request.headers.get("if-none-match"), avatar.etag):
+            return Response(status_code=304, headers=headers)
+        return Response(avatar.body, media_type=avatar.media_type, headers=headers)
+
+    # Static files are fingerprinted once at startup; pages link the hashed URLs
+    static_assets = StaticAssets(directory="static")
+    app.mount("/static", static_assets, name="static")
+    # Tables and their snapshots are private to their owners, they are only
+    # downloaded through the authenticated export API
+    uploads = UploadedFiles(
+        directory=settings.UPLOADS_DIR, hidden=("tables/", ".snapshot.")
+    )
+    app.mount("/uploads", uploads, name="uploads")
 
     app.include_router(api_router, prefix="/api/v1")
 
-    @app.get("/login")
-    async def read_login():
-        return FileResponse("templates/login.html")
+    # HTML pages are loaded once and served from memory
+    pages = PageCache(
+        "templates", static_assets, auto_reload=settings.TEMPLATES_AUTO_RELOAD
+    )
+
+    @app.get("/login", response_class=HTMLResponse)
+    async def read_login(request: Request):
+        return pages.response("login.html", request)
 
     @app.get("/queries", response_class=HTMLResponse)
     async def queries_page(request: Request):
-        return HTMLResponse(content=open("templates/index.html").read())
+        return pages.response("index.html", request)
 
     @app.get("/help", response_class=HTMLResponse)
     async def help_page(request: Request):
-        return HTMLResponse(content=open("templates/help.html").read())
+        return pages.response("help.html", request)
 
     @app.get("/settings", response_class=HTMLResponse)
     async def settings_page(request: Request):
-        return HTMLResponse(content=open("templates/settings.html").read())
+        return pages.response("settings.html", request)
 
     @app.get("/")
     async def read_root():
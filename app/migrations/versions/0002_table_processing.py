@@ -0,0 +1,74 @@
+"""table processing
+
+Adds the column types, CSV dialect and background processing results of
+uploaded tables, and the schema index (`table_columns`).
+
+Databases created by `create_all` after these columns were introduced but
+before migrations already have some of them, so only missing ones are added.
+Existing tables are left "pending" and processed on the next startup.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-19 18:49:20.797887
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "0002"
+down_revision: Union[str, Sequence[str], None] = "0001"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TABLE_COLUMNS = [
+    sa.Column("column_types", sa.JSON(), nullable=True),
+    sa.Column("memory_report", sa.JSON(), nullable=True),
+    sa.Column("csv_dialect", sa.JSON(), nullable=True),
+    sa.Column(
+        "processing_status",
+        sa.String(),
+        nullable=False,
+        server_default="pending",
+    ),
+    sa.Column("column_stats", sa.JSON(), nullable=True),
+    sa.Column("preview", sa.JSON(), nullable=True),
+    sa.Column("snapshot_path", sa.String(), nullable=True),
+]
+
+
+def upgrade() -> None:
+    inspector = sa.inspect(op.get_bind())
+    existing = {column["name"] for column in inspector.get_columns("tables")}
+    with op.batch_alter_table("tables") as batch_op:
+        for column in TABLE_COLUMNS:
+            if column.name not in existing:
+                batch_op.add_column(column)
+
+    if inspector.has_table("table_columns"):
+        return
+    op.create_table(
+        "table_columns",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("table_id", sa.Integer(), nullable=False),
+        sa.Column("position", sa.Integer(), nullable=False),
+        sa.Column("name", sa.String(), nullable=False),
+        sa.Column("dtype", sa.String(), nullable=False),
+        sa.ForeignKeyConstraint(["table_id"], ["tables.id"]),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("ix_table_columns_id", "table_columns", ["id"], unique=False)
+    op.create_index("ix_table_columns_name", "table_columns", ["name"], unique=False)
+    op.create_index(
+        "ix_table_columns_table_id", "table_columns", ["table_id"], unique=False
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("table_columns")
+    with op.batch_alter_table("tables") as batch_op:
+        for column in reversed(TABLE_COLUMNS):
+            batch_op.drop_column(column.name)
@@ -0,0 +1,54 @@
+"""storage intent journal
+
+Adds the journal of storage writes and deletions replayed by
+`scripts/sync_db_and_files.py`, and indexes the columns it looks files up by.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-19 21:12:40.118204
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "0003"
+down_revision: Union[str, Sequence[str], None] = "0002"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "storage_intents",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("operation", sa.String(), nullable=False),
+        sa.Column("kind", sa.String(), nullable=False),
+        sa.Column("key", sa.String(), nullable=False),
+        sa.Column("status", sa.String(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+        sqlite_autoincrement=True,
+    )
+    op.create_index("ix_storage_intents_key", "storage_intents", ["key"], unique=False)
+    op.create_table(
+        "journal_checkpoints",
+        sa.Column("name", sa.String(), nullable=False),
+        sa.Column("position", sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint("name"),
+    )
+    op.create_index("ix_users_avatar_url", "users", ["avatar_url"], unique=False)
+    op.create_index(
+        "ix_tables_snapshot_path", "tables", ["snapshot_path"], unique=False
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_tables_snapshot_path", table_name="tables")
+    op.drop_index("ix_users_avatar_url", table_name="users")
+    op.drop_table("journal_checkpoints")
+    op.drop_index("ix_storage_intents_key", table_name="storage_intents")
+    op.drop_table("storage_intents")
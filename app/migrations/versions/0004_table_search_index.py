@@ -0,0 +1,44 @@
+"""table search index
+
+Adds the FTS5 index of table names and cell values used by
+`services.search_index`. Processed tables are queued for processing again
+on the next startup, which fills the index for them.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-19 23:05:11.402817
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "0004"
+down_revision: Union[str, Sequence[str], None] = "0003"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute("""
+        CREATE VIRTUAL TABLE table_search USING fts5(
+            value,
+            ref,
+            table_id UNINDEXED,
+            column_name UNINDEXED,
+            positions UNINDEXED,
+            row_count UNINDEXED,
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        )
+        """)
+    op.execute(
+        "UPDATE tables SET processing_status = 'pending' "
+        "WHERE processing_status = 'ready'"
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP TABLE table_search")
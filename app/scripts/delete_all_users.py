@@ -1,32 +1,96 @@
-import sys
+"""
+A script to delete users together with their tables and files.
+
+Users are deleted in batches, each in its own short transaction, and their
+table files, snapshots and avatars are removed in parallel (see
+`services.user_deletion`). Without filters every user is deleted;
+superusers are kept unless --include-superusers is given.
+
+Usage:
+    python scripts/delete_all_users.py --dry-run
+    python scripts/delete_all_users.py --inactive --yes
+    python scripts/delete_all_users.py --username-prefix load_ --batch-size 5000
+"""
+
+import argparse
+import asyncio
+import logging
 import os
+import sys
 
 # Add project root to the Python path
-sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
-from db.session import SessionLocal
-from db.models.user import User
-from db.models.table import UserTable  # noqa
+from db.session import engine
+from services import user_deletion
+from services.storage import get_storage
 
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
 
-def delete_all_users():
-    db = SessionLocal()
-    try:
-        num_rows_deleted = db.query(User).delete()
-        db.commit()
-        print(f"Successfully deleted {num_rows_deleted} users.")
-    except Exception as e:
-        print(f"An error occurred: {e}")
-        db.rollback()
-    finally:
-        db.close()
 
+def log_progress(report: user_deletion.UserDeletionReport) -> None:
+    rate = report.users_deleted / report.elapsed if report.elapsed else 0
+    logging.info(
+        f"Deleted {report.users_deleted}/{report.users_matched} users, "
+        f"{report.tables_deleted}/{report.tables_matched} tables, "
+        f"{report.files_deleted} files ({rate:.0f} users/s)."
+    )
 
-if __name__ == "__main__":
-    print("This script will delete all users from the database.")
-    confirmation = input("Are you sure you want to continue? (y/n): ")
-    if confirmation.lower() == "y":
-        delete_all_users()
+
+async def delete_users(
+    args: argparse.Namespace,
+) -> user_deletion.UserDeletionReport:
+    where = user_deletion.user_filter(
+        user_ids=args.ids,
+        username_prefix=args.username_prefix,
+        inactive_only=args.inactive,
+        include_superusers=args.include_superusers,
+    )
+    report = await user_deletion.delete_users(
+        engine,
+        get_storage(),
+        where,
+        dry_run=args.dry_run,
+        batch_size=args.batch_size,
+        concurrency=args.concurrency,
+        progress=log_progress,
+    )
+    if args.dry_run:
+        logging.info(
+            f"Would delete {report.users_matched} users and "
+            f"{report.tables_matched} tables."
+        )
     else:
-        print("Operation cancelled.")
- 
\ No newline at end of file
+        log_progress(report)
+        if report.failed_deletions:
+            logging.warning(
+                f"Failed to delete {report.failed_deletions} files, "
+                "run scripts/sync_db_and_files.py to retry."
+            )
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--ids", type=int, nargs="+", help="only these user ids")
+    parser.add_argument("--username-prefix", help="only usernames with this prefix")
+    parser.add_argument("--inactive", action="store_true", help="only inactive users")
+    parser.add_argument("--include-superusers", action="store_true")
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--yes", action="store_true", help="do not ask to confirm")
+    parser.add_argument("--batch-size", type=int, default=user_deletion.BATCH_SIZE)
+    parser.add_argument(
+        "--concurrency", type=int, default=user_deletion.DELETE_CONCURRENCY
+    )
+    args = parser.parse_args()
+
+    if not (args.dry_run or args.yes):
+        print("This script will delete the matching users and all their data.")
+        confirmation = input("Are you sure you want to continue? (y/n): ")
+        if confirmation.lower() != "y":
+            print("Operation cancelled.")
+            sys.exit(0)
+    asyncio.run(delete_users(args))
@@ -1,15 +1,66 @@
+from __future__ import annotations
+
 import hashlib
-import os
-from PIL import Image, ImageDraw, ImageFont
+import mimetypes
+import re
 import uuid
+from functools import lru_cache
+from io import BytesIO
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from fastapi import HTTPException, UploadFile, status
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from core import metrics
+from core.config import settings
+from core.http_cache import make_etag
+from core.lazy import lazy_import
+from core.lru import LRUCache
+from features.users.models import User
+from services.storage import CHUNK_SIZE, get_storage, key_from_path, path_from_key
+
+# Pillow is imported on first use to keep application startup fast
+Image = lazy_import("PIL.Image")
+ImageDraw = lazy_import("PIL.ImageDraw")
+ImageFont = lazy_import("PIL.ImageFont")
+ImageOps = lazy_import("PIL.ImageOps")
+features = lazy_import("PIL.features")
+
+AVATAR_SIZE = 200
+FONT_SIZE = 144
+
+# Маски хранятся для каждой первой буквы; 512 хватает с запасом на латиницу,
+# кириллицу и цифры, каждая маска занимает 40 КБ.
+GLYPH_CACHE_SIZE = 512
 
-# Убедимся, что директория для аватаров существует
-AVATAR_DIR = "uploads/avatars"
+# Аватары по умолчанию общие для всех пользователей с одинаковыми буквой
+# и цветом, поэтому лежат отдельно от загруженных пользователями файлов.
+DEFAULT_AVATARS_PREFIX = "avatars/default/"
+DEFAULT_AVATAR_KEY_RE = re.compile(
+    r"^avatars/default/([0-9a-f]{4,6})-([0-9a-f]{6})\.png$"
+)
 
+# Размеры, в которых отдаются уменьшенные копии аватаров (`?size=`)
+AVATAR_VARIANT_SIZES = (48, 72, 96, 144, AVATAR_SIZE)
 
+# Загруженные аватары хранятся набором копий: avatars/<uuid>/<size>.webp
+CUSTOM_AVATAR_KEY_RE = re.compile(r"^(avatars/[0-9a-f-]{36})/\d+\.(webp|png)$")
+CUSTOM_AVATAR_QUALITY = 85
+
+
+@lru_cache(maxsize=None)
+def custom_avatar_format() -> str:
+    """WebP, если Pillow собран с его поддержкой, иначе PNG."""
+    return "WEBP" if features.check("webp") else "PNG"
+
+
+@lru_cache(maxsize=None)
 def get_font(size):
     """
     Пытается найти системный шрифт. Возвращает шрифт по умолчанию, если не найден.
+    Результат кэшируется для каждого размера, поэтому перебор путей выполняется
+    один раз за время жизни процесса.
     """
     # Сначала ищем жирные шрифты
     bold_font_paths = [
@@ -33,53 +84,261 @@ def get_font(size):
             continue
 
     # Если ничего не найдено, используем шрифт по умолчанию от Pillow.
-    # Он будет маленьким, так как параметр size игнорируется.
-    return ImageFont.load_default()
+    return ImageFont.load_default(size)
 
 
-def generate_avatar(username: str) -> str:
+def _draw_letter(image: Image.Image, letter: str, fill, font) -> None:
+    draw = ImageDraw.Draw(image)
+    center = image.width / 2, image.height / 2
+    # Используем anchor="mm" для идеального центрирования.
+    try:
+        draw.text(center, letter, fill=fill, font=font, anchor="mm")
+    except (TypeError, ValueError):
+        # Фоллбэк, если шрифт не поддерживает anchor (растровый шрифт по умолчанию).
+        left, top, right, bottom = draw.textbbox((0, 0), letter, font=font)
+        x = (image.width - (right - left)) / 2 - left
+        y = (image.height - (bottom - top)) / 2 - top
+        draw.text((x, y), letter, fill=fill, font=font)
+
+
+@lru_cache(maxsize=GLYPH_CACHE_SIZE)
+def get_glyph_mask(letter: str, size: int = AVATAR_SIZE) -> Image.Image:
     """
-    Генерирует аватар для пользователя, сохраняет его и возвращает путь.
+    Возвращает маску (режим "L") с отрисованной по центру буквой.
+    Маска не зависит от цвета, поэтому рендерится один раз на букву.
     """
-    # 1. Генерация цвета на основе имени пользователя
-    hash_object = hashlib.md5(username.encode())
-    hex_dig = hash_object.hexdigest()
-    # Берем первые 6 символов для цвета
-    color = f"#{hex_dig[:6]}"
+    mask = Image.new("L", (size, size), 0)
+    _draw_letter(mask, letter, 255, get_font(round(FONT_SIZE * size / AVATAR_SIZE)))
+    return mask
+
+
+def avatar_color(username: str) -> str:
+    """Цвет фона аватара, вычисляемый из md5 имени пользователя."""
+    return f"#{hashlib.md5(username.encode()).hexdigest()[:6]}"
+
+
+def _render(letter: str, color: str, size: int) -> Image.Image:
+    image = Image.new("RGB", (size, size), color=color)
+    image.paste("white", (0, 0), get_glyph_mask(letter, size))
+    return image
+
 
-    # 2. Получение первой буквы и создание изображения
+def render_avatar(username: str, size: int = AVATAR_SIZE) -> Image.Image:
+    """
+    Рисует аватар: заливка цветом пользователя и белая буква, наложенная
+    по кэшированной маске.
+    """
+    return _render(username[0].upper(), avatar_color(username), size)
+
+
+def _encode(image: Image.Image, image_format: str = "PNG") -> bytes:
+    buffer = BytesIO()
+    image.save(buffer, format=image_format)
+    return buffer.getvalue()
+
+
+def default_avatar_key(username: str) -> str:
+    """
+    Ключ аватара по умолчанию. Изображение зависит только от первой буквы
+    и цвета, поэтому ключ состоит из кода буквы и цвета, например
+    `avatars/default/0041-1a2b3c.png`, и по нему аватар можно отрисовать заново.
+    """
     letter = username[0].upper()
-    image = Image.new("RGB", (200, 200), color=color)
-    draw = ImageDraw.Draw(image)
+    return f"{DEFAULT_AVATARS_PREFIX}{ord(letter):04x}-{avatar_color(username)[1:]}.png"
 
-    # 3. Написание буквы на изображении
-    font = get_font(144)  # Уменьшаем размер до 90% и делаем жирным
 
-    # Используем anchor="mm" для идеального центрирования.
+def parse_default_avatar_key(key: str) -> Optional[Tuple[str, str]]:
+    """Возвращает (букву, цвет) для ключа аватара по умолчанию или None."""
+    match = DEFAULT_AVATAR_KEY_RE.match(key)
+    if not match:
+        return None
+    return chr(int(match.group(1), 16)), f"#{match.group(2)}"
+
+
+def is_shared_default_avatar(avatar_url: str) -> bool:
+    """Общие аватары по умолчанию нельзя удалять при смене аватара одним пользователем."""
+    return key_from_path(avatar_url).startswith(DEFAULT_AVATARS_PREFIX)
+
+
+async def generate_avatar(username: str) -> str:
+    """
+    Возвращает путь к аватару по умолчанию для пользователя. Файл рендерится
+    и сохраняется, только если аватара с такими буквой и цветом ещё нет.
+    """
+    key = default_avatar_key(username)
+    storage = get_storage()
+
+    if not await storage.exists(key):
+        # Одновременная запись одного ключа безопасна: содержимое совпадает,
+        # а хранилище заменяет файл атомарно.
+        await storage.save(key, _encode(render_avatar(username)))
+
+    # Возвращаем URL-путь для доступа через веб
+    return f"/{path_from_key(key)}"
+
+
+class AvatarVariant(NamedTuple):
+    body: bytes
+    media_type: str
+    etag: str
+
+
+avatar_cache = LRUCache(settings.AVATAR_CACHE_SIZE, sizeof=lambda v: len(v.body))
+
+metrics.register_cache(
+    "avatar_variants",
+    lambda: (avatar_cache.hits, avatar_cache.misses, len(avatar_cache)),
+)
+metrics.register_lru_cache("avatar_glyphs", get_glyph_mask)
+metrics.register_lru_cache("avatar_fonts", get_font)
+
+
+def _resize(data: bytes, size: int) -> bytes:
+    with Image.open(BytesIO(data)) as image:
+        image_format = image.format or "PNG"
+        variant = ImageOps.fit(image, (size, size), Image.Resampling.LANCZOS)
+        if image_format == "JPEG" and variant.mode != "RGB":
+            variant = variant.convert("RGB")
+        return _encode(variant, image_format)
+
+
+def is_default_avatar_in_use(db: Session, key: str) -> bool:
+    """Ссылается ли на аватар по умолчанию хотя бы один пользователь."""
+    query = select(User.id).where(User.avatar_url == f"/{path_from_key(key)}")
+    return db.scalar(query.limit(1)) is not None
+
+
+async def get_avatar_variant(
+    db: Session, key: str, size: Optional[int] = None
+) -> AvatarVariant:
+    """
+    Возвращает аватар (или его уменьшенную копию) из кэша в памяти.
+    Аватары по умолчанию рендерятся по ключу без обращения к хранилищу,
+    загруженные пользователями читаются из хранилища и масштабируются.
+    Бросает FileNotFoundError, если аватара нет.
+    """
+    cached = avatar_cache.get((key, size))
+    if cached is not None:
+        return cached
+
+    default = parse_default_avatar_key(key)
+    custom = CUSTOM_AVATAR_KEY_RE.match(key)
+    if default is not None:
+        # Рендерятся только аватары пользователей, иначе любой ключ такого
+        # вида тратил бы процессор и вытеснял из кэша настоящие аватары
+        if not await run_in_threadpool(is_default_avatar_in_use, db, key):
+            raise FileNotFoundError(key)
+        letter, color = default
+        body = await run_in_threadpool(
+            lambda: _encode(_render(letter, color, size or AVATAR_SIZE))
+        )
+        media_type = "image/png"
+    elif custom is not None:
+        # Все размеры загруженного аватара уже лежат в хранилище
+        variant_key = f"{custom.group(1)}/{size or AVATAR_SIZE}.{custom.group(2)}"
+        body = await get_storage().read_bytes(variant_key)
+        media_type = f"image/{custom.group(2)}"
+    else:
+        body = await get_storage().read_bytes(key)
+        if size is not None:
+            body = await run_in_threadpool(_resize, body, size)
+        media_type = mimetypes.guess_type(key)[0] or "application/octet-stream"
+
+    variant = AvatarVariant(body, media_type, make_etag(body))
+    avatar_cache.set((key, size), variant)
+    return variant
+
+
+def avatar_keys(avatar_url: str) -> List[str]:
+    """Все ключи хранилища, из которых состоит аватар."""
+    key = key_from_path(avatar_url)
+    custom = CUSTOM_AVATAR_KEY_RE.match(key)
+    if custom is None:
+        return [key]
+    return [
+        f"{custom.group(1)}/{size}.{custom.group(2)}" for size in AVATAR_VARIANT_SIZES
+    ]
+
+
+def _make_custom_variants(data: bytes) -> Dict[int, bytes]:
+    """
+    Декодирует загруженное изображение один раз и кодирует его квадратные
+    копии всех размеров. Метаданные (EXIF, ICC) не переносятся.
+    """
     try:
-        draw.text(
-            (100, 100),  # Центр изображения
-            letter,
-            fill="white",
-            font=font,
-            anchor="mm",
+        image = Image.open(BytesIO(data))
+        width, height = image.size
+        if width * height > settings.AVATAR_MAX_PIXELS:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail="Image dimensions are too large.",
+            )
+        # Поворот из EXIF применяется до того, как метаданные отбрасываются
+        image = ImageOps.exif_transpose(image)
+        has_alpha = image.mode in ("RGBA", "LA") or "transparency" in image.info
+        image = image.convert("RGBA" if has_alpha else "RGB")
+    except Image.DecompressionBombError:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail="Image dimensions are too large.",
         )
-    except (TypeError, AttributeError):
-        # Фоллбэк, если шрифт не поддерживает anchor (например, дефолтный шрифт).
-        # Этот метод центрирования менее точен и может использовать устаревшие функции.
-        width, height = draw.textsize(letter, font=font)
-        x = (200 - width) / 2
-        y = (200 - height) / 2
-        draw.text((x, y), letter, fill="white", font=font)
+    except (Image.UnidentifiedImageError, OSError):
+        raise HTTPException(status_code=400, detail="Invalid image file.")
 
-    # 4. Сохранение файла с уникальным именем
-    avatar_filename = f"{uuid.uuid4()}.png"
-    avatar_path = os.path.join(AVATAR_DIR, avatar_filename)
+    side = min(image.size)
+    image = ImageOps.fit(image, (side, side), Image.Resampling.LANCZOS)
 
-    # Убедимся, что директория существует прямо перед сохранением
-    os.makedirs(os.path.dirname(avatar_path), exist_ok=True)
+    image_format = custom_avatar_format()
+    variants = {}
+    for size in sorted(AVATAR_VARIANT_SIZES, reverse=True):
+        # Каждая копия уменьшается из предыдущей, а не из оригинала
+        image = image.resize((size, size), Image.Resampling.LANCZOS)
+        buffer = BytesIO()
+        image.save(buffer, format=image_format, quality=CUSTOM_AVATAR_QUALITY)
+        variants[size] = buffer.getvalue()
+    return variants
 
-    image.save(avatar_path)
 
-    # Возвращаем URL-путь для доступа через веб
-    return f"/{avatar_path.replace(os.path.sep, '/')}"
+def new_custom_avatar_key() -> str:
+    """
+    Ключ самой большой копии нового загруженного аватара. Выдаётся заранее,
+    чтобы записать намерение в журнал до сохранения файлов.
+    """
+    return f"avatars/{uuid.uuid4()}/{AVATAR_SIZE}.{custom_avatar_format().lower()}"
+
+
+async def save_custom_avatar(file: UploadFile, key: str) -> str:
+    """
+    Перекодирует загруженный аватар в набор размеров, сохраняет их под
+    ключом из `new_custom_avatar_key` и возвращает путь к самой большой копии.
+    """
+    data = bytearray()
+    while chunk := await file.read(CHUNK_SIZE):
+        data += chunk
+        if len(data) > settings.AVATAR_MAX_BYTES:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail="Avatar file is too large.",
+            )
+
+    variants = await run_in_threadpool(_make_custom_variants, bytes(data))
+
+    base_key, extension = CUSTOM_AVATAR_KEY_RE.match(key).groups()
+    storage = get_storage()
+    for size, body in variants.items():
+        await storage.save(f"{base_key}/{size}.{extension}", body)
+    return f"/{path_from_key(key)}"
+
+
+def evict_avatar(avatar_url: str) -> None:
+    """Убирает из кэша все варианты аватара."""
+    key = key_from_path(avatar_url)
+    for size in (None, *AVATAR_VARIANT_SIZES):
+        avatar_cache.pop((key, size))
+
+
+async def delete_avatar_file(avatar_url: str) -> None:
+    """Удаляет файлы аватара из хранилища и все его варианты из кэша."""
+    for variant_key in avatar_keys(avatar_url):
+        await get_storage().delete(variant_key)
+    evict_avatar(avatar_url)
@@ -0,0 +1,110 @@
+import logging
+import zlib
+from typing import AsyncIterable, AsyncIterator, Optional
+
+import anyio
+
+try:
+    import zstandard
+except ImportError:  # zstandard is an optional dependency
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# Size of the chunks used when streaming data through a codec
+CHUNK_SIZE = 1024 * 1024
+
+CODEC_SUFFIXES = {
+    "gzip": ".gz",
+    "zstd": ".zst",
+}
+
+
+def resolve_codec(codec: Optional[str]) -> Optional[str]:
+    """
+    Normalizes the configured codec name. Falls back to gzip if zstd is
+    requested but the `zstandard` package is not installed.
+    """
+    if not codec:
+        return None
+    codec = codec.lower()
+    if codec not in CODEC_SUFFIXES:
+        raise ValueError(f"Unsupported compression codec: {codec}")
+    if codec == "zstd" and zstandard is None:
+        logger.warning("zstandard is not installed, falling back to gzip.")
+        return "gzip"
+    return codec
+
+
+def codec_suffix(codec: Optional[str]) -> str:
+    """Returns the file suffix for a codec, or an empty string if uncompressed."""
+    return CODEC_SUFFIXES[codec] if codec else ""
+
+
+def codec_for_path(path: str) -> Optional[str]:
+    """Detects the codec of a stored file from its suffix."""
+    for codec, suffix in CODEC_SUFFIXES.items():
+        if path.endswith(suffix):
+            return codec
+    return None
+
+
+def strip_codec_suffix(path: str) -> str:
+    """
+    Returns the path without the compression suffix,
+    e.g. `table.csv.gz` -> `table.csv`.
+    """
+    codec = codec_for_path(path)
+    return path[: -len(CODEC_SUFFIXES[codec])] if codec else path
+
+
+def _compressor(codec: str):
+    if codec == "gzip":
+        # wbits=31 produces a gzip container, compatible with `gzip.open`
+        return zlib.compressobj(6, zlib.DEFLATED, 31)
+    return zstandard.ZstdCompressor(level=3).compressobj()
+
+
+def _decompressor(codec: str):
+    if codec == "gzip":
+        return zlib.decompressobj(31)
+    if zstandard is None:
+        raise RuntimeError("zstandard is required to read .zst files.")
+    return zstandard.ZstdDecompressor().decompressobj()
+
+
+async def compress_chunks(
+    chunks: AsyncIterable[bytes], codec: Optional[str]
+) -> AsyncIterator[bytes]:
+    """
+    Compresses a stream of chunks on the fly. The CPU-bound work runs in
+    a worker thread to keep the event loop responsive.
+    """
+    if not codec:
+        async for chunk in chunks:
+            yield chunk
+        return
+    compressor = _compressor(codec)
+    async for chunk in chunks:
+        data = await anyio.to_thread.run_sync(compressor.compress, chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+async def decompress_chunks(
+    chunks: AsyncIterable[bytes], codec: Optional[str]
+) -> AsyncIterator[bytes]:
+    """Decompresses a stream of chunks on the fly."""
+    if not codec:
+        async for chunk in chunks:
+            yield chunk
+        return
+    decompressor = _decompressor(codec)
+    async for chunk in chunks:
+        data = await anyio.to_thread.run_sync(decompressor.decompress, chunk)
+        if data:
+            yield data
+    tail = decompressor.flush()
+    if tail:
+        yield tail
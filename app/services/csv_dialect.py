@@ -0,0 +1,107 @@
+"""
+Detection of CSV encoding and dialect from the first bytes of a file.
+
+Uploaded CSVs come as UTF-8 or cp1251 with `,` or `;` delimiters. The dialect
+is sniffed once from a small sample of the upload stream, stored on the
+`Table` row and passed to every later `pd.read_csv` call, so reads never
+have to guess or retry.
+"""
+
+import codecs
+import csv
+from typing import List, Optional
+
+# Only this many bytes from the start of the file are inspected
+SNIFF_BYTES = 16 * 1024
+
+# latin-1 decodes any byte sequence, so it is the last resort
+ENCODINGS = ("utf-8", "cp1251", "latin-1")
+DELIMITERS = ",;\t|"
+
+
+def _detect_encoding(sample: bytes) -> str:
+    if sample.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    for encoding in ENCODINGS:
+        try:
+            sample.decode(encoding)
+        except UnicodeDecodeError as e:
+            # The sample may end in the middle of a multibyte character
+            if encoding == "utf-8" and e.start >= len(sample) - 3:
+                try:
+                    sample[: e.start].decode(encoding)
+                    return encoding
+                except UnicodeDecodeError:
+                    pass
+            continue
+        return encoding
+    return ENCODINGS[-1]
+
+
+def _is_number(value: str) -> bool:
+    try:
+        float(value.replace(",", "."))
+    except ValueError:
+        return False
+    return True
+
+
+def sniff_dialect(sample: bytes) -> dict:
+    """
+    Detects the encoding, delimiter, quote character and header presence
+    of a CSV file from its first bytes.
+    """
+    sample = sample[:SNIFF_BYTES]
+    encoding = _detect_encoding(sample)
+    text = sample.decode(encoding, errors="ignore")
+
+    # Drop the last line if the sample cut it in half
+    lines = text.splitlines()
+    if len(sample) == SNIFF_BYTES and len(lines) > 1:
+        lines = lines[:-1]
+    text = "\n".join(lines)
+
+    sniffer = csv.Sniffer()
+    try:
+        dialect = sniffer.sniff(text, delimiters=DELIMITERS)
+        delimiter, quotechar = dialect.delimiter, dialect.quotechar
+    except csv.Error:
+        delimiter, quotechar = ",", '"'
+
+    # Sniffer.has_header often misjudges all-text tables, so a header is
+    # assumed unless the first row also contains numbers.
+    has_header = True
+    if len(lines) > 1:
+        first_row = next(
+            csv.reader([lines[0]], delimiter=delimiter, quotechar=quotechar)
+        )
+        try:
+            looks_like_data = not sniffer.has_header(text)
+        except csv.Error:
+            looks_like_data = False
+        if looks_like_data and any(_is_number(value) for value in first_row):
+            has_header = False
+
+    return {
+        "encoding": encoding,
+        "delimiter": delimiter,
+        "quotechar": quotechar,
+        "has_header": has_header,
+    }
+
+
+def read_csv_kwargs(dialect: Optional[dict]) -> dict:
+    """Builds `pd.read_csv` arguments for a stored dialect."""
+    if not dialect:
+        return {}
+    return {
+        "encoding": dialect["encoding"],
+        "sep": dialect["delimiter"],
+        "quotechar": dialect["quotechar"],
+        "header": 0 if dialect["has_header"] else None,
+    }
+
+
+def default_column_names(count: int) -> List[str]:
+    """Column names used for files without a header row."""
+    return [f"column_{i}" for i in range(1, count + 1)]
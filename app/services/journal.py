@@ -0,0 +1,85 @@
+"""
+Intent journal for storage side effects.
+
+Every code path that writes or deletes a stored file records an intent
+first and marks it done once the file operation has finished:
+
+    intents = journal.record(db, journal.WRITE, [(journal.TABLE, key)])
+    db.commit()                      # durable before the file exists
+    await storage.save(key, ...)
+    ... create the row ...
+    journal.mark_done(db, intents)
+    db.commit()
+
+Intents of deletions are committed together with the database change they
+belong to. A crash between the two steps leaves a pending intent behind,
+which `services.reconciliation.replay_journal` resolves by looking at the
+row and the file of that key only.
+"""
+
+from typing import Iterable, List, NamedTuple, Tuple
+
+from sqlalchemy import insert, update
+from sqlalchemy.orm import Session
+
+from features.journal.models import StorageIntent
+
+WRITE = "write"
+DELETE = "delete"
+
+TABLE = "table"
+SNAPSHOT = "snapshot"
+AVATAR = "avatar"
+
+PENDING = "pending"
+DONE = "done"
+
+
+class Intents(NamedTuple):
+    operation: str
+    keys: List[str]
+
+
+def record(db: Session, operation: str, entries: Iterable[Tuple[str, str]]) -> Intents:
+    """
+    Adds pending intents for `(kind, key)` pairs to the current transaction.
+    Does not commit.
+    """
+    rows = [{"operation": operation, "kind": kind, "key": key} for kind, key in entries]
+    if rows:
+        # One executemany; fetching generated ids would insert row by row
+        db.execute(insert(StorageIntent), rows)
+    return Intents(operation, [row["key"] for row in rows])
+
+
+def mark_done(db: Session, intents: Intents) -> None:
+    """Marks intents as finished. Does not commit."""
+    if intents.keys:
+        db.execute(
+            update(StorageIntent)
+            .where(
+                StorageIntent.operation == intents.operation,
+                StorageIntent.key.in_(intents.keys),
+                StorageIntent.status == PENDING,
+            )
+            .values(status=DONE)
+            .execution_options(synchronize_session=False)
+        )
+
+
+def record_and_commit(
+    db: Session, operation: str, entries: Iterable[Tuple[str, str]]
+) -> Intents:
+    """
+    Records intents in a transaction of their own. Blocking, async callers
+    run it with `run_in_threadpool`.
+    """
+    intents = record(db, operation, entries)
+    db.commit()
+    return intents
+
+
+def mark_done_and_commit(db: Session, intents: Intents) -> None:
+    """Marks intents as finished and commits. Blocking, like `record_and_commit`."""
+    mark_done(db, intents)
+    db.commit()
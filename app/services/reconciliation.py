@@ -0,0 +1,560 @@
+"""
+Reconciliation of database rows with the files in storage.
+
+A full pass:
+1. Lists every stored key under `avatars/` and `tables/` once.
+2. Streams users and tables from the database in batches (`yield_per`),
+   checking their files against that listing and removing every referenced
+   key from it, so what is left at the end are orphans. Only the listing
+   and the ids of broken rows are held in memory, never the ORM objects.
+3. Resets avatars whose files are missing and deletes table rows whose
+   files are missing, in chunked set-based statements.
+4. Deletes orphan files in chunks with bounded concurrency; local storage
+   runs every deletion in a worker thread.
+
+The storage listing is taken before the database is read, so a row
+committed during the pass may reference a file stored after the listing
+and look broken. Broken rows are therefore re-checked against the storage
+with their current paths right before they are changed, and orphan table
+files are re-checked against the database right before they are deleted,
+to spare uploads committed while the pass was running.
+
+An incremental pass (`replay_journal`) checks only the keys recorded in
+the intent journal (see `services.journal`) since the last checkpoint, so
+its cost follows recent activity rather than the size of the storage. Both
+passes advance the checkpoint up to the first pending intent that is still
+within `STORAGE_JOURNAL_GRACE_PERIOD`, as its upload may still be running,
+and neither treats the files of such uploads as orphans. Entries whose
+files could not be deleted are kept behind the checkpoint and read again
+by the next incremental pass, so a failing key never holds back the rest.
+"""
+
+import asyncio
+import logging
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import timedelta
+from typing import Dict, Iterator, List, Optional, Sequence, Set, Tuple
+
+from sqlalchemy import delete, func, or_, select, update
+from sqlalchemy.engine import Connection, Engine
+
+from core.config import settings
+from features.journal.models import JournalCheckpoint, StorageIntent, utcnow
+from features.tables.models import Table, TableColumn
+from features.users.models import User
+from services import journal, search_index
+from services.avatar_service import avatar_keys, is_shared_default_avatar
+from services.storage import StorageBackend, key_from_path, path_from_key
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+DELETE_CONCURRENCY = 16
+# Temporary files of uploads in progress (see LocalStorage.save)
+PARTIAL_SUFFIX = ".part"
+CHECKPOINT = "sync"
+
+
+@dataclass
+class ReconciliationReport:
+    dry_run: bool
+    stored_files: int = 0
+    users_checked: int = 0
+    tables_checked: int = 0
+    avatars_reset: int = 0
+    tables_deleted: int = 0
+    snapshots_reset: int = 0
+    journal_entries: int = 0
+    orphan_files: int = 0
+    files_deleted: int = 0
+    failed_deletions: int = 0
+    # Seconds per phase, summed over batches
+    timings: Dict[str, float] = field(default_factory=dict)
+
+    @contextmanager
+    def timed(self, phase: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.timings[phase] = self.timings.get(phase, 0.0) + elapsed
+
+
+def _chunks(items: List, size: int) -> Iterator[List]:
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
+def _check_avatars(
+    engine: Engine, stored: Set[str], report: ReconciliationReport, batch_size: int
+) -> List[int]:
+    """Returns ids of users whose uploaded avatar is missing."""
+    missing = []
+    query = select(User.id, User.avatar_url).where(User.avatar_url.isnot(None))
+    with engine.connect() as conn:
+        rows = conn.execution_options(yield_per=batch_size).execute(query)
+        for user_id, avatar_url in rows:
+            report.users_checked += 1
+            # Shared default avatars are rendered from their key when missing,
+            # uploaded ones belong to a single user
+            if (
+                not is_shared_default_avatar(avatar_url)
+                and key_from_path(avatar_url) not in stored
+            ):
+                missing.append(user_id)
+            stored.difference_update(avatar_keys(avatar_url))
+    return missing
+
+
+def _check_tables(
+    engine: Engine, stored: Set[str], report: ReconciliationReport, batch_size: int
+) -> List[int]:
+    """Returns ids of tables whose file is missing."""
+    missing = []
+    query = select(Table.id, Table.file_path, Table.snapshot_path)
+    with engine.connect() as conn:
+        rows = conn.execution_options(yield_per=batch_size).execute(query)
+        for table_id, file_path, snapshot_path in rows:
+            report.tables_checked += 1
+            key = key_from_path(file_path)
+            if key not in stored:
+                missing.append(table_id)
+            else:
+                stored.discard(key)
+                # The snapshot of a broken table is left over as an orphan
+                if snapshot_path:
+                    stored.discard(key_from_path(snapshot_path))
+    return missing
+
+
+def _apply_db_changes(
+    engine: Engine,
+    missing_avatars: List[int],
+    missing_tables: List[int],
+    batch_size: int,
+    missing_snapshots: List[int] = (),
+) -> None:
+    for ids in _chunks(missing_avatars, batch_size):
+        with engine.begin() as conn:
+            conn.execute(
+                update(User)
+                .where(User.id.in_(ids))
+                .values(avatar_url=None, is_default_avatar=True)
+            )
+    for ids in _chunks(list(missing_snapshots), batch_size):
+        # Tables without a snapshot are loaded from the original file
+        with engine.begin() as conn:
+            conn.execute(
+                update(Table).where(Table.id.in_(ids)).values(snapshot_path=None)
+            )
+    for ids in _chunks(missing_tables, batch_size):
+        # Bulk deletes bypass the ORM cascade to the schema index
+        with engine.begin() as conn:
+            conn.execute(delete(TableColumn).where(TableColumn.table_id.in_(ids)))
+            search_index.remove_tables(conn, ids)
+            conn.execute(delete(Table).where(Table.id.in_(ids)))
+
+
+def _current_keys(
+    engine: Engine,
+    missing_avatars: List[int],
+    missing_tables: List[int],
+    batch_size: int,
+) -> Tuple[Dict[int, str], Dict[int, str]]:
+    """Current avatar and table file keys of the rows found broken by the scan."""
+    avatars, tables = {}, {}
+    with engine.connect() as conn:
+        for ids in _chunks(missing_avatars, batch_size):
+            query = select(User.id, User.avatar_url).where(
+                User.id.in_(ids), User.avatar_url.isnot(None)
+            )
+            for user_id, avatar_url in conn.execute(query):
+                if not is_shared_default_avatar(avatar_url):
+                    avatars[user_id] = key_from_path(avatar_url)
+        for ids in _chunks(missing_tables, batch_size):
+            query = select(Table.id, Table.file_path).where(Table.id.in_(ids))
+            for table_id, file_path in conn.execute(query):
+                tables[table_id] = key_from_path(file_path)
+    return avatars, tables
+
+
+async def _recheck_missing(
+    engine: Engine,
+    storage: StorageBackend,
+    missing_avatars: List[int],
+    missing_tables: List[int],
+    batch_size: int,
+    concurrency: int,
+) -> Tuple[List[int], List[int]]:
+    """
+    Keeps the rows found broken by the scan whose files are still missing,
+    dropping files stored after the listing and rows changed or deleted since.
+    """
+    avatars, tables = await asyncio.to_thread(
+        _current_keys, engine, missing_avatars, missing_tables, batch_size
+    )
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def exists(key: str) -> bool:
+        async with semaphore:
+            return await storage.exists(key)
+
+    async def still_missing(keys: Dict[int, str]) -> List[int]:
+        ids = list(keys)
+        stored = await asyncio.gather(*(exists(keys[id_]) for id_ in ids))
+        return [id_ for id_, is_stored in zip(ids, stored) if not is_stored]
+
+    return await still_missing(avatars), await still_missing(tables)
+
+
+def _still_referenced(engine: Engine, keys: List[str]) -> Set[str]:
+    """Table files among `keys` that got a database row since the scan."""
+    paths = [path_from_key(key) for key in keys if key.startswith("tables/")]
+    if not paths:
+        return set()
+    query = select(Table.file_path, Table.snapshot_path).where(
+        or_(Table.file_path.in_(paths), Table.snapshot_path.in_(paths))
+    )
+    with engine.connect() as conn:
+        return {
+            key_from_path(path)
+            for row in conn.execute(query)
+            for path in row
+            if path is not None
+        }
+
+
+async def _delete_files(
+    storage: StorageBackend,
+    engine: Engine,
+    orphans: List[str],
+    report: ReconciliationReport,
+    batch_size: int,
+    concurrency: int,
+) -> Set[str]:
+    """Deletes orphan files, returns the keys that could not be deleted."""
+    semaphore = asyncio.Semaphore(concurrency)
+    failed = set()
+
+    async def delete_one(key: str) -> None:
+        async with semaphore:
+            try:
+                if await storage.delete(key):
+                    report.files_deleted += 1
+            except Exception as e:
+                report.failed_deletions += 1
+                failed.add(key)
+                logger.warning(f"Failed to delete orphan file {key}: {e}")
+
+    for chunk in _chunks(orphans, batch_size):
+        referenced = await asyncio.to_thread(_still_referenced, engine, chunk)
+        await asyncio.gather(
+            *(delete_one(key) for key in chunk if key not in referenced)
+        )
+    return failed
+
+
+def _checkpoint(conn: Connection) -> int:
+    position = conn.scalar(
+        select(JournalCheckpoint.position).where(JournalCheckpoint.name == CHECKPOINT)
+    )
+    return position or 0
+
+
+def _safe_position(engine: Engine, grace: float) -> int:
+    """
+    Highest journal id that can be reconciled now: the one right before the
+    oldest pending intent younger than `grace` seconds, or the last one.
+    """
+    cutoff = utcnow() - timedelta(seconds=grace)
+    with engine.connect() as conn:
+        checkpoint = _checkpoint(conn)
+        in_flight = conn.scalar(
+            select(func.min(StorageIntent.id)).where(
+                StorageIntent.id > checkpoint,
+                StorageIntent.status == journal.PENDING,
+                StorageIntent.created_at > cutoff,
+            )
+        )
+        if in_flight is not None:
+            return in_flight - 1
+        last = conn.scalar(select(func.max(StorageIntent.id)))
+        return max(last or 0, checkpoint)
+
+
+def _in_flight_keys(engine: Engine, grace: float) -> Set[str]:
+    """Keys of writes still pending and younger than `grace` seconds."""
+    cutoff = utcnow() - timedelta(seconds=grace)
+    query = select(StorageIntent.kind, StorageIntent.key).where(
+        StorageIntent.operation == journal.WRITE,
+        StorageIntent.status == journal.PENDING,
+        StorageIntent.created_at > cutoff,
+    )
+    keys = set()
+    with engine.connect() as conn:
+        for kind, key in conn.execute(query):
+            if kind == journal.AVATAR:
+                keys.update(avatar_keys(f"/{path_from_key(key)}"))
+            else:
+                keys.add(key)
+    return keys
+
+
+def _advance_checkpoint(
+    engine: Engine, position: int, retry: Sequence[int] = ()
+) -> None:
+    """
+    Moves the checkpoint forward and prunes the entries behind it, except
+    the `retry` ones.
+    """
+    with engine.begin() as conn:
+        if _checkpoint(conn) >= position:
+            # Entries read again from behind the checkpoint may be done now
+            conn.execute(
+                delete(StorageIntent).where(
+                    StorageIntent.id <= position, StorageIntent.id.not_in(retry)
+                )
+            )
+            return
+        updated = conn.execute(
+            update(JournalCheckpoint)
+            .where(JournalCheckpoint.name == CHECKPOINT)
+            .values(position=position)
+        )
+        if not updated.rowcount:
+            conn.execute(
+                JournalCheckpoint.__table__.insert().values(
+                    name=CHECKPOINT, position=position
+                )
+            )
+        conn.execute(
+            delete(StorageIntent).where(
+                StorageIntent.id <= position, StorageIntent.id.not_in(retry)
+            )
+        )
+
+
+@dataclass
+class _JournalBatch:
+    """Database changes and orphan files found in a batch of journal entries."""
+
+    missing_avatars: List[int] = field(default_factory=list)
+    missing_tables: List[int] = field(default_factory=list)
+    missing_snapshots: List[int] = field(default_factory=list)
+    # Orphan files with the journaled `(kind, key)` they were found through
+    orphans: Dict[str, Tuple[str, str]] = field(default_factory=dict)
+
+
+def _read_journal(engine: Engine, after: int, until: int, limit: int) -> List:
+    """Up to `limit` entries with ids in `(after, until]`, oldest first."""
+    query = (
+        select(StorageIntent.id, StorageIntent.kind, StorageIntent.key)
+        .where(StorageIntent.id > after, StorageIntent.id <= until)
+        .order_by(StorageIntent.id)
+        .limit(limit)
+    )
+    with engine.connect() as conn:
+        return conn.execute(query).all()
+
+
+def _referencing_rows(engine: Engine, keys: Dict[str, Set[str]]) -> Dict:
+    """
+    Maps journaled keys to the rows that reference them: table files and
+    snapshots to `(table id, snapshot path)`, avatars to user ids.
+    """
+    referenced = {}
+    table_paths = [path_from_key(key) for key in keys[journal.TABLE]]
+    snapshot_paths = [path_from_key(key) for key in keys[journal.SNAPSHOT]]
+    avatar_urls = [f"/{path_from_key(key)}" for key in keys[journal.AVATAR]]
+    with engine.connect() as conn:
+        if table_paths:
+            query = select(Table.id, Table.file_path, Table.snapshot_path).where(
+                Table.file_path.in_(table_paths)
+            )
+            for table_id, file_path, snapshot_path in conn.execute(query):
+                referenced[(journal.TABLE, key_from_path(file_path))] = (
+                    table_id,
+                    snapshot_path,
+                )
+        if snapshot_paths:
+            query = select(Table.id, Table.snapshot_path).where(
+                Table.snapshot_path.in_(snapshot_paths)
+            )
+            for table_id, snapshot_path in conn.execute(query):
+                referenced[(journal.SNAPSHOT, key_from_path(snapshot_path))] = table_id
+        if avatar_urls:
+            query = select(User.id, User.avatar_url).where(
+                User.avatar_url.in_(avatar_urls)
+            )
+            for user_id, avatar_url in conn.execute(query):
+                referenced[(journal.AVATAR, key_from_path(avatar_url))] = user_id
+    return referenced
+
+
+async def _check_journal_batch(
+    engine: Engine,
+    storage: StorageBackend,
+    rows: List,
+    concurrency: int,
+) -> _JournalBatch:
+    keys: Dict[str, Set[str]] = {
+        journal.TABLE: set(),
+        journal.SNAPSHOT: set(),
+        journal.AVATAR: set(),
+    }
+    for row in rows:
+        keys[row.kind].add(row.key)
+    referenced = await asyncio.to_thread(_referencing_rows, engine, keys)
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def exists(key: str) -> bool:
+        async with semaphore:
+            return await storage.exists(key)
+
+    entries = [(kind, key) for kind in keys for key in sorted(keys[kind])]
+    stored = await asyncio.gather(*(exists(key) for _, key in entries))
+
+    batch = _JournalBatch()
+    for (kind, key), is_stored in zip(entries, stored):
+        row = referenced.get((kind, key))
+        if row is None:
+            if kind == journal.AVATAR:
+                # Uploaded avatars are stored in several sizes
+                for orphan in avatar_keys(f"/{path_from_key(key)}"):
+                    batch.orphans[orphan] = (kind, key)
+            elif is_stored:
+                batch.orphans[key] = (kind, key)
+        elif not is_stored:
+            if kind == journal.TABLE:
+                table_id, snapshot_path = row
+                batch.missing_tables.append(table_id)
+                if snapshot_path:
+                    batch.orphans[key_from_path(snapshot_path)] = (kind, key)
+            elif kind == journal.SNAPSHOT:
+                batch.missing_snapshots.append(row)
+            else:
+                batch.missing_avatars.append(row)
+    return batch
+
+
+async def replay_journal(
+    engine: Engine,
+    storage: StorageBackend,
+    *,
+    dry_run: bool = False,
+    grace: Optional[float] = None,
+    batch_size: int = BATCH_SIZE,
+    concurrency: int = DELETE_CONCURRENCY,
+) -> ReconciliationReport:
+    """
+    Runs an incremental pass over the journal entries recorded since the
+    last checkpoint, see the module docstring.
+    """
+    if grace is None:
+        grace = settings.STORAGE_JOURNAL_GRACE_PERIOD
+    report = ReconciliationReport(dry_run=dry_run)
+
+    with report.timed("read journal"):
+        until = await asyncio.to_thread(_safe_position, engine, grace)
+
+    # Everything behind the checkpoint is pruned but the entries kept for a
+    # retry, so reading from the start gets those and the new entries
+    start = 0
+    retry: List[int] = []
+    while rows := await asyncio.to_thread(
+        _read_journal, engine, start, until, batch_size
+    ):
+        start = rows[-1].id
+        report.journal_entries += len(rows)
+        with report.timed("check entries"):
+            batch = await _check_journal_batch(engine, storage, rows, concurrency)
+        report.avatars_reset += len(batch.missing_avatars)
+        report.tables_deleted += len(batch.missing_tables)
+        report.snapshots_reset += len(batch.missing_snapshots)
+        report.orphan_files += len(batch.orphans)
+        if dry_run:
+            continue
+
+        with report.timed("update database"):
+            await asyncio.to_thread(
+                _apply_db_changes,
+                engine,
+                batch.missing_avatars,
+                batch.missing_tables,
+                batch_size,
+                batch.missing_snapshots,
+            )
+        with report.timed("delete orphan files"):
+            failed = await _delete_files(
+                storage, engine, sorted(batch.orphans), report, batch_size, concurrency
+            )
+        failed_entries = {batch.orphans[key] for key in failed}
+        retry.extend(row.id for row in rows if (row.kind, row.key) in failed_entries)
+
+    # Entries whose files could not be deleted are retried by the next pass
+    if not dry_run:
+        await asyncio.to_thread(_advance_checkpoint, engine, until, retry)
+    return report
+
+
+async def reconcile(
+    engine: Engine,
+    storage: StorageBackend,
+    *,
+    dry_run: bool = False,
+    batch_size: int = BATCH_SIZE,
+    concurrency: int = DELETE_CONCURRENCY,
+) -> ReconciliationReport:
+    """Runs a full reconciliation pass, see the module docstring."""
+    report = ReconciliationReport(dry_run=dry_run)
+    # Everything journaled before the scan is covered by it
+    position = await asyncio.to_thread(
+        _safe_position, engine, settings.STORAGE_JOURNAL_GRACE_PERIOD
+    )
+
+    with report.timed("scan storage"):
+        stored = set(await storage.list_keys("avatars/"))
+        stored.update(await storage.list_keys("tables/"))
+        stored = {key for key in stored if not key.endswith(PARTIAL_SUFFIX)}
+    report.stored_files = len(stored)
+
+    with report.timed("check avatars"):
+        missing_avatars = await asyncio.to_thread(
+            _check_avatars, engine, stored, report, batch_size
+        )
+    with report.timed("check tables"):
+        missing_tables = await asyncio.to_thread(
+            _check_tables, engine, stored, report, batch_size
+        )
+    report.avatars_reset = len(missing_avatars)
+    report.tables_deleted = len(missing_tables)
+    # Files of uploads still running have no row yet
+    stored.difference_update(
+        await asyncio.to_thread(
+            _in_flight_keys, engine, settings.STORAGE_JOURNAL_GRACE_PERIOD
+        )
+    )
+    orphans = sorted(stored)
+    report.orphan_files = len(orphans)
+
+    if dry_run:
+        return report
+
+    with report.timed("update database"):
+        missing_avatars, missing_tables = await _recheck_missing(
+            engine, storage, missing_avatars, missing_tables, batch_size, concurrency
+        )
+        report.avatars_reset = len(missing_avatars)
+        report.tables_deleted = len(missing_tables)
+        await asyncio.to_thread(
+            _apply_db_changes, engine, missing_avatars, missing_tables, batch_size
+        )
+    with report.timed("delete orphan files"):
+        await _delete_files(storage, engine, orphans, report, batch_size, concurrency)
+    if not report.failed_deletions:
+        await asyncio.to_thread(_advance_checkpoint, engine, position)
+    return report
@@ -0,0 +1,219 @@
+"""
+Full-text index of table names and cell values.
+
+The index is an SQLite FTS5 table in the application database (see
+`features.tables.models.SEARCH_INDEX_DDL`) with one document per distinct
+value of every column of a table, plus one for the table name. A document
+keeps the value, the column, the number of rows holding it and the first
+`MAX_POSITIONS` of their row positions, so a search returns tables,
+columns and rows without opening any file.
+
+Every document also carries reference tokens in the `ref` column: `u<id>`
+of the owner, `t<id>` of the table and `n<id>` on the name document. A
+search matches the owner token together with the query, so FTS5 only
+intersects the posting lists of the user's documents; deletions and
+renames find the documents of a table the same way.
+
+Tables are indexed by the processing pipeline (`table_processing`),
+renamed with `rename_table` and dropped by every path deleting tables.
+"""
+
+from __future__ import annotations
+
+from collections import OrderedDict
+from typing import Iterator, Sequence, Tuple, Union
+
+from fastapi import HTTPException, status
+from sqlalchemy import select, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session
+
+from core.lazy import lazy_import
+from features.tables.models import SEARCH_INDEX_TABLE as INDEX_TABLE, Table
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+# Row positions stored per value; `row_count` has the total
+MAX_POSITIONS = 100
+# Documents inserted per transaction
+INSERT_BATCH_SIZE = 2_000
+MAX_RESULTS = 500
+
+Executor = Union[Session, Connection]
+
+_INSERT = text(
+    f"INSERT INTO {INDEX_TABLE} "
+    "(value, ref, table_id, column_name, positions, row_count) "
+    "VALUES (:value, :ref, :table_id, :column_name, :positions, :row_count)"
+)
+
+
+def _tokens(prefix: str, ids: Sequence[int]) -> str:
+    return " OR ".join(f'"{prefix}{id_}"' for id_ in ids)
+
+
+def _delete_matching(db: Executor, match: str) -> None:
+    db.execute(
+        text(
+            f"DELETE FROM {INDEX_TABLE} WHERE rowid IN "
+            f"(SELECT rowid FROM {INDEX_TABLE} WHERE {INDEX_TABLE} MATCH :match)"
+        ),
+        {"match": match},
+    )
+
+
+def remove_tables(db: Executor, table_ids: Sequence[int]) -> None:
+    """Drops the documents of tables. Does not commit."""
+    if table_ids:
+        _delete_matching(db, f"ref : ({_tokens('t', table_ids)})")
+
+
+def remove_users(db: Executor, user_ids: Sequence[int]) -> None:
+    """Drops the documents of all tables of users. Does not commit."""
+    if user_ids:
+        _delete_matching(db, f"ref : ({_tokens('u', user_ids)})")
+
+
+def rename_table(db: Executor, table_id: int, user_id: int, table_name: str) -> None:
+    """Updates the name document of a table of the user. Does not commit."""
+    db.execute(
+        text(
+            f"UPDATE {INDEX_TABLE} SET value = :value WHERE rowid IN "
+            f"(SELECT rowid FROM {INDEX_TABLE} WHERE {INDEX_TABLE} MATCH :match)"
+        ),
+        {"value": table_name, "match": f'ref : ("n{table_id}" AND "u{user_id}")'},
+    )
+
+
+def column_documents(series: pd.Series) -> Iterator[Tuple[str, str, int]]:
+    """Yields `(value, positions, row_count)` for every distinct value of a column."""
+    codes, uniques = pd.factorize(series, use_na_sentinel=True)
+    if not len(uniques):
+        return
+    values = pd.Index(uniques).astype(str)
+    counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+    # Row positions grouped by value, in row order; missing values sort first
+    order = np.argsort(codes, kind="stable")[len(codes) - counts.sum() :]
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    for value, start, count in zip(values, starts, counts):
+        if not value.strip():
+            continue
+        positions = order[start : start + min(count, MAX_POSITIONS)]
+        yield value, " ".join(map(str, positions)), int(count)
+
+
+def _insert(engine: Engine, batch: list) -> None:
+    with engine.begin() as conn:
+        conn.execute(_INSERT, batch)
+
+
+def index_table(engine: Engine, table: Table, df: pd.DataFrame) -> None:
+    """
+    Replaces the documents of a table with its name and the values of `df`.
+    Runs in a worker thread. Every batch is committed in a short transaction
+    of its own, so request handlers never wait for a whole table to be
+    indexed to write to the database.
+    """
+    with engine.begin() as conn:
+        remove_tables(conn, [table.id])
+    ref = f"u{table.user_id} t{table.id}"
+    batch = [
+        {
+            "value": table.table_name,
+            "ref": f"{ref} n{table.id}",
+            "table_id": table.id,
+            "column_name": None,
+            "positions": "",
+            "row_count": 0,
+        }
+    ]
+    for column in df.columns:
+        for value, positions, row_count in column_documents(df[column]):
+            batch.append(
+                {
+                    "value": value,
+                    "ref": ref,
+                    "table_id": table.id,
+                    "column_name": str(column),
+                    "positions": positions,
+                    "row_count": row_count,
+                }
+            )
+            if len(batch) >= INSERT_BATCH_SIZE:
+                _insert(engine, batch)
+                batch = []
+    if batch:
+        _insert(engine, batch)
+
+
+def drop_table(engine: Engine, table_id: int) -> None:
+    """Drops the documents of a table in a transaction of its own."""
+    with engine.begin() as conn:
+        remove_tables(conn, [table_id])
+
+
+def _match_expression(query: str) -> str:
+    """
+    Turns a user query into an FTS5 expression: all words must match, a
+    trailing `*` matches words starting with the given prefix.
+    """
+    terms = []
+    for word in query.split():
+        prefix = word.endswith("*")
+        word = word.rstrip("*").replace('"', '""')
+        if word:
+            terms.append(f'"{word}"' + ("*" if prefix else ""))
+    if not terms:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="The search query is empty.",
+        )
+    return " ".join(terms)
+
+
+def search_tables(db: Session, user_id: int, query: str, limit: int = 50) -> list:
+    """
+    Returns the tables of a user with names or values matching `query`, most
+    relevant first, with up to `limit` matching values in total.
+    """
+    match = f'ref : "u{user_id}" AND value : ({_match_expression(query)})'
+    rows = db.execute(
+        text(
+            "SELECT table_id, column_name, value, positions, row_count "
+            f"FROM {INDEX_TABLE} WHERE {INDEX_TABLE} MATCH :match "
+            "ORDER BY rank LIMIT :limit"
+        ),
+        {"match": match, "limit": min(limit, MAX_RESULTS)},
+    ).all()
+    if not rows:
+        return []
+
+    names = dict(
+        db.execute(
+            select(Table.id, Table.table_name).where(
+                Table.id.in_({row.table_id for row in rows}), Table.user_id == user_id
+            )
+        ).all()
+    )
+    results: "OrderedDict[int, dict]" = OrderedDict()
+    for row in rows:
+        if row.table_id not in names:
+            continue
+        result = results.setdefault(
+            row.table_id,
+            {
+                "table_id": row.table_id,
+                "table_name": names[row.table_id],
+                "matches": [],
+            },
+        )
+        result["matches"].append(
+            {
+                "column": row.column_name,
+                "value": row.value,
+                "rows": [int(position) for position in row.positions.split()],
+                "row_count": row.row_count,
+            }
+        )
+    return list(results.values())
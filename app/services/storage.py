@@ -0,0 +1,437 @@
+"""
+Storage backends for uploaded files (tables and avatars).
+
+Files are addressed by slash-separated keys relative to the uploads root,
+e.g. `tables/1/<uuid>.csv` or `avatars/<uuid>.png`. The database keeps the
+legacy `uploads/...` paths and URLs, use `key_from_path` to convert them.
+"""
+
+from __future__ import annotations
+
+import abc
+import contextlib
+import datetime
+import hashlib
+import hmac
+import os
+import uuid
+import xml.etree.ElementTree as ET
+from functools import lru_cache
+from typing import AsyncIterable, AsyncIterator, Dict, List, Optional, Union
+from urllib.parse import quote
+
+import anyio
+
+from core.config import settings
+from core.lazy import lazy_import
+
+# Only the S3 backend needs an HTTP client
+httpx = lazy_import("httpx")
+
+CHUNK_SIZE = 1024 * 1024
+
+Data = Union[bytes, AsyncIterable[bytes]]
+
+
+async def _iter_data(data: Data) -> AsyncIterator[bytes]:
+    if isinstance(data, (bytes, bytearray)):
+        yield bytes(data)
+    else:
+        async for chunk in data:
+            yield chunk
+
+
+class StorageBackend(abc.ABC):
+    """
+    Async interface for storing files. All reads and writes are streamed
+    in chunks so that large tables never have to be held in memory.
+    """
+
+    @abc.abstractmethod
+    async def save(self, key: str, data: Data) -> int:
+        """
+        Stores bytes or an async iterable of chunks under `key`, replacing
+        any existing object. Returns the number of bytes written.
+        """
+
+    @abc.abstractmethod
+    def iter_bytes(
+        self,
+        key: str,
+        start: int = 0,
+        end: Optional[int] = None,
+        chunk_size: int = CHUNK_SIZE,
+    ) -> AsyncIterator[bytes]:
+        """
+        Streams the object, optionally limited to the inclusive byte range
+        `[start, end]`. Raises FileNotFoundError if the key does not exist.
+        """
+
+    @abc.abstractmethod
+    async def exists(self, key: str) -> bool:
+        """Checks whether an object is stored under `key`."""
+
+    @abc.abstractmethod
+    async def size(self, key: str) -> int:
+        """Returns the object size in bytes, raises FileNotFoundError if missing."""
+
+    @abc.abstractmethod
+    async def delete(self, key: str) -> bool:
+        """Deletes the object. Returns False if it did not exist."""
+
+    @abc.abstractmethod
+    async def list_keys(self, prefix: str = "") -> List[str]:
+        """Lists all keys starting with `prefix`, recursively."""
+
+    async def read_bytes(
+        self, key: str, start: int = 0, end: Optional[int] = None
+    ) -> bytes:
+        return b"".join([chunk async for chunk in self.iter_bytes(key, start, end)])
+
+
+class LocalStorage(StorageBackend):
+    """Stores files on the local filesystem under `root`."""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def path(self, key: str) -> str:
+        parts = key.split("/")
+        if any(part in ("", ".", "..") for part in parts):
+            raise ValueError(f"Invalid storage key: {key}")
+        return os.path.join(self.root, *parts)
+
+    async def save(self, key: str, data: Data) -> int:
+        path = self.path(key)
+        await anyio.Path(path).parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temporary file first so readers never see partial files
+        tmp_path = f"{path}.{uuid.uuid4().hex}.part"
+        written = 0
+        try:
+            async with await anyio.open_file(tmp_path, "wb") as f:
+                async for chunk in _iter_data(data):
+                    await f.write(chunk)
+                    written += len(chunk)
+            await anyio.to_thread.run_sync(os.replace, tmp_path, path)
+        except BaseException:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(tmp_path)
+            raise
+        return written
+
+    async def iter_bytes(
+        self,
+        key: str,
+        start: int = 0,
+        end: Optional[int] = None,
+        chunk_size: int = CHUNK_SIZE,
+    ) -> AsyncIterator[bytes]:
+        async with await anyio.open_file(self.path(key), "rb") as f:
+            if start:
+                await f.seek(start)
+            remaining = None if end is None else end - start + 1
+            while remaining is None or remaining > 0:
+                size = chunk_size if remaining is None else min(chunk_size, remaining)
+                chunk = await f.read(size)
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
+    async def exists(self, key: str) -> bool:
+        return await anyio.Path(self.path(key)).is_file()
+
+    async def size(self, key: str) -> int:
+        return (await anyio.Path(self.path(key)).stat()).st_size
+
+    async def delete(self, key: str) -> bool:
+        try:
+            await anyio.to_thread.run_sync(os.remove, self.path(key))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def _scan(self, directory: str, prefix: str) -> List[str]:
+        keys = []
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    keys.extend(self._scan(entry.path, f"{prefix}{entry.name}/"))
+                elif entry.is_file(follow_symlinks=False):
+                    keys.append(f"{prefix}{entry.name}")
+        return keys
+
+    async def list_keys(self, prefix: str = "") -> List[str]:
+        # Scan the deepest directory covered by the prefix, then filter
+        directory_prefix = prefix.rsplit("/", 1)[0] + "/" if "/" in prefix else ""
+        directory = (
+            self.path(directory_prefix.rstrip("/")) if directory_prefix else self.root
+        )
+        if not os.path.isdir(directory):
+            return []
+        keys = await anyio.to_thread.run_sync(self._scan, directory, directory_prefix)
+        return [key for key in keys if key.startswith(prefix)]
+
+
+def _hmac_sha256(key: bytes, message: str) -> bytes:
+    return hmac.new(key, message.encode(), hashlib.sha256).digest()
+
+
+def _quote(value: str) -> str:
+    return quote(value, safe="-_.~")
+
+
+class S3Storage(StorageBackend):
+    """
+    Stores files in an S3-compatible object store (AWS S3, MinIO, ...)
+    using path-style URLs and AWS Signature Version 4.
+
+    Objects larger than `part_size` are uploaded with a multipart upload,
+    so writes are streamed without buffering the whole file.
+    """
+
+    def __init__(
+        self,
+        endpoint_url: str,
+        bucket: str,
+        access_key: str,
+        secret_key: str,
+        region: str = "us-east-1",
+        part_size: int = 8 * 1024 * 1024,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.endpoint_url = endpoint_url.rstrip("/")
+        self.bucket = bucket
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self.part_size = part_size
+        self._transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(transport=self._transport, timeout=60)
+        return self._client
+
+    def _sign(
+        self, method: str, path: str, query: str, payload_hash: str
+    ) -> Dict[str, str]:
+        now = datetime.datetime.now(datetime.timezone.utc)
+        amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+        datestamp = now.strftime("%Y%m%d")
+        host = httpx.URL(self.endpoint_url).netloc.decode()
+
+        headers = {
+            "host": host,
+            "x-amz-content-sha256": payload_hash,
+            "x-amz-date": amz_date,
+        }
+        signed_headers = ";".join(headers)
+        canonical_headers = "".join(f"{k}:{v}\n" for k, v in headers.items())
+        canonical_request = "\n".join(
+            [method, path, query, canonical_headers, signed_headers, payload_hash]
+        )
+        scope = f"{datestamp}/{self.region}/s3/aws4_request"
+        string_to_sign = "\n".join(
+            [
+                "AWS4-HMAC-SHA256",
+                amz_date,
+                scope,
+                hashlib.sha256(canonical_request.encode()).hexdigest(),
+            ]
+        )
+        signing_key = ("AWS4" + self.secret_key).encode()
+        for part in (datestamp, self.region, "s3", "aws4_request"):
+            signing_key = _hmac_sha256(signing_key, part)
+        signature = hmac.new(
+            signing_key, string_to_sign.encode(), hashlib.sha256
+        ).hexdigest()
+
+        headers["authorization"] = (
+            f"AWS4-HMAC-SHA256 Credential={self.access_key}/{scope}, "
+            f"SignedHeaders={signed_headers}, Signature={signature}"
+        )
+        del headers["host"]
+        return headers
+
+    def _build_request(
+        self,
+        method: str,
+        key: Optional[str] = None,
+        params: Optional[Dict[str, str]] = None,
+        content: bytes = b"",
+        headers: Optional[Dict[str, str]] = None,
+    ) -> httpx.Request:
+        path = f"/{self.bucket}"
+        if key is not None:
+            path += "/" + quote(key, safe="/-_.~")
+        query = "&".join(
+            f"{_quote(k)}={_quote(v)}" for k, v in sorted((params or {}).items())
+        )
+        payload_hash = hashlib.sha256(content).hexdigest()
+        request_headers = self._sign(method, path, query, payload_hash)
+        request_headers.update(headers or {})
+        url = f"{self.endpoint_url}{path}" + (f"?{query}" if query else "")
+        return self.client.build_request(
+            method, url, content=content or None, headers=request_headers
+        )
+
+    async def _send(
+        self, method: str, key: Optional[str] = None, **kwargs
+    ) -> httpx.Response:
+        response = await self.client.send(self._build_request(method, key, **kwargs))
+        if response.status_code == 404:
+            raise FileNotFoundError(key)
+        response.raise_for_status()
+        return response
+
+    async def save(self, key: str, data: Data) -> int:
+        buffer = bytearray()
+        chunks = _iter_data(data)
+        async for chunk in chunks:
+            buffer.extend(chunk)
+            if len(buffer) >= self.part_size:
+                break
+        else:
+            # Small object, a single PUT is enough
+            await self._send("PUT", key, content=bytes(buffer))
+            return len(buffer)
+
+        response = await self._send("POST", key, params={"uploads": ""})
+        upload_id = _find_text(ET.fromstring(response.content), "UploadId")
+        parts: List[str] = []
+        written = 0
+
+        async def upload_part(body: bytes) -> None:
+            nonlocal written
+            part_response = await self._send(
+                "PUT",
+                key,
+                params={"partNumber": str(len(parts) + 1), "uploadId": upload_id},
+                content=body,
+            )
+            parts.append(part_response.headers["etag"])
+            written += len(body)
+
+        try:
+            async for chunk in chunks:
+                buffer.extend(chunk)
+                while len(buffer) >= self.part_size:
+                    await upload_part(bytes(buffer[: self.part_size]))
+                    del buffer[: self.part_size]
+            if buffer:
+                await upload_part(bytes(buffer))
+
+            body = "".join(
+                f"<Part><PartNumber>{number}</PartNumber><ETag>{etag}</ETag></Part>"
+                for number, etag in enumerate(parts, start=1)
+            )
+            await self._send(
+                "POST",
+                key,
+                params={"uploadId": upload_id},
+                content=(
+                    f"<CompleteMultipartUpload>{body}</CompleteMultipartUpload>"
+                ).encode(),
+            )
+        except BaseException:
+            with contextlib.suppress(Exception):
+                await self._send("DELETE", key, params={"uploadId": upload_id})
+            raise
+        return written
+
+    async def iter_bytes(
+        self,
+        key: str,
+        start: int = 0,
+        end: Optional[int] = None,
+        chunk_size: int = CHUNK_SIZE,
+    ) -> AsyncIterator[bytes]:
+        headers = {}
+        if start or end is not None:
+            headers["range"] = f"bytes={start}-{'' if end is None else end}"
+        request = self._build_request("GET", key, headers=headers)
+        response = await self.client.send(request, stream=True)
+        try:
+            if response.status_code == 404:
+                raise FileNotFoundError(key)
+            response.raise_for_status()
+            async for chunk in response.aiter_bytes(chunk_size):
+                yield chunk
+        finally:
+            await response.aclose()
+
+    async def _head(self, key: str) -> httpx.Response:
+        return await self._send("HEAD", key)
+
+    async def exists(self, key: str) -> bool:
+        try:
+            await self._head(key)
+        except FileNotFoundError:
+            return False
+        return True
+
+    async def size(self, key: str) -> int:
+        return int((await self._head(key)).headers["content-length"])
+
+    async def delete(self, key: str) -> bool:
+        if not await self.exists(key):
+            return False
+        await self._send("DELETE", key)
+        return True
+
+    async def list_keys(self, prefix: str = "") -> List[str]:
+        keys: List[str] = []
+        params = {"list-type": "2", "prefix": prefix}
+        while True:
+            response = await self._send("GET", None, params=params)
+            root = ET.fromstring(response.content)
+            keys.extend(
+                _find_text(item, "Key")
+                for item in root
+                if item.tag.endswith("Contents")
+            )
+            token = _find_text(root, "NextContinuationToken")
+            if not token:
+                return keys
+            params["continuation-token"] = token
+
+
+def _find_text(element: ET.Element, tag: str) -> Optional[str]:
+    """Finds a child element's text regardless of the XML namespace."""
+    for child in element:
+        if child.tag.split("}")[-1] == tag:
+            return child.text
+    return None
+
+
+@lru_cache
+def get_storage() -> StorageBackend:
+    """Returns the storage backend configured in the settings."""
+    if settings.STORAGE_BACKEND == "s3":
+        return S3Storage(
+            endpoint_url=settings.S3_ENDPOINT_URL,
+            bucket=settings.S3_BUCKET,
+            access_key=settings.S3_ACCESS_KEY,
+            secret_key=settings.S3_SECRET_KEY,
+            region=settings.S3_REGION,
+        )
+    return LocalStorage(settings.UPLOADS_DIR)
+
+
+def key_from_path(path: str) -> str:
+    """
+    Converts a stored file path or URL (e.g. `/uploads/avatars/a.png`)
+    to a storage key (`avatars/a.png`).
+    """
+    path = path.replace(os.path.sep, "/").lstrip("/")
+    prefix = settings.UPLOADS_DIR.strip("/") + "/"
+    return path[len(prefix) :] if path.startswith(prefix) else path
+
+
+def path_from_key(key: str) -> str:
+    """Converts a storage key back to the path stored in the database."""
+    return f"{settings.UPLOADS_DIR}/{key}"
@@ -0,0 +1,144 @@
+"""
+Ingest-time column type inference for uploaded tables.
+
+`pd.read_csv` and `pd.read_excel` load strings as `object` and numbers as
+`int64`/`float64`. At upload we choose the most compact lossless dtype for
+every column once and store it with the table, so every later load can
+read the file straight into those dtypes.
+"""
+
+from __future__ import annotations
+
+from typing import Dict, List, Tuple
+
+from core.lazy import lazy_import
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+# String columns with at most this share of distinct values become categoricals
+CATEGORY_MAX_UNIQUE_RATIO = 0.5
+# Number of values checked before trying to parse a whole column as dates
+DATE_SAMPLE_SIZE = 100
+
+INTEGER_DTYPES = ["int8", "int16", "int32", "int64"]
+UNSIGNED_DTYPES = ["uint8", "uint16", "uint32", "uint64"]
+
+
+def _smallest_integer_dtype(values: pd.Series, nullable: bool) -> str:
+    low, high = values.min(), values.max()
+    candidates = UNSIGNED_DTYPES if low >= 0 else INTEGER_DTYPES
+    for dtype in candidates:
+        info = np.iinfo(dtype)
+        if info.min <= low and high <= info.max:
+            # Nullable extension dtypes are spelled with a capital letter
+            return dtype.capitalize().replace("Ui", "UI") if nullable else dtype
+    return "Int64" if nullable else "int64"
+
+
+def _is_iso_dates(values: pd.Series) -> bool:
+    try:
+        pd.to_datetime(values.head(DATE_SAMPLE_SIZE), format="ISO8601")
+        pd.to_datetime(values, format="ISO8601")
+    except (ValueError, TypeError, OverflowError):
+        return False
+    return True
+
+
+def infer_column_dtype(series: pd.Series) -> str:
+    """Returns the most compact dtype that represents the column losslessly."""
+    values = series.dropna()
+    if values.empty:
+        return str(series.dtype)
+
+    if pd.api.types.is_bool_dtype(series):
+        return "bool"
+
+    if pd.api.types.is_integer_dtype(series):
+        return _smallest_integer_dtype(values, nullable=False)
+
+    if pd.api.types.is_float_dtype(series):
+        # Integers with missing values are loaded as floats
+        if (values == values.round()).all() and values.abs().max() < 2**53:
+            return _smallest_integer_dtype(values.astype("int64"), nullable=True)
+        if (values.astype("float32").astype("float64") == values).all():
+            return "float32"
+        return "float64"
+
+    if pd.api.types.is_object_dtype(series) and values.map(type).eq(str).all():
+        if _is_iso_dates(values):
+            return "datetime64[ns]"
+        if values.nunique() <= CATEGORY_MAX_UNIQUE_RATIO * len(values):
+            return "category"
+
+    return str(series.dtype)
+
+
+def infer_column_types(df: pd.DataFrame) -> Dict[str, str]:
+    return {str(column): infer_column_dtype(df[column]) for column in df.columns}
+
+
+def _split_dates(column_types: Dict[str, str]) -> Tuple[Dict[str, str], List[str]]:
+    dtypes = {
+        column: dtype
+        for column, dtype in column_types.items()
+        if not dtype.startswith("datetime64")
+    }
+    dates = [column for column in column_types if column not in dtypes]
+    return dtypes, dates
+
+
+def read_csv_kwargs(column_types: Dict[str, str]) -> dict:
+    """
+    Builds `pd.read_csv` arguments that parse the file directly into the
+    stored dtypes, without materializing `object`/`int64` columns first.
+    """
+    dtypes, dates = _split_dates(column_types)
+    kwargs = {"dtype": dtypes}
+    if dates:
+        kwargs.update(parse_dates=dates, date_format="ISO8601")
+    return kwargs
+
+
+def apply_column_types(df: pd.DataFrame, column_types: Dict[str, str]) -> pd.DataFrame:
+    """Casts an already loaded DataFrame (e.g. from Excel) to the stored dtypes."""
+    dtypes, dates = _split_dates(column_types)
+    # Excel headers may be numbers, while stored (JSON) names are strings
+    df = df.astype({c: dtypes[str(c)] for c in df.columns if str(c) in dtypes})
+    for column in df.columns:
+        if str(column) in dates:
+            df[column] = pd.to_datetime(df[column], format="ISO8601")
+    return df
+
+
+def memory_report(raw_df: pd.DataFrame, typed_df: pd.DataFrame) -> dict:
+    """
+    Compares the deep memory usage of a table loaded with pandas defaults
+    and with the inferred dtypes, per column and in total.
+    """
+    raw_usage = raw_df.memory_usage(index=False, deep=True)
+    typed_usage = typed_df.memory_usage(index=False, deep=True)
+    columns = [
+        {
+            "name": str(column),
+            "dtype": str(typed_df[column].dtype),
+            "raw_bytes": int(raw_usage[column]),
+            "bytes": int(typed_usage[column]),
+        }
+        for column in typed_df.columns
+    ]
+    return {
+        "columns": columns,
+        "raw_bytes": int(raw_usage.sum()),
+        "bytes": int(typed_usage.sum()),
+    }
+
+
+def optimize(df: pd.DataFrame) -> Tuple[Dict[str, str], dict]:
+    """
+    Infers compact column types for a freshly loaded table.
+    Returns the types to persist and the memory report.
+    """
+    column_types = infer_column_types(df)
+    typed_df = apply_column_types(df, column_types)
+    return column_types, memory_report(df, typed_df)
@@ -0,0 +1,279 @@
+"""
+Streaming export of stored tables and query results as CSV, XLSX or Parquet.
+
+Exports are generated from the typed DataFrame of
+`table_service.get_table_frame` and the rows selected by
+`table_query.select_rows`, `CHUNK_ROWS` rows at a time in worker threads,
+so only one chunk is converted at once whatever the size of the export:
+- CSV is encoded and sent chunk by chunk. The output only depends on the
+  table source, the query and the format, which make up the ETag, so a
+  byte range is served by generating the export again and skipping to the
+  range. The total length needed for `Content-Range` is remembered after
+  the first complete download, or counted without sending anything.
+- XLSX is written by xlsxwriter in constant-memory mode, Parquet by
+  pyarrow one row group per chunk, both into a temporary file that is
+  streamed once complete (the formats can only be finished at the end).
+"""
+
+from __future__ import annotations
+
+import hashlib
+import importlib.util
+import json
+import os
+import tempfile
+from typing import AsyncIterator, BinaryIO, Iterator, Optional, Tuple
+from urllib.parse import quote
+
+from fastapi import HTTPException, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+
+from core.lazy import lazy_import
+from core.lru import LRUCache
+from features.tables import crud
+from features.tables.schemas import TableExportQuery
+from services import table_query
+from services.storage import CHUNK_SIZE
+
+pd = lazy_import("pandas")
+pa = lazy_import("pyarrow")
+pq = lazy_import("pyarrow.parquet")
+xlsxwriter = lazy_import("xlsxwriter")
+
+CHUNK_ROWS = 10_000
+# Rows of an Excel worksheet, including the header
+XLSX_MAX_ROWS = 1_048_576
+
+MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+# Lengths of complete CSV exports by ETag
+export_sizes = LRUCache(10_000, sizeof=lambda v: 1)
+
+
+def _chunks(selection: table_query.Selection) -> Iterator[pd.DataFrame]:
+    for start in range(0, len(selection.positions), CHUNK_ROWS):
+        yield selection.rows(start, start + CHUNK_ROWS)
+
+
+def _to_csv(frame: pd.DataFrame, header: bool) -> bytes:
+    return frame.to_csv(index=False, header=header, lineterminator="\n").encode()
+
+
+def csv_chunks(selection: table_query.Selection) -> Iterator[bytes]:
+    yield _to_csv(selection.frame[selection.columns].head(0), header=True)
+    for chunk in _chunks(selection):
+        yield _to_csv(chunk, header=False)
+
+
+def write_xlsx(selection: table_query.Selection, file: BinaryIO) -> None:
+    workbook = xlsxwriter.Workbook(
+        file,
+        {
+            # Rows are flushed to disk as soon as the next one is started
+            "constant_memory": True,
+            "default_date_format": "yyyy-mm-dd hh:mm:ss",
+            "remove_timezone": True,
+            "nan_inf_to_errors": True,
+        },
+    )
+    worksheet = workbook.add_worksheet()
+    worksheet.write_row(0, 0, [str(column) for column in selection.columns])
+    row = 1
+    for chunk in _chunks(selection):
+        values = chunk.astype(object).where(chunk.notna(), None)
+        for record in values.itertuples(index=False, name=None):
+            worksheet.write_row(row, 0, record)
+            row += 1
+    workbook.close()
+
+
+def _parquet_schema(sample: pd.DataFrame) -> pa.Schema:
+    schema = pa.Schema.from_pandas(sample, preserve_index=False)
+    # Columns without values in the sample are inferred as null
+    for i, schema_field in enumerate(schema):
+        if pa.types.is_null(schema_field.type):
+            schema = schema.set(i, schema_field.with_type(pa.string()))
+    return schema
+
+
+def write_parquet(selection: table_query.Selection, file: BinaryIO) -> None:
+    schema = _parquet_schema(selection.rows(0, CHUNK_ROWS))
+    with pq.ParquetWriter(file, schema) as writer:
+        for chunk in _chunks(selection):
+            writer.write_table(
+                pa.Table.from_pandas(chunk, schema=schema, preserve_index=False)
+            )
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Inclusive byte range of a single-range `Range` header. Returns None when
+    the whole body should be sent (other units, several ranges, malformed
+    headers) and raises 416 when the range is outside the body.
+    """
+    unit, _, spec = header.partition("=")
+    first, dash, last = spec.partition("-")
+    if unit.strip().lower() != "bytes" or not dash or "," in spec:
+        return None
+    first, last = first.strip(), last.strip()
+    if first == last == "" or not all(p == "" or p.isdigit() for p in (first, last)):
+        return None
+    if first:
+        start = int(first)
+        if last and int(last) < start:
+            return None
+        end = min(int(last), size - 1) if last else size - 1
+    else:
+        # The last bytes of the body; an empty suffix is not satisfiable
+        suffix = int(last)
+        start, end = size - min(suffix, size) if suffix else size, size - 1
+    if start >= size:
+        raise HTTPException(
+            status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{size}"},
+        )
+    return start, end
+
+
+async def _byte_range(
+    chunks: AsyncIterator[bytes], start: int, end: int
+) -> AsyncIterator[bytes]:
+    position = 0
+    async for chunk in chunks:
+        chunk_end = position + len(chunk)
+        if chunk_end > start:
+            yield chunk[max(start - position, 0) : end + 1 - position]
+        position = chunk_end
+        if position > end:
+            break
+
+
+async def _remember_size(chunks: AsyncIterator[bytes], etag: str):
+    size = 0
+    async for chunk in chunks:
+        size += len(chunk)
+        yield chunk
+    export_sizes.set(etag, size)
+
+
+async def _stream_file(file: BinaryIO) -> AsyncIterator[bytes]:
+    try:
+        await run_in_threadpool(file.seek, 0)
+        while chunk := await run_in_threadpool(file.read, CHUNK_SIZE):
+            yield chunk
+    finally:
+        file.close()
+
+
+def _content_disposition(filename: str) -> str:
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
+
+
+def _etag(table: crud.Table, export_format: str, query: TableExportQuery) -> str:
+    key = [
+        table.id,
+        table.snapshot_path or table.file_path,
+        export_format,
+        query.model_dump(mode="json"),
+    ]
+    digest = hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+async def _csv_response(
+    selection: table_query.Selection,
+    headers: dict,
+    etag: str,
+    range_header: Optional[str],
+    if_range: Optional[str],
+) -> StreamingResponse:
+    headers["Accept-Ranges"] = "bytes"
+    chunks = iterate_in_threadpool(csv_chunks(selection))
+    size = export_sizes.get(etag)
+
+    # A range of an older version of the export would not fit the rest
+    if range_header and (if_range is None or if_range == etag):
+        if size is None:
+            size = await run_in_threadpool(
+                lambda: sum(len(chunk) for chunk in csv_chunks(selection))
+            )
+            export_sizes.set(etag, size)
+        byte_range = parse_range(range_header, size)
+        if byte_range is not None:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+            headers["Content-Length"] = str(end - start + 1)
+            return StreamingResponse(
+                _byte_range(chunks, start, end),
+                status_code=status.HTTP_206_PARTIAL_CONTENT,
+                media_type=MEDIA_TYPES["csv"],
+                headers=headers,
+            )
+
+    if size is None:
+        chunks = _remember_size(chunks, etag)
+    else:
+        headers["Content-Length"] = str(size)
+    return StreamingResponse(chunks, media_type=MEDIA_TYPES["csv"], headers=headers)
+
+
+async def export_table(
+    db: Session,
+    table_id: int,
+    user_id: int,
+    export_format: str,
+    query: Optional[TableExportQuery] = None,
+    range_header: Optional[str] = None,
+    if_range: Optional[str] = None,
+) -> StreamingResponse:
+    """
+    Streams a table of the user, or the result of `query` over it, as a file
+    download in `export_format`. Byte ranges are supported for CSV.
+    """
+    if export_format == "parquet" and importlib.util.find_spec("pyarrow") is None:
+        raise HTTPException(
+            status_code=status.HTTP_501_NOT_IMPLEMENTED,
+            detail="Parquet export requires pyarrow, which is not installed.",
+        )
+    query = query or TableExportQuery()
+    table, selection = await table_query.select_table_rows(
+        db, table_id, user_id, query, query.limit
+    )
+    if export_format == "xlsx" and len(selection.positions) >= XLSX_MAX_ROWS:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"XLSX supports at most {XLSX_MAX_ROWS - 1} rows, use CSV.",
+        )
+
+    etag = _etag(table, export_format, query)
+    headers = {
+        "Content-Disposition": _content_disposition(
+            f"{table.table_name}.{export_format}"
+        ),
+        "ETag": etag,
+    }
+    if export_format == "csv":
+        return await _csv_response(selection, headers, etag, range_header, if_range)
+
+    write = write_xlsx if export_format == "xlsx" else write_parquet
+    file = tempfile.TemporaryFile()
+    try:
+        await run_in_threadpool(write, selection, file)
+        file.flush()
+        headers["Content-Length"] = str(os.fstat(file.fileno()).st_size)
+    except BaseException:
+        file.close()
+        raise
+    return StreamingResponse(
+        _stream_file(file), media_type=MEDIA_TYPES[export_format], headers=headers
+    )
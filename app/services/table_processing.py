@@ -0,0 +1,224 @@
+"""
+Background processing of uploaded tables.
+
+An upload returns as soon as the file is stored and its `Table` row exists
+with `processing_status="pending"`. The pipeline then, off the request path:
+1. Infers compact column types and the memory report.
+2. Computes per-column statistics.
+3. Writes a columnar snapshot of the typed DataFrame for fast loading.
+4. Fills the schema index (`TableColumn` rows) and the full-text index of
+   cell values (`services.search_index`).
+5. Stores a preview snapshot, so previews need no file I/O.
+"""
+
+from __future__ import annotations
+
+import logging
+from typing import List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import StaleDataError
+from starlette.concurrency import run_in_threadpool
+
+from core import metrics
+from core.config import settings
+from core.lazy import lazy_import
+from core.task_queue import TaskQueue
+from db.session import SessionLocal
+from features.tables.models import Table, TableColumn
+from services import (
+    journal,
+    search_index,
+    table_dtypes,
+    table_service,
+    table_snapshot,
+)
+from services.storage import get_storage, key_from_path, path_from_key
+
+pd = lazy_import("pandas")
+
+logger = logging.getLogger(__name__)
+
+PREVIEW_ROWS = 5
+
+queue = TaskQueue(
+    "table-processing",
+    concurrency=settings.TABLE_PROCESSING_CONCURRENCY,
+    maxsize=settings.TABLE_PROCESSING_QUEUE_SIZE,
+)
+
+
+@metrics.registry.collector("task_queue_pending_jobs", "Jobs waiting for a worker.")
+def _queue_pending():
+    return [({"queue": queue.name}, queue.pending)]
+
+
+def _json_value(value):
+    if pd.isna(value):
+        return None
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat()
+    return value.item() if hasattr(value, "item") else value
+
+
+def column_stats(df: pd.DataFrame) -> dict:
+    """Computes JSON-serializable per-column statistics."""
+    stats = {}
+    for column in df.columns:
+        series = df[column]
+        entry = {
+            "count": int(series.count()),
+            "nulls": int(series.isna().sum()),
+            "unique": int(series.nunique()),
+        }
+        is_numeric = pd.api.types.is_numeric_dtype(
+            series
+        ) and not pd.api.types.is_bool_dtype(series)
+        if entry["count"] and (
+            is_numeric or pd.api.types.is_datetime64_any_dtype(series)
+        ):
+            entry["min"] = _json_value(series.min())
+            entry["max"] = _json_value(series.max())
+            if is_numeric:
+                entry["mean"] = float(series.mean())
+        stats[str(column)] = entry
+    return stats
+
+
+def snapshot_key(table: Table) -> str:
+    return f"{key_from_path(table.file_path)}{table_snapshot.SUFFIX}"
+
+
+def _analyze(df: pd.DataFrame) -> tuple:
+    column_types, memory_report = table_dtypes.optimize(df)
+    typed_df = table_dtypes.apply_column_types(df, column_types)
+    try:
+        snapshot = table_snapshot.dumps(typed_df)
+    except table_snapshot.UnsupportedSnapshot as e:
+        # Loaded from the original file instead
+        logger.info(f"No snapshot for a table: {e}")
+        snapshot = None
+    preview = {
+        "preview": table_service.to_records(typed_df.head(PREVIEW_ROWS)),
+        "columns": [str(column) for column in typed_df.columns],
+        "total_rows": len(typed_df),
+    }
+    stats = column_stats(typed_df)
+    return column_types, memory_report, stats, snapshot, preview, typed_df
+
+
+def _start(db: Session, table_id: int) -> Optional[Tuple[Table, str, journal.Intents]]:
+    """Marks a table as processing and records the snapshot intent."""
+    table = db.get(Table, table_id)
+    if table is None:
+        return None
+    key = snapshot_key(table)
+    table.processing_status = "processing"
+    intents = journal.record(db, journal.WRITE, [(journal.SNAPSHOT, key)])
+    db.commit()
+    # Loaded here, so the pipeline reads no expired attribute on the loop
+    db.refresh(table)
+    return table, key, intents
+
+
+def _finish(db: Session, table: Table, intents: journal.Intents, **values) -> bool:
+    """
+    Stores the results (or the failure) of processing with the finished
+    intent. Returns False if the table was deleted in the meantime.
+    """
+    for name, value in values.items():
+        setattr(table, name, value)
+    journal.mark_done(db, intents)
+    try:
+        db.commit()
+        return True
+    except StaleDataError:
+        db.rollback()
+        journal.mark_done_and_commit(db, intents)
+        return False
+
+
+async def _discard(db: Session, table_id: int, key: str) -> None:
+    """Drops what processing stored for a table that failed or is gone."""
+    await run_in_threadpool(search_index.drop_table, db.get_bind(), table_id)
+    await get_storage().delete(key)
+
+
+async def process_table(table_id: int) -> None:
+    """
+    Runs the post-upload pipeline for a single table. The session blocks,
+    so every database step runs in the threadpool.
+    """
+    db = SessionLocal()
+    try:
+        started = await run_in_threadpool(_start, db, table_id)
+        if started is None:
+            return
+        table, key, intents = started
+
+        try:
+            df = await table_service.load_table_dataframe(table, apply_types=False)
+            column_types, memory_report, stats, snapshot, preview, typed_df = (
+                await run_in_threadpool(_analyze, df)
+            )
+            if snapshot is not None:
+                await get_storage().save(key, snapshot)
+            # Committed in batches by the worker thread, so no write
+            # transaction stays open here while the event loop goes on
+            await run_in_threadpool(
+                search_index.index_table, db.get_bind(), table, typed_df
+            )
+        except Exception:
+            logger.exception(f"Processing of table {table_id} failed.")
+            await _discard(db, table_id, key)
+            await run_in_threadpool(
+                _finish, db, table, intents, processing_status="failed"
+            )
+            return
+
+        finished = await run_in_threadpool(
+            _finish,
+            db,
+            table,
+            intents,
+            column_types=column_types,
+            memory_report=memory_report,
+            column_stats=stats,
+            preview=preview,
+            snapshot_path=path_from_key(key) if snapshot is not None else None,
+            columns=[
+                TableColumn(position=position, name=name, dtype=dtype)
+                for position, (name, dtype) in enumerate(column_types.items())
+            ],
+            processing_status="ready",
+        )
+        if finished:
+            # Queries load the new snapshot from now on
+            table_service.frame_cache.pop(table_id)
+        else:
+            await _discard(db, table_id, key)
+    finally:
+        db.close()
+
+
+async def submit_table(table_id: int) -> None:
+    await queue.submit(process_table, table_id)
+
+
+def _pending_table_ids() -> List[int]:
+    with SessionLocal() as db:
+        return [
+            table_id
+            for (table_id,) in db.query(Table.id).filter(
+                Table.processing_status.in_(["pending", "processing"])
+            )
+        ]
+
+
+async def resume_pending_tables() -> None:
+    """Re-enqueues tables whose processing was interrupted by a restart."""
+    table_ids = await run_in_threadpool(_pending_table_ids)
+    for table_id in table_ids:
+        await submit_table(table_id)
+    if table_ids:
+        logger.info(f"Resumed processing of {len(table_ids)} tables.")
@@ -0,0 +1,252 @@
+"""
+Server-side filtering, sorting and aggregation of stored tables.
+
+Queries run over the typed DataFrame from `table_service.get_table_frame`,
+which is cached in memory between requests, with vectorized pandas/NumPy
+operations in a worker thread:
+1. Filters are combined into a single boolean mask.
+2. Group-by and aggregates use pandas' hash-based groupby.
+3. Sorting only orders the sort keys and takes the requested page of row
+   positions, so wide tables are not reordered as a whole. A single numeric
+   key is not sorted at all, the first rows are selected in linear time.
+4. Projection and the page are materialized last, only for returned rows.
+"""
+
+from __future__ import annotations
+
+from typing import List, NamedTuple, Optional, Tuple
+
+from fastapi import HTTPException, status
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from core.config import settings
+from core.lazy import lazy_import
+from features.tables import crud
+from features.tables.schemas import QueryAggregate, QueryFilter, TableQuery
+from services import table_service
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+COMPARISONS = {
+    "eq": "__eq__",
+    "ne": "__ne__",
+    "lt": "__lt__",
+    "le": "__le__",
+    "gt": "__gt__",
+    "ge": "__ge__",
+}
+
+
+# Pages ending before this row of a single numeric sort key use selection
+TOP_ROWS_MAX = 10_000
+
+
+class InvalidQuery(ValueError):
+    pass
+
+
+class Selection(NamedTuple):
+    """Result of a query as row positions into a frame, not yet materialized."""
+
+    frame: pd.DataFrame
+    columns: List[str]
+    # Positions of the result rows in `frame`, in result order
+    positions: np.ndarray
+    # Rows (or groups) matching the query before offset and limit
+    total: int
+
+    def rows(self, start: int = 0, stop: Optional[int] = None) -> pd.DataFrame:
+        return self.frame.iloc[self.positions[start:stop]][self.columns]
+
+
+def _check_columns(df: pd.DataFrame, columns: List[str]) -> None:
+    missing = [column for column in columns if column not in df.columns]
+    if missing:
+        raise InvalidQuery(f"Unknown columns: {', '.join(map(str, missing))}")
+
+
+def _scalar(series: pd.Series, value):
+    """Converts a JSON value to the type of the column it is compared to."""
+    if isinstance(value, (list, dict)):
+        raise InvalidQuery(f"Expected a single value for column '{series.name}'")
+    if value is not None and pd.api.types.is_datetime64_any_dtype(series.dtype):
+        return pd.Timestamp(value)
+    return value
+
+
+def _values(series: pd.Series) -> pd.Series:
+    # Ordering comparisons are not defined on unordered categoricals
+    if isinstance(series.dtype, pd.CategoricalDtype) and not series.cat.ordered:
+        return series.astype(series.cat.categories.dtype)
+    return series
+
+
+def _mask(df: pd.DataFrame, condition: QueryFilter) -> pd.Series:
+    series = df[condition.column]
+    op, value = condition.op, condition.value
+    if op == "is_null":
+        return series.isna()
+    if op == "not_null":
+        return series.notna()
+    if op in ("in", "not_in"):
+        if not isinstance(value, list):
+            raise InvalidQuery(f"'{op}' expects a list of values")
+        mask = series.isin([_scalar(series, item) for item in value])
+        return ~mask if op == "not_in" else mask
+    if op in ("contains", "startswith"):
+        strings = series.astype("string")
+        if op == "contains":
+            mask = strings.str.contains(str(value), regex=False)
+        else:
+            mask = strings.str.startswith(str(value))
+        return mask.fillna(False).astype(bool)
+    mask = getattr(_values(series), COMPARISONS[op])(_scalar(series, value))
+    # Missing values never match a comparison
+    return mask.fillna(False).astype(bool) if mask.dtype != bool else mask
+
+
+def _aggregate(frame: pd.DataFrame, query: TableQuery) -> pd.DataFrame:
+    # Group-by alone lists the distinct groups with their sizes
+    aggregates = query.aggregates or [QueryAggregate(func="count")]
+    names = query.group_by + [aggregate.name for aggregate in aggregates]
+    if len(set(names)) != len(names):
+        raise InvalidQuery("Result columns must have unique names, set `alias`")
+
+    if not query.group_by:
+        return pd.DataFrame(
+            [
+                {
+                    aggregate.name: (
+                        len(frame)
+                        if aggregate.column is None
+                        else getattr(frame[aggregate.column], aggregate.func)()
+                    )
+                    for aggregate in aggregates
+                }
+            ]
+        )
+
+    grouped = frame.groupby(query.group_by, dropna=False, observed=True, sort=False)
+    columns = {
+        aggregate.name: (
+            grouped.size()
+            if aggregate.column is None
+            else getattr(grouped[aggregate.column], aggregate.func)()
+        )
+        for aggregate in aggregates
+    }
+    return pd.concat(columns, axis=1).reset_index()
+
+
+def _order(keys: pd.DataFrame, query: TableQuery, stop: Optional[int]) -> np.ndarray:
+    """Positions of rows `offset:stop` after sorting by `keys`."""
+    keys = keys.reset_index(drop=True)
+    # Deep pages are cheaper to reach with a full sort
+    if (
+        len(query.sort) == 1
+        and stop is not None
+        and stop <= min(len(keys) - 1, TOP_ROWS_MAX)
+    ):
+        series = keys[query.sort[0].column]
+        if pd.api.types.is_numeric_dtype(series.dtype) and not isinstance(
+            series.dtype, pd.CategoricalDtype
+        ):
+            # Selecting the first rows is linear, a full sort is not
+            top = series.nlargest if query.sort[0].descending else series.nsmallest
+            order = top(stop, keep="first").index.to_numpy()
+            if len(order) < stop:
+                # Missing values are left out by nlargest and go last
+                nulls = np.flatnonzero(series.isna().to_numpy())
+                order = np.concatenate([order, nulls[: stop - len(order)]])
+            return order[query.offset :]
+    order = keys.sort_values(
+        by=[sort.column for sort in query.sort],
+        ascending=[not sort.descending for sort in query.sort],
+        kind="stable",
+        na_position="last",
+    )
+    return order.index.to_numpy()[query.offset : stop]
+
+
+def select_rows(df: pd.DataFrame, query: TableQuery, limit: Optional[int]) -> Selection:
+    """
+    Evaluates a query over a table, see the module docstring. Up to `limit`
+    rows after `query.offset` are selected, all of them if it is None.
+    """
+    _check_columns(df, [condition.column for condition in query.filters])
+    stop = None if limit is None else query.offset + limit
+
+    # Matching row positions; columns are only taken for those rows when needed
+    positions = None
+    if query.filters:
+        masks = [_mask(df, condition).to_numpy() for condition in query.filters]
+        positions = np.flatnonzero(np.logical_and.reduce(masks))
+
+    def take(columns: List[str]) -> pd.DataFrame:
+        frame = df[columns]
+        return frame if positions is None else frame.iloc[positions]
+
+    if query.group_by or query.aggregates:
+        needed = query.group_by + [
+            aggregate.column for aggregate in query.aggregates if aggregate.column
+        ]
+        _check_columns(df, needed)
+        result = _aggregate(take(list(dict.fromkeys(needed))), query)
+        _check_columns(result, [sort.column for sort in query.sort])
+        if query.sort:
+            page = _order(result, query, stop)
+        else:
+            page = np.arange(len(result))[query.offset : stop]
+        return Selection(result, list(result.columns), page, len(result))
+
+    columns = list(df.columns) if query.columns is None else query.columns
+    sort_columns = [sort.column for sort in query.sort]
+    _check_columns(df, columns + sort_columns)
+    total = len(df) if positions is None else len(positions)
+    if query.sort:
+        page = _order(take(list(dict.fromkeys(sort_columns))), query, stop)
+    else:
+        page = np.arange(query.offset, total if stop is None else min(stop, total))
+    if positions is not None:
+        page = positions[page]
+    return Selection(df, columns, page, total)
+
+
+def _result(rows: pd.DataFrame, total: int) -> dict:
+    return {
+        "columns": [str(column) for column in rows.columns],
+        "rows": table_service.to_records(rows),
+        "total_rows": total,
+    }
+
+
+async def select_table_rows(
+    db: Session, table_id: int, user_id: int, query: TableQuery, limit: Optional[int]
+) -> Tuple[crud.Table, Selection]:
+    """Loads a table of the user and selects the rows of `query` in a worker thread."""
+    table = await run_in_threadpool(
+        table_service.get_user_table_or_404, db, table_id=table_id, user_id=user_id
+    )
+    try:
+        df = await table_service.get_table_frame(table)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка чтения файла таблицы: {e}")
+    try:
+        return table, await run_in_threadpool(select_rows, df, query, limit)
+    except (InvalidQuery, TypeError, ValueError) as e:
+        # Unknown columns, bad values or operations the column type lacks
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e)
+        )
+
+
+async def query_table(db: Session, table_id: int, user_id: int, query: TableQuery):
+    if query.limit > settings.TABLE_QUERY_MAX_ROWS:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"limit must not exceed {settings.TABLE_QUERY_MAX_ROWS}",
+        )
+    _, selection = await select_table_rows(db, table_id, user_id, query, query.limit)
+    return await run_in_threadpool(lambda: _result(selection.rows(), selection.total))
@@ -1,20 +1,56 @@
+from __future__ import annotations
+
 import os
-import shutil
+import tempfile
 import uuid
 from fastapi import UploadFile, HTTPException, status
+from fastapi.encoders import jsonable_encoder
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-import pandas as pd
 from io import BytesIO
-from typing import Optional
+from typing import AsyncIterator, BinaryIO, NamedTuple, Optional, Tuple
 import logging
 
 from features.users.models import User
 from features.tables import crud
 from features.tables.schemas import TableCreate, TableUpdate
+from core import metrics
 from core.config import settings
+from core.lazy import lazy_import
+from core.lru import LRUCache
+from services import (
+    compression,
+    csv_dialect,
+    journal,
+    search_index,
+    table_dtypes,
+    table_snapshot,
+)
+from services.storage import CHUNK_SIZE, get_storage, key_from_path, path_from_key
+
+pd = lazy_import("pandas")
 
 logger = logging.getLogger(__name__)
 
+# Tables up to this size are kept in memory while being read from storage
+SPOOL_MAX_MEMORY = 32 * 1024 * 1024
+
+
+class CachedFrame(NamedTuple):
+    frame: pd.DataFrame
+    # Snapshot or file the frame was loaded from
+    source: str
+    nbytes: int
+
+
+# Typed DataFrames of recently queried tables, shared between requests
+frame_cache = LRUCache(settings.TABLE_CACHE_SIZE, sizeof=lambda v: v.nbytes)
+
+metrics.register_cache(
+    "table_frames",
+    lambda: (frame_cache.hits, frame_cache.misses, len(frame_cache)),
+)
+
 
 def validate_and_sanitize_table_name(db: Session, user_id: int, table_name: str) -> str:
     """
@@ -38,6 +74,52 @@ def validate_and_sanitize_table_name(db: Session, user_id: int, table_name: str)
     return sanitized_name
 
 
+async def _iter_upload(file: UploadFile) -> AsyncIterator[bytes]:
+    while chunk := await file.read(CHUNK_SIZE):
+        yield chunk
+
+
+async def _download_table(file_path: str) -> BinaryIO:
+    """
+    Streams a stored table file into a spooled temporary file, decompressing
+    it on the fly. Small tables stay in memory, large ones spill to disk.
+    """
+    chunks = get_storage().iter_bytes(key_from_path(file_path))
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY)
+    try:
+        async for chunk in compression.decompress_chunks(
+            chunks, compression.codec_for_path(file_path)
+        ):
+            spool.write(chunk)
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool
+
+
+def _read_dataframe(
+    stream: BinaryIO,
+    file_format: str,
+    column_types: Optional[dict] = None,
+    dialect: Optional[dict] = None,
+) -> pd.DataFrame:
+    if file_format.endswith(".csv"):
+        kwargs = {
+            **csv_dialect.read_csv_kwargs(dialect),
+            **table_dtypes.read_csv_kwargs(column_types or {}),
+        }
+        headerless = dialect is not None and not dialect["has_header"]
+        if headerless and column_types:
+            kwargs["names"] = list(column_types)
+        df = pd.read_csv(stream, **kwargs)
+        if headerless and not column_types:
+            df.columns = csv_dialect.default_column_names(len(df.columns))
+        return df
+    df = pd.read_excel(stream)
+    return table_dtypes.apply_column_types(df, column_types) if column_types else df
+
+
 async def process_and_save_table(
     db: Session, file: UploadFile, user: User, custom_table_name: Optional[str] = None
 ) -> crud.Table:
@@ -48,9 +130,9 @@ async def process_and_save_table(
             detail="Неподдерживаемый тип файла. Пожалуйста, загрузите файл .csv или .xlsx.",
         )
 
-    # Read content to check if file is empty
-    content = await file.read()
-    if not content:
+    # Peek at the first chunk to check if file is empty
+    first_chunk = await file.read(CHUNK_SIZE)
+    if not first_chunk:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Загруженный файл пуст.",
@@ -58,40 +140,60 @@ async def process_and_save_table(
     # Reset file pointer after reading
     await file.seek(0)
 
+    # Detect the CSV dialect from the first bytes, it is reused for all reads
+    dialect = (
+        csv_dialect.sniff_dialect(first_chunk)
+        if file.filename.endswith(".csv")
+        else None
+    )
+
     # Specific check for Excel files to have only one sheet
     if file.filename.endswith(".xlsx"):
-        xls = pd.ExcelFile(BytesIO(content))
+        xls = await run_in_threadpool(pd.ExcelFile, file.file)
         if len(xls.sheet_names) != 1:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Excel файлы с несколькими листами не поддерживаются.",
             )
+        await file.seek(0)
 
     # Determine table name
     base_name = custom_table_name or os.path.splitext(file.filename)[0]
 
-    # Validate the determined table name
-    final_table_name = validate_and_sanitize_table_name(
-        db, user_id=user.id, table_name=base_name
+    # Validate the determined table name; the session blocks, so database
+    # work runs in a worker thread
+    final_table_name = await run_in_threadpool(
+        validate_and_sanitize_table_name, db, user_id=user.id, table_name=base_name
     )
 
-    # Create a unique path for the file
-    user_upload_dir = os.path.join(settings.UPLOADS_DIR, "tables", str(user.id))
-    os.makedirs(user_upload_dir, exist_ok=True)
-
     original_filename = file.filename
     file_extension = os.path.splitext(original_filename)[1]
-    unique_filename = f"{uuid.uuid4()}{file_extension}"
-    file_path = os.path.join(user_upload_dir, unique_filename)
+    # Only CSV files are compressed, .xlsx is already a zip archive
+    codec = (
+        compression.resolve_codec(settings.TABLES_COMPRESSION)
+        if file_extension == ".csv"
+        else None
+    )
+    # Create a unique storage key for the file
+    unique_filename = f"{uuid.uuid4()}{file_extension}{compression.codec_suffix(codec)}"
+    key = f"tables/{user.id}/{unique_filename}"
+    user_id = user.id
+
+    # The intent is durable before the file exists, so an upload interrupted
+    # between the file and the row is found by the sync tool
+    intents = await run_in_threadpool(
+        journal.record_and_commit, db, journal.WRITE, [(journal.TABLE, key)]
+    )
 
-    # Save the file
+    # Save the file, streaming it through the compressor chunk by chunk
     try:
-        with open(file_path, "wb") as buffer:
-            buffer.write(content)  # Use the content we've already read
+        await get_storage().save(
+            key, compression.compress_chunks(_iter_upload(file), codec)
+        )
     except Exception as e:
         # Clean up if file writing fails
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        await get_storage().delete(key)
+        await run_in_threadpool(journal.mark_done_and_commit, db, intents)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Не удалось сохранить файл: {e}",
@@ -103,11 +205,17 @@ async def process_and_save_table(
     table_create = TableCreate(
         table_name=final_table_name,
         original_file_name=original_filename,
-        file_path=file_path,
-        user_id=user.id,
+        file_path=path_from_key(key),
+        user_id=user_id,
+        csv_dialect=dialect,
     )
 
-    return crud.create_user_table(db, table=table_create)
+    # The row and the finished intent are committed together
+    def create_table_row() -> crud.Table:
+        journal.mark_done(db, intents)
+        return crud.create_user_table(db, table=table_create)
+
+    return await run_in_threadpool(create_table_row)
 
 
 async def get_preview_from_upload(file: UploadFile, preview_rows: int = 5) -> dict:
@@ -131,7 +239,8 @@ async def get_preview_from_upload(file: UploadFile, preview_rows: int = 5) -> di
         file_stream = BytesIO(content)
 
         if file.filename.endswith(".csv"):
-            df = pd.read_csv(file_stream)
+            dialect = csv_dialect.sniff_dialect(content)
+            df = _read_dataframe(file_stream, file.filename, dialect=dialect)
         else:  # .xlsx
             # Check for multiple sheets in excel file
             xls = pd.ExcelFile(file_stream)
@@ -183,61 +292,152 @@ def rename_table(db: Session, table_id: int, new_name: str, user_id: int) -> cru
         db, user_id=user_id, table_name=new_name
     )
 
-    # Then, update the table name in the database
+    # The name document of the search index is committed with the new name
+    search_index.rename_table(db, table_id, user_id, validated_new_name)
     return crud.update_table_name(
         db=db, table_id=table_id, new_name=validated_new_name, user_id=user_id
     )
 
 
-def delete_table_file_and_db_entry(
+async def delete_table_file_and_db_entry(
     db: Session, table_id: int, user_id: int
 ) -> crud.Table:
-    # First, get the table to find its file path
-    table_to_delete = (
-        db.query(crud.Table)
-        .filter(crud.Table.id == table_id, crud.Table.user_id == user_id)
-        .first()
+    # The row is loaded once and removed through the identity map
+    table_to_delete = await run_in_threadpool(
+        get_user_table_or_404, db, table_id=table_id, user_id=user_id
+    )
+    file_key = key_from_path(table_to_delete.file_path)
+    snapshot_key = (
+        key_from_path(table_to_delete.snapshot_path)
+        if table_to_delete.snapshot_path
+        else None
     )
 
-    if not table_to_delete:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, detail="Table not found"
-        )
+    # The intents are committed together with the removal of the row
+    entries = [(journal.TABLE, file_key)]
+    if snapshot_key:
+        entries.append((journal.SNAPSHOT, snapshot_key))
 
-    file_path = table_to_delete.file_path
+    def remove_table_row() -> Tuple[journal.Intents, crud.Table]:
+        intents = journal.record(db, journal.DELETE, entries)
+        search_index.remove_tables(db, [table_id])
+        return intents, crud.table.remove(db, id=table_to_delete.id)
 
-    # Delete the database entry
-    deleted_table = crud.delete_table(db=db, table_id=table_id, user_id=user_id)
+    intents, deleted_table = await run_in_threadpool(remove_table_row)
 
-    # If DB deletion was successful, delete the file
-    if deleted_table and file_path and os.path.exists(file_path):
-        os.remove(file_path)
+    # If DB deletion was successful, delete the file and its snapshot
+    if deleted_table:
+        frame_cache.pop(table_id)
+        for key in filter(None, (file_key, snapshot_key)):
+            await get_storage().delete(key)
+        await run_in_threadpool(journal.mark_done_and_commit, db, intents)
 
     return deleted_table
 
 
-def get_table_preview(db: Session, table_id: int, user_id: int) -> dict:
-    table = (
-        db.query(crud.Table)
-        .filter(crud.Table.id == table_id, crud.Table.user_id == user_id)
-        .first()
-    )
+def get_user_table_or_404(db: Session, table_id: int, user_id: int) -> crud.Table:
+    table = crud.get_user_table(db, table_id=table_id, user_id=user_id)
     if not table:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Table not found"
         )
+    return table
+
+
+def to_records(df: pd.DataFrame) -> list:
+    # Nullable and categorical dtypes may hold pd.NA, which is not JSON serializable
+    records = df.astype(object).where(df.notna(), None).to_dict(orient="records")
+    return jsonable_encoder(records)
+
+
+async def load_table_dataframe(
+    table: crud.Table, apply_types: bool = True
+) -> pd.DataFrame:
+    """
+    Loads a stored table from the storage backend. Uses the columnar
+    snapshot written by the processing pipeline if there is one, otherwise
+    parses the file directly into the column types inferred at upload.
+    """
+    # Snapshots of older versions were pickles, which are never loaded
+    if apply_types and (table.snapshot_path or "").endswith(table_snapshot.SUFFIX):
+        data = await get_storage().read_bytes(key_from_path(table.snapshot_path))
+        return await run_in_threadpool(table_snapshot.loads, data)
+
+    file_format = compression.strip_codec_suffix(table.file_path)
+    if not file_format.endswith((".csv", ".xlsx")):
+        raise ValueError("Неподдерживаемый формат файла.")
+    column_types = table.column_types if apply_types else None
+    with await _download_table(table.file_path) as stream:
+        return await run_in_threadpool(
+            _read_dataframe, stream, file_format, column_types, table.csv_dialect
+        )
+
+
+async def get_table_frame(table: crud.Table) -> pd.DataFrame:
+    """
+    Returns the typed DataFrame of a table from the in-memory cache, loading
+    it on a miss. The frame is shared between requests and must not be
+    modified in place.
+    """
+    source = table.snapshot_path or table.file_path
+    cached = frame_cache.get(table.id)
+    if cached is not None and cached.source == source:
+        return cached.frame
+    df = await load_table_dataframe(table)
+    nbytes = await run_in_threadpool(lambda: int(df.memory_usage(deep=True).sum()))
+    frame_cache.set(table.id, CachedFrame(df, source, nbytes))
+    return df
+
+
+async def get_table_preview(db: Session, table_id: int, user_id: int) -> dict:
+    table = await run_in_threadpool(
+        get_user_table_or_404, db, table_id=table_id, user_id=user_id
+    )
+
+    # Served from the snapshot stored by the processing pipeline
+    if table.preview is not None:
+        return table.preview
+
+    file_format = compression.strip_codec_suffix(table.file_path)
+    if not file_format.endswith((".csv", ".xlsx")):
+        return {"error": "Неподдерживаемый формат файла для предпросмотра."}
 
     try:
-        if table.file_path.endswith(".csv"):
-            df = pd.read_csv(table.file_path)
-        elif table.file_path.endswith(".xlsx"):
-            df = pd.read_excel(table.file_path)
-        else:
-            return {"error": "Неподдерживаемый формат файла для предпросмотра."}
-
-        preview = df.head(5).to_dict(orient="records")
+        df = await load_table_dataframe(table)
+
+        preview = to_records(df.head(5))
         columns = df.columns.tolist()
         return {"preview": preview, "columns": columns, "total_rows": len(df)}
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка чтения файла таблицы: {e}")
+
+
+async def get_table_memory_report(db: Session, table_id: int, user_id: int) -> dict:
+    """
+    Returns the memory usage of a table with pandas default dtypes versus
+    the inferred compact dtypes. Tables uploaded before type inference
+    existed are analyzed on first request and the result is persisted.
+    """
+    table = await run_in_threadpool(
+        get_user_table_or_404, db, table_id=table_id, user_id=user_id
+    )
+
+    if table.memory_report is None:
+        try:
+            df = await load_table_dataframe(table, apply_types=False)
+        except Exception as e:
+            raise HTTPException(
+                status_code=500, detail=f"Ошибка чтения файла таблицы: {e}"
+            )
+        column_types, report = await run_in_threadpool(table_dtypes.optimize, df)
+        table.column_types = column_types
+        table.memory_report = report
+        await run_in_threadpool(db.commit)
+
+    report = table.memory_report
+    return {
+        "table_id": table.id,
+        **report,
+        "reduction": report["raw_bytes"] / report["bytes"] if report["bytes"] else 1.0,
+    }
@@ -0,0 +1,149 @@
+"""
+Columnar snapshots of typed tables.
+
+A snapshot is an uncompressed `.npz` archive with one array per column and
+a JSON header with the column names and dtypes, so loading it is mostly a
+copy of the stored bytes and never executes code: arrays are read with
+`allow_pickle=False` and only numeric, boolean and byte arrays are stored.
+Columns are encoded by kind:
+- NumPy dtypes (numbers, booleans, datetimes) as their values.
+- Nullable extension dtypes (`Int8`, `boolean`, ...) as values and a mask.
+- Categoricals as codes, with their categories encoded as a column.
+- Text as the concatenated UTF-8 bytes, end offsets and a missing mask.
+
+Tables holding anything else (e.g. Excel cells of mixed types) get no
+snapshot and are parsed from the original file instead.
+"""
+
+from __future__ import annotations
+
+import json
+from io import BytesIO
+from typing import Dict, List
+
+from core.lazy import lazy_import
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+SUFFIX = ".snapshot.npz"
+VERSION = 1
+
+
+class UnsupportedSnapshot(ValueError):
+    pass
+
+
+def _encode_text(values, arrays: Dict[str, np.ndarray], prefix: str) -> None:
+    mask = np.asarray(pd.isna(values), dtype=bool)
+    strings = ["" if missing else value for value, missing in zip(values, mask)]
+    # Offsets count characters, so the text is decoded at once and sliced
+    arrays[f"{prefix}.offsets"] = np.cumsum(
+        [len(value) for value in strings], dtype=np.int64
+    )
+    arrays[f"{prefix}.bytes"] = np.frombuffer("".join(strings).encode(), np.uint8)
+    arrays[f"{prefix}.mask"] = mask
+
+
+def _decode_text(archive, prefix: str, missing) -> np.ndarray:
+    ends = archive[f"{prefix}.offsets"].tolist()
+    text = archive[f"{prefix}.bytes"].tobytes().decode()
+    values = np.empty(len(ends), dtype=object)
+    values[:] = [text[start:end] for start, end in zip([0] + ends[:-1], ends)]
+    values[archive[f"{prefix}.mask"]] = missing
+    return values
+
+
+def _is_text(values) -> bool:
+    return all(isinstance(value, str) for value in values[~pd.isna(values)])
+
+
+def _encode_column(
+    series: pd.Series, arrays: Dict[str, np.ndarray], prefix: str
+) -> dict:
+    dtype = series.dtype
+    if isinstance(dtype, pd.CategoricalDtype):
+        categories = dtype.categories.to_numpy()
+        if not _is_text(categories):
+            raise UnsupportedSnapshot(f"Categories of '{series.name}' are not text")
+        arrays[f"{prefix}.codes"] = series.cat.codes.to_numpy()
+        _encode_text(categories, arrays, f"{prefix}.categories")
+        return {"kind": "category", "ordered": bool(dtype.ordered)}
+    if isinstance(dtype, pd.StringDtype) or (
+        dtype == object and _is_text(series.to_numpy())
+    ):
+        _encode_text(series.to_numpy(dtype=object), arrays, prefix)
+        return {"kind": "text", "dtype": str(dtype)}
+    masked_arrays = (
+        pd.arrays.IntegerArray,
+        pd.arrays.BooleanArray,
+        pd.arrays.FloatingArray,
+    )
+    if isinstance(series.array, masked_arrays):
+        mask = series.isna().to_numpy()
+        arrays[f"{prefix}.values"] = series.to_numpy(
+            dtype=dtype.numpy_dtype, na_value=dtype.numpy_dtype.type(0)
+        )
+        arrays[f"{prefix}.mask"] = mask
+        return {"kind": "masked", "dtype": str(dtype)}
+    if isinstance(dtype, pd.api.extensions.ExtensionDtype) or dtype == object:
+        raise UnsupportedSnapshot(f"Column '{series.name}' of {dtype} is not supported")
+    arrays[f"{prefix}.values"] = series.to_numpy()
+    return {"kind": "numpy"}
+
+
+def _decode_column(archive, prefix: str, column: dict):
+    kind = column["kind"]
+    if kind == "numpy":
+        return archive[f"{prefix}.values"]
+    if kind == "masked":
+        dtype = pd.api.types.pandas_dtype(column["dtype"])
+        values, mask = archive[f"{prefix}.values"], archive[f"{prefix}.mask"]
+        return dtype.construct_array_type()(values, mask)
+    if kind == "category":
+        categories = _decode_text(archive, f"{prefix}.categories", None)
+        return pd.Categorical.from_codes(
+            archive[f"{prefix}.codes"], categories, ordered=column["ordered"]
+        )
+    if column["dtype"] == "object":
+        # Like pandas' readers, missing text is NaN
+        return _decode_text(archive, prefix, np.nan)
+    return pd.array(_decode_text(archive, prefix, None), dtype=column["dtype"])
+
+
+def dumps(df: pd.DataFrame) -> bytes:
+    """Encodes a typed table, raises UnsupportedSnapshot for unsupported columns."""
+    if not df.index.equals(pd.RangeIndex(len(df))):
+        raise UnsupportedSnapshot("Only tables with a default index are supported")
+    arrays: Dict[str, np.ndarray] = {}
+    columns: List[dict] = []
+    for i in range(df.shape[1]):
+        column = _encode_column(df.iloc[:, i], arrays, str(i))
+        columns.append({"name": df.columns[i], **column})
+    try:
+        header = json.dumps({"version": VERSION, "rows": len(df), "columns": columns})
+    except TypeError:
+        # Excel headers may be dates and other values JSON cannot represent
+        raise UnsupportedSnapshot("Column names are not JSON serializable")
+    arrays["header"] = np.frombuffer(header.encode(), dtype=np.uint8)
+
+    buffer = BytesIO()
+    np.savez(buffer, **arrays)
+    return buffer.getvalue()
+
+
+def loads(data: bytes) -> pd.DataFrame:
+    with np.load(BytesIO(data), allow_pickle=False) as archive:
+        header = json.loads(archive["header"].tobytes())
+        if header["version"] != VERSION:
+            raise ValueError(f"Unsupported snapshot version {header['version']}")
+        columns = header["columns"]
+        df = pd.DataFrame(
+            {
+                i: _decode_column(archive, str(i), column)
+                for i, column in enumerate(columns)
+            },
+            index=pd.RangeIndex(header["rows"]),
+        )
+    df.columns = [column["name"] for column in columns]
+    return df
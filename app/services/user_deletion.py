@@ -0,0 +1,285 @@
+"""
+Bulk deletion of users together with their tables and files.
+
+Users are deleted in batches of `batch_size`, walking the matching ids in
+order. Each batch is one short transaction of set-based statements:
+1. Collects the stored files of the batch (tables, snapshots, avatars).
+2. Records their deletion in the storage intent journal.
+3. Deletes the schema and search indexes, the tables and the users.
+
+The files of a batch are then deleted with bounded concurrency while the
+next batch is being deleted from the database. Intents of files that could
+not be deleted stay pending and are retried by `scripts/sync_db_and_files.py`.
+
+Deletions requested through the admin API run as jobs on a dedicated queue,
+one at a time; their progress is kept in memory.
+"""
+
+import asyncio
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import and_, delete, func, or_, select, true
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import ColumnElement
+
+from core.task_queue import TaskQueue
+from db.session import engine
+from features.tables.models import Table, TableColumn
+from features.users.models import User
+from services import journal, search_index
+from services.avatar_service import avatar_keys, evict_avatar, is_shared_default_avatar
+from services.storage import StorageBackend, get_storage, key_from_path
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+DELETE_CONCURRENCY = 16
+# Finished jobs kept for status requests
+MAX_JOBS = 100
+
+queue = TaskQueue("user-deletion", concurrency=1, maxsize=MAX_JOBS)
+
+
+@dataclass
+class UserDeletionReport:
+    dry_run: bool
+    users_matched: int = 0
+    tables_matched: int = 0
+    users_deleted: int = 0
+    tables_deleted: int = 0
+    files_deleted: int = 0
+    failed_deletions: int = 0
+    # Seconds since the deletion started
+    elapsed: float = 0.0
+
+
+@dataclass
+class _Batch:
+    last_id: int
+    users: int
+    tables: int
+    # Storage keys to delete and the avatars to drop from the cache
+    keys: List[str] = field(default_factory=list)
+    avatar_urls: List[str] = field(default_factory=list)
+    intents: Optional[journal.Intents] = None
+
+
+def user_filter(
+    *,
+    user_ids: Optional[Sequence[int]] = None,
+    username_prefix: Optional[str] = None,
+    inactive_only: bool = False,
+    include_superusers: bool = False,
+    exclude_ids: Sequence[int] = (),
+) -> ColumnElement:
+    """Condition on `User` matching all given criteria; no criteria match everyone."""
+    conditions = []
+    if user_ids is not None:
+        conditions.append(User.id.in_(user_ids))
+    if username_prefix:
+        conditions.append(User.username.startswith(username_prefix, autoescape=True))
+    if inactive_only:
+        conditions.append(User.is_active.is_(False))
+    if not include_superusers:
+        conditions.append(
+            or_(User.is_superuser.is_(None), User.is_superuser.is_(False))
+        )
+    if exclude_ids:
+        conditions.append(User.id.notin_(exclude_ids))
+    return and_(true(), *conditions)
+
+
+def _count(engine: Engine, where: ColumnElement) -> Tuple[int, int]:
+    user_ids = select(User.id).where(where)
+    with engine.connect() as conn:
+        users = conn.scalar(select(func.count()).select_from(User).where(where))
+        tables = conn.scalar(
+            select(func.count()).select_from(Table).where(Table.user_id.in_(user_ids))
+        )
+    return users, tables
+
+
+def _delete_batch(
+    engine: Engine, where: ColumnElement, after: int, batch_size: int
+) -> Optional[_Batch]:
+    """Deletes the next batch of matching users in one transaction."""
+    with Session(engine) as db:
+        user_ids = db.scalars(
+            select(User.id)
+            .where(where, User.id > after)
+            .order_by(User.id)
+            .limit(batch_size)
+        ).all()
+        if not user_ids:
+            return None
+        tables = db.execute(
+            select(Table.file_path, Table.snapshot_path).where(
+                Table.user_id.in_(user_ids)
+            )
+        ).all()
+        avatar_urls = [
+            url
+            for url in db.scalars(
+                select(User.avatar_url).where(
+                    User.id.in_(user_ids), User.avatar_url.isnot(None)
+                )
+            )
+            # Shared default avatars are used by other users as well
+            if not is_shared_default_avatar(url)
+        ]
+
+        batch = _Batch(last_id=user_ids[-1], users=len(user_ids), tables=len(tables))
+        entries = []
+        for file_path, snapshot_path in tables:
+            entries.append((journal.TABLE, key_from_path(file_path)))
+            if snapshot_path:
+                entries.append((journal.SNAPSHOT, key_from_path(snapshot_path)))
+        batch.keys = [key for _, key in entries]
+        for url in avatar_urls:
+            entries.append((journal.AVATAR, key_from_path(url)))
+            batch.keys.extend(avatar_keys(url))
+        batch.avatar_urls = avatar_urls
+        batch.intents = journal.record(db, journal.DELETE, entries)
+
+        # Bulk deletes bypass the ORM cascade, so children go first
+        table_ids = select(Table.id).where(Table.user_id.in_(user_ids))
+        db.execute(delete(TableColumn).where(TableColumn.table_id.in_(table_ids)))
+        search_index.remove_users(db, user_ids)
+        db.execute(delete(Table).where(Table.user_id.in_(user_ids)))
+        db.execute(delete(User).where(User.id.in_(user_ids)))
+        db.commit()
+    return batch
+
+
+def _finish(engine: Engine, intents: journal.Intents) -> None:
+    with Session(engine) as db:
+        journal.mark_done(db, intents)
+        db.commit()
+
+
+async def _delete_files(
+    engine: Engine,
+    storage: StorageBackend,
+    batch: _Batch,
+    report: UserDeletionReport,
+    semaphore: asyncio.Semaphore,
+) -> None:
+    failed = False
+
+    async def delete_one(key: str) -> None:
+        nonlocal failed
+        async with semaphore:
+            try:
+                if await storage.delete(key):
+                    report.files_deleted += 1
+            except Exception as e:
+                failed = True
+                report.failed_deletions += 1
+                logger.warning(f"Failed to delete file {key}: {e}")
+
+    await asyncio.gather(*(delete_one(key) for key in batch.keys))
+    for url in batch.avatar_urls:
+        evict_avatar(url)
+    # Pending intents are picked up by the sync tool
+    if not failed:
+        await asyncio.to_thread(_finish, engine, batch.intents)
+
+
+async def delete_users(
+    engine: Engine,
+    storage: StorageBackend,
+    where: ColumnElement,
+    *,
+    dry_run: bool = False,
+    batch_size: int = BATCH_SIZE,
+    concurrency: int = DELETE_CONCURRENCY,
+    progress: Optional[Callable[[UserDeletionReport], None]] = None,
+    report: Optional[UserDeletionReport] = None,
+) -> UserDeletionReport:
+    """
+    Deletes the users matching `where`, see the module docstring. `progress`
+    is called with the report after every batch.
+    """
+    report = report or UserDeletionReport(dry_run=dry_run)
+    start = time.perf_counter()
+    report.users_matched, report.tables_matched = await asyncio.to_thread(
+        _count, engine, where
+    )
+    if dry_run:
+        report.elapsed = time.perf_counter() - start
+        return report
+
+    semaphore = asyncio.Semaphore(concurrency)
+    deleting_files: Optional[asyncio.Task] = None
+    after = 0
+    try:
+        while batch := await asyncio.to_thread(
+            _delete_batch, engine, where, after, batch_size
+        ):
+            after = batch.last_id
+            report.users_deleted += batch.users
+            report.tables_deleted += batch.tables
+            # Files of the previous batch were deleted meanwhile
+            if deleting_files is not None:
+                await deleting_files
+            deleting_files = asyncio.create_task(
+                _delete_files(engine, storage, batch, report, semaphore)
+            )
+            report.elapsed = time.perf_counter() - start
+            if progress is not None:
+                progress(report)
+    finally:
+        if deleting_files is not None:
+            await deleting_files
+    report.elapsed = time.perf_counter() - start
+    return report
+
+
+@dataclass
+class UserDeletionJob:
+    id: str
+    report: UserDeletionReport
+    # "queued", "running", "finished" or "failed"
+    state: str = "queued"
+    error: Optional[str] = None
+
+
+jobs: "OrderedDict[str, UserDeletionJob]" = OrderedDict()
+
+
+async def _run_job(job: UserDeletionJob, where: ColumnElement, batch_size: int):
+    job.state = "running"
+    try:
+        await delete_users(
+            engine,
+            get_storage(),
+            where,
+            dry_run=job.report.dry_run,
+            batch_size=batch_size,
+            report=job.report,
+        )
+    except Exception as e:
+        job.state = "failed"
+        job.error = str(e)
+        raise
+    job.state = "finished"
+
+
+async def submit_deletion(
+    where: ColumnElement, dry_run: bool = False, batch_size: int = BATCH_SIZE
+) -> UserDeletionJob:
+    """Queues a bulk deletion and returns its job, which reports the progress."""
+    job = UserDeletionJob(id=uuid.uuid4().hex, report=UserDeletionReport(dry_run))
+    jobs[job.id] = job
+    while len(jobs) > MAX_JOBS:
+        jobs.popitem(last=False)
+    if not await queue.submit(_run_job, job, where, batch_size):
+        job.state = "failed"
+        job.error = "The deletion queue is not running."
+    return job
@@ -54,7 +54,7 @@ document.addEventListener('DOMContentLoaded', () => {
 
         if (user && user.avatar_url) {
             const avatarImg = document.createElement('img');
-            avatarImg.src = `${user.avatar_url}?t=${new Date().getTime()}`;
+            avatarImg.src = `${user.avatar_url}?size=72`;
             avatarImg.alt = user.username;
             avatarImg.className = 'user-avatar-img';
             userAvatarPlaceholder.appendChild(avatarImg);
@@ -47,7 +47,7 @@ document.addEventListener('DOMContentLoaded', () => {
         deleteAvatarBtn.disabled = user.is_default_avatar;
 
         if (user.avatar_url) {
-            const avatarUrl = `${user.avatar_url}?t=${new Date().getTime()}`;
+            const avatarUrl = user.avatar_url;
             if (avatarPreview) {
                 avatarPreview.src = avatarUrl;
                 avatarPreview.style.display = 'block';
@@ -13,17 +13,32 @@ from sqlalchemy.pool import StaticPool
 from main import app
 from core.config import settings
 from db.base import Base
+from db.instrumentation import instrument_engine
 from db.session import get_db
+from services import table_processing, user_deletion
 from tests.utils import random_lower_string
 
-
 engine = create_engine(
     settings.TEST_DATABASE_URL,
     connect_args={"check_same_thread": False},
     poolclass=StaticPool,
 )
+instrument_engine(engine)
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Background jobs run concurrently with requests and open their own sessions,
+# so they need their own connections to the test database
+background_engine = create_engine(
+    settings.TEST_DATABASE_URL, connect_args={"check_same_thread": False}
+)
+table_processing.SessionLocal = sessionmaker(
+    autocommit=False, autoflush=False, bind=background_engine
+)
+user_deletion.engine = background_engine
+
+# The test schema is created from the models below; migrations are tested separately
+settings.DB_MIGRATIONS = "off"
+
 
 @pytest.fixture(scope="session", autouse=True)
 def create_test_upload_dir():
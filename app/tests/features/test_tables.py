@@ -2,6 +2,9 @@ from fastapi.testclient import TestClient
 from io import BytesIO
 import pandas as pd
 
+from db.instrumentation import capture_statements
+from tests.utils import wait_for_table_processing
+
 
 def test_preview_table_file(authorized_client: dict):
     auth_client = authorized_client["client"]
@@ -213,9 +216,13 @@ def test_delete_table(authorized_client: dict):
     file = ("table_to_delete.csv", BytesIO(file_content), "text/csv")
     create_response = auth_client.post("/api/v1/tables/upload", files={"file": file})
     table_id = create_response.json()["id"]
+    wait_for_table_processing(auth_client)
 
-    delete_response = auth_client.delete(f"/api/v1/tables/{table_id}")
+    with capture_statements() as stats:
+        delete_response = auth_client.delete(f"/api/v1/tables/{table_id}")
     assert delete_response.status_code == 200
+    # The table row is looked up once, not once per layer
+    assert stats.duplicate_statements() == {}
 
     # Verify it's gone from the list
     get_response = auth_client.get("/api/v1/tables/")
@@ -232,3 +239,309 @@ def test_unauthorized_user_cannot_access_tables(client: TestClient):
     csv_file = ("unauth_preview.csv", BytesIO(csv_content), "text/csv")
     response_preview = client.post("/api/v1/tables/preview", files={"file": csv_file})
     assert response_preview.status_code == 401
+
+
+def test_get_table_preview(authorized_client: dict):
+    auth_client = authorized_client["client"]
+
+    file_content = b"col1,col2\n1,a\n2,b\n3,c"
+    file = ("table_preview.csv", BytesIO(file_content), "text/csv")
+    create_response = auth_client.post("/api/v1/tables/upload", files={"file": file})
+    table_id = create_response.json()["id"]
+
+    response = auth_client.get(f"/api/v1/tables/{table_id}/preview")
+    assert response.status_code == 200, response.text
+    data = response.json()
+    assert data["columns"] == ["col1", "col2"]
+    assert data["total_rows"] == 3
+    assert data["preview"][0] == {"col1": 1, "col2": "a"}
+
+
+def test_upload_compressed_table(authorized_client: dict, db, monkeypatch):
+    from core.config import settings
+    from features.tables.models import Table as TableModel
+
+    monkeypatch.setattr(settings, "TABLES_COMPRESSION", "gzip")
+    auth_client = authorized_client["client"]
+
+    file_content = b"col1,col2\n1,2\n3,4"
+    file = ("compressed_table.csv", BytesIO(file_content), "text/csv")
+    create_response = auth_client.post("/api/v1/tables/upload", files={"file": file})
+    assert create_response.status_code == 201, create_response.text
+    table_id = create_response.json()["id"]
+
+    stored_table = db.get(TableModel, table_id)
+    assert stored_table.file_path.endswith(".csv.gz")
+
+    response = auth_client.get(f"/api/v1/tables/{table_id}/preview")
+    assert response.status_code == 200, response.text
+    assert response.json()["preview"] == [
+        {"col1": 1, "col2": 2},
+        {"col1": 3, "col2": 4},
+    ]
+
+
+def test_get_table_memory_report(authorized_client: dict):
+    auth_client = authorized_client["client"]
+
+    rows = "\n".join(
+        f"{i},{'north' if i % 2 else 'south'},{i * 0.5}" for i in range(100)
+    )
+    file_content = f"id,region,score\n{rows}".encode()
+    file = ("memory_table.csv", BytesIO(file_content), "text/csv")
+    create_response = auth_client.post("/api/v1/tables/upload", files={"file": file})
+    table_id = create_response.json()["id"]
+
+    response = auth_client.get(f"/api/v1/tables/{table_id}/memory")
+    assert response.status_code == 200, response.text
+    report = response.json()
+    dtypes = {column["name"]: column["dtype"] for column in report["columns"]}
+    assert dtypes == {"id": "uint8", "region": "category", "score": "float32"}
+    assert report["bytes"] < report["raw_bytes"]
+    assert report["reduction"] > 1
+
+    # The preview is loaded with the same compact types
+    preview_response = auth_client.get(f"/api/v1/tables/{table_id}/preview")
+    assert preview_response.json()["preview"][1] == {
+        "id": 1,
+        "region": "north",
+        "score": 0.5,
+    }
+
+
+def test_upload_cp1251_semicolon_table(authorized_client: dict):
+    auth_client = authorized_client["client"]
+    file_content = "Город;Население\nТверь;400000\nОмск;1100000\n".encode("cp1251")
+
+    preview_file = ("cities.csv", BytesIO(file_content), "text/csv")
+    preview_response = auth_client.post(
+        "/api/v1/tables/preview", files={"file": preview_file}
+    )
+    assert preview_response.status_code == 200, preview_response.text
+    assert preview_response.json()["header"] == ["Город", "Население"]
+
+    upload_file = ("cities.csv", BytesIO(file_content), "text/csv")
+    create_response = auth_client.post(
+        "/api/v1/tables/upload", files={"file": upload_file}
+    )
+    assert create_response.status_code == 201, create_response.text
+    table_id = create_response.json()["id"]
+
+    response = auth_client.get(f"/api/v1/tables/{table_id}/preview")
+    assert response.status_code == 200, response.text
+    assert response.json()["preview"][0] == {"Город": "Тверь", "Население": 400000}
+
+
+def test_upload_is_processed_in_background(authorized_client: dict, db):
+    from features.tables.models import Table as TableModel
+
+    auth_client = authorized_client["client"]
+    file_content = b"id,city,day\n1,Tver,2024-01-01\n2,Omsk,2024-01-02\n3,Tver,\n"
+    file = ("processed_table.csv", BytesIO(file_content), "text/csv")
+    create_response = auth_client.post("/api/v1/tables/upload", files={"file": file})
+    assert create_response.status_code == 201, create_response.text
+    table_id = create_response.json()["id"]
+    assert create_response.json()["processing_status"] in ("pending", "processing")
+
+    wait_for_table_processing(auth_client)
+
+    tables = auth_client.get("/api/v1/tables/").json()
+    assert (
+        next(t for t in tables if t["id"] == table_id)["processing_status"] == "ready"
+    )
+
+    stored_table = db.get(TableModel, table_id)
+    db.refresh(stored_table)
+    assert [(c.name, c.dtype) for c in stored_table.columns] == [
+        ("id", "uint8"),
+        ("city", "object"),
+        ("day", "datetime64[ns]"),
+    ]
+    assert stored_table.column_stats["id"] == {
+        "count": 3,
+        "nulls": 0,
+        "unique": 3,
+        "min": 1,
+        "max": 3,
+        "mean": 2.0,
+    }
+    assert stored_table.snapshot_path.endswith(".snapshot.npz")
+    # Tables and snapshots are not served by the public uploads mount
+    assert auth_client.get(f"/{stored_table.snapshot_path}").status_code == 404
+    assert auth_client.get(f"/{stored_table.file_path}").status_code == 404
+
+    response = auth_client.get(f"/api/v1/tables/{table_id}/preview")
+    assert response.status_code == 200, response.text
+    assert response.json()["total_rows"] == 3
+    assert response.json()["preview"][0] == {
+        "id": 1,
+        "city": "Tver",
+        "day": "2024-01-01T00:00:00",
+    }
+
+
+def test_processing_of_table_deleted_midway(authorized_client: dict, db, monkeypatch):
+    import asyncio
+
+    from features.journal.models import StorageIntent
+    from services import journal, table_processing, table_service
+
+    auth_client = authorized_client["client"]
+    file = ("deleted_midway.csv", BytesIO(b"a\n1\n"), "text/csv")
+    table_id = auth_client.post("/api/v1/tables/upload", files={"file": file}).json()[
+        "id"
+    ]
+    wait_for_table_processing(auth_client)
+
+    async def delete_then_fail(table, apply_types=True):
+        assert auth_client.delete(f"/api/v1/tables/{table_id}").status_code == 200
+        raise ValueError("The file is gone")
+
+    monkeypatch.setattr(table_service, "load_table_dataframe", delete_then_fail)
+    # The failure of a deleted table is not stored, and its intent is done
+    asyncio.run(table_processing.process_table(table_id))
+    pending = db.query(StorageIntent).filter_by(status=journal.PENDING)
+    assert pending.count() == 0
+
+
+def test_query_table(authorized_client: dict):
+    auth_client = authorized_client["client"]
+    file_content = b"id,city,amount\n1,Tver,10\n2,Omsk,5\n3,Tver,7\n4,Perm,\n"
+    file = ("query_table.csv", BytesIO(file_content), "text/csv")
+    table_id = auth_client.post("/api/v1/tables/upload", files={"file": file}).json()[
+        "id"
+    ]
+    wait_for_table_processing(auth_client)
+    url = f"/api/v1/tables/{table_id}/query"
+
+    response = auth_client.post(
+        url,
+        json={
+            "columns": ["id", "amount"],
+            "filters": [{"column": "city", "op": "eq", "value": "Tver"}],
+            "sort": [{"column": "amount", "descending": True}],
+            "limit": 1,
+        },
+    )
+    assert response.status_code == 200, response.text
+    assert response.json() == {
+        "columns": ["id", "amount"],
+        "rows": [{"id": 1, "amount": 10}],
+        "total_rows": 2,
+    }
+
+    response = auth_client.post(
+        url,
+        json={
+            "group_by": ["city"],
+            "aggregates": [{"func": "sum", "column": "amount"}],
+            "sort": [{"column": "city"}],
+        },
+    )
+    assert response.json()["rows"] == [
+        {"city": "Omsk", "sum_amount": 5},
+        {"city": "Perm", "sum_amount": 0},
+        {"city": "Tver", "sum_amount": 17},
+    ]
+
+    response = auth_client.post(url, json={"filters": [{"column": "nope"}]})
+    assert response.status_code == 422
+    assert auth_client.post(url, json={"limit": 10**9}).status_code == 422
+    assert auth_client.post("/api/v1/tables/999999/query", json={}).status_code == 404
+
+
+def test_export_table(authorized_client: dict, monkeypatch):
+    from services import table_export
+
+    # Several chunks even for a small table
+    monkeypatch.setattr(table_export, "CHUNK_ROWS", 2)
+    auth_client = authorized_client["client"]
+    file_content = b"id,city,amount\n1,Tver,10\n2,Omsk,5\n3,Tver,7\n4,Perm,\n"
+    file = ("export_table.csv", BytesIO(file_content), "text/csv")
+    table_id = auth_client.post("/api/v1/tables/upload", files={"file": file}).json()[
+        "id"
+    ]
+    wait_for_table_processing(auth_client)
+    url = f"/api/v1/tables/{table_id}/export"
+
+    response = auth_client.get(url)
+    assert response.status_code == 200, response.text
+    assert response.headers["content-type"] == "text/csv; charset=utf-8"
+    assert "export_table" in response.headers["content-disposition"]
+    assert response.headers["accept-ranges"] == "bytes"
+    body = response.content
+    assert body == b"id,city,amount\n1,Tver,10\n2,Omsk,5\n3,Tver,7\n4,Perm,\n"
+
+    # Resuming a download
+    etag = response.headers["etag"]
+    response = auth_client.get(url, headers={"Range": "bytes=20-", "If-Range": etag})
+    assert response.status_code == 206
+    assert response.headers["content-range"] == f"bytes 20-{len(body) - 1}/{len(body)}"
+    assert response.content == body[20:]
+    response = auth_client.get(url, headers={"Range": "bytes=-6"})
+    assert response.content == body[-6:]
+    response = auth_client.get(url, headers={"Range": "bytes=3-4", "If-Range": '"x"'})
+    assert response.status_code == 200 and response.content == body
+    response = auth_client.get(url, headers={"Range": f"bytes={len(body)}-"})
+    assert response.status_code == 416
+    assert response.headers["content-range"] == f"bytes */{len(body)}"
+
+    response = auth_client.post(
+        url,
+        json={
+            "columns": ["id"],
+            "filters": [{"column": "city", "op": "eq", "value": "Tver"}],
+        },
+    )
+    assert response.status_code == 200, response.text
+    assert response.content == b"id\n1\n3\n"
+
+    response = auth_client.post(
+        url + "?format=xlsx", json={"sort": [{"column": "amount"}]}
+    )
+    assert response.status_code == 200, response.text
+    df = pd.read_excel(BytesIO(response.content))
+    assert df["id"].tolist() == [2, 3, 1, 4]
+    assert df["city"].tolist() == ["Omsk", "Tver", "Tver", "Perm"]
+
+    assert auth_client.get(url + "?format=json").status_code == 422
+    assert auth_client.get("/api/v1/tables/999999/export").status_code == 404
+
+
+def test_search_tables(authorized_client: dict):
+    auth_client = authorized_client["client"]
+    file_content = "id,city,note\n1,Tver,Café opening\n2,Omsk,\n3,Tver,late\n"
+    file = ("search_sales.csv", BytesIO(file_content.encode()), "text/csv")
+    table_id = auth_client.post("/api/v1/tables/upload", files={"file": file}).json()[
+        "id"
+    ]
+    wait_for_table_processing(auth_client)
+
+    response = auth_client.get("/api/v1/tables/search", params={"q": "tver"})
+    assert response.status_code == 200, response.text
+    assert response.json() == [
+        {
+            "table_id": table_id,
+            "table_name": "search_sales",
+            "matches": [
+                {"column": "city", "value": "Tver", "rows": [0, 2], "row_count": 2}
+            ],
+        }
+    ]
+    # Case, diacritics and prefixes
+    matches = auth_client.get("/api/v1/tables/search", params={"q": "CAFE op*"}).json()
+    assert matches[0]["matches"][0]["rows"] == [0]
+    assert auth_client.get("/api/v1/tables/search", params={"q": "perm"}).json() == []
+    assert (
+        auth_client.get("/api/v1/tables/search", params={"q": "* "}).status_code == 422
+    )
+
+    auth_client.put(f"/api/v1/tables/{table_id}", json={"table_name": "orders"})
+    matches = auth_client.get("/api/v1/tables/search", params={"q": "orders"}).json()
+    assert matches[0]["matches"] == [
+        {"column": None, "value": "orders", "rows": [], "row_count": 0}
+    ]
+    assert auth_client.get("/api/v1/tables/search", params={"q": "sales"}).json() == []
+
+    auth_client.delete(f"/api/v1/tables/{table_id}")
+    assert auth_client.get("/api/v1/tables/search", params={"q": "tver"}).json() == []
@@ -1,3 +1,5 @@
+import asyncio
+
 from fastapi.testclient import TestClient
 from sqlalchemy.orm import Session
 import os
@@ -7,8 +9,12 @@ from PIL import Image
 from io import BytesIO
 
 from core.config import settings
+from features.journal.models import StorageIntent
+from features.users.models import User
+from services.storage import key_from_path
 from tests.utils import random_lower_string
 from features.users.crud import user as crud_user
+from services.avatar_service import generate_avatar
 
 
 # --- Registration and Login Tests ---
@@ -147,10 +153,65 @@ def test_update_username_regenerates_default_avatar(authorized_client):
     updated_user = response.json()
     assert updated_user["avatar_url"] != old_avatar_path
     assert os.path.exists(updated_user["avatar_url"].lstrip("/"))
-    assert not os.path.exists(old_avatar_path.lstrip("/"))
+    # Default avatars are shared by letter and colour, so the old one is kept
+    assert os.path.exists(old_avatar_path.lstrip("/"))
     os.remove(updated_user["avatar_url"].lstrip("/"))
 
 
+def test_default_avatars_are_deduplicated(client: TestClient):
+    username = f"dedup_{random_lower_string()}"
+    avatar_url = client.post(
+        "/api/v1/users/register", json={"username": username, "password": "password123"}
+    ).json()["avatar_url"]
+    avatar_path = avatar_url.lstrip("/")
+    assert avatar_url.startswith("/uploads/avatars/default/")
+    modified = os.stat(avatar_path).st_mtime_ns
+
+    # Generating the same avatar again reuses the file without rewriting it
+    assert asyncio.run(generate_avatar(username)) == avatar_url
+    assert os.stat(avatar_path).st_mtime_ns == modified
+    os.remove(avatar_path)
+
+
+def test_get_avatar_http_caching(authorized_client):
+    client = authorized_client["client"]
+    avatar_url = authorized_client["user_data"]["avatar_url"]
+
+    response = client.get(avatar_url)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/png"
+    assert "immutable" in response.headers["cache-control"]
+    etag = response.headers["etag"]
+
+    revalidated = client.get(avatar_url, headers={"If-None-Match": etag})
+    assert revalidated.status_code == 304
+    assert revalidated.content == b""
+    assert revalidated.headers["etag"] == etag
+
+    resized = client.get(avatar_url, params={"size": 72})
+    assert resized.status_code == 200
+    assert Image.open(BytesIO(resized.content)).size == (72, 72)
+    assert resized.headers["etag"] != etag
+
+    assert client.get(avatar_url, params={"size": 73}).status_code == 400
+    assert client.get("/uploads/avatars/missing.png").status_code == 404
+
+
+def test_default_avatar_rendered_without_file(client: TestClient, db):
+    avatar_url = "/uploads/avatars/default/0041-1a2b3c.png"
+    # Keys no user refers to are not rendered
+    assert client.get(avatar_url).status_code == 404
+
+    db.add(User(username="render", hashed_password="-", avatar_url=avatar_url))
+    db.commit()
+    # Default avatars can be rendered from the key alone
+    response = client.get(avatar_url)
+    assert response.status_code == 200
+    image = Image.open(BytesIO(response.content))
+    assert image.size == (200, 200)
+    assert image.getpixel((0, 0)) == (0x1A, 0x2B, 0x3C)
+
+
 def test_update_username_preserves_custom_avatar(authorized_client):
     client = authorized_client["client"]
     img = Image.new("RGB", (100, 100), color="blue")
@@ -266,7 +327,58 @@ def test_upload_avatar_invalid_format(authorized_client):
     assert "Invalid image format" in response.json()["detail"]
 
 
-def test_delete_avatar(authorized_client):
+def test_upload_avatar_is_reencoded(authorized_client):
+    client = authorized_client["client"]
+    img = Image.new("RGB", (600, 400), color="red")
+    exif = Image.Exif()
+    exif[0x010E] = "private description"
+    img_byte_arr = BytesIO()
+    img.save(img_byte_arr, format="JPEG", exif=exif)
+    files = {"file": ("photo.jpg", img_byte_arr.getvalue(), "image/jpeg")}
+    response = client.put("/api/v1/users/me/avatar", files=files)
+    assert response.status_code == 200, response.text
+    avatar_url = response.json()["avatar_url"]
+    assert avatar_url.endswith("/200.webp")
+
+    base_dir = os.path.dirname(avatar_url.lstrip("/"))
+    for size in (48, 72, 96, 144, 200):
+        with Image.open(os.path.join(base_dir, f"{size}.webp")) as variant:
+            assert variant.size == (size, size)
+            assert not variant.getexif()
+
+    # Stored sizes are served directly
+    resized = client.get(avatar_url, params={"size": 48})
+    assert resized.headers["content-type"] == "image/webp"
+    assert Image.open(BytesIO(resized.content)).size == (48, 48)
+
+    # Deleting the avatar removes every stored size
+    client.delete("/api/v1/users/me/avatar")
+    assert not os.path.exists(base_dir) or not os.listdir(base_dir)
+
+
+def test_upload_avatar_limits(authorized_client, db: Session, monkeypatch):
+    client = authorized_client["client"]
+    files = {"file": ("broken.png", b"not an image", "image/png")}
+    response = client.put("/api/v1/users/me/avatar", files=files)
+    assert response.status_code == 400
+    assert "Invalid image file" in response.json()["detail"]
+
+    monkeypatch.setattr(settings, "AVATAR_MAX_PIXELS", 100 * 100)
+    img_byte_arr = BytesIO()
+    Image.new("RGB", (101, 100)).save(img_byte_arr, format="PNG")
+    files = {"file": ("big.png", img_byte_arr.getvalue(), "image/png")}
+    response = client.put("/api/v1/users/me/avatar", files=files)
+    assert response.status_code == 413
+
+    monkeypatch.setattr(settings, "AVATAR_MAX_BYTES", 10)
+    response = client.put("/api/v1/users/me/avatar", files=files)
+    assert response.status_code == 413
+    assert client.get("/api/v1/users/me").json()["is_default_avatar"] is True
+    # Rejected uploads resolve their intents
+    assert db.query(StorageIntent).filter_by(status="pending").count() == 0
+
+
+def test_delete_avatar(authorized_client, db: Session):
     client = authorized_client["client"]
     # First, upload a custom avatar to delete it
     img = Image.new("RGB", (100, 100), color="green")
@@ -277,6 +389,8 @@ def test_delete_avatar(authorized_client):
     upload_response = client.put("/api/v1/users/me/avatar", files=files)
     custom_avatar_url = upload_response.json()["avatar_url"]
     assert os.path.exists(custom_avatar_url.lstrip("/"))
+    resized = client.get(custom_avatar_url, params={"size": 48})
+    assert Image.open(BytesIO(resized.content)).size == (48, 48)
 
     # Now, delete it
     delete_response = client.delete("/api/v1/users/me/avatar")
@@ -286,9 +400,18 @@ def test_delete_avatar(authorized_client):
     new_default_avatar_url = data["avatar_url"]
     assert new_default_avatar_url != custom_avatar_url
     assert not os.path.exists(custom_avatar_url.lstrip("/"))
+    # Cached variants of the deleted avatar are dropped as well
+    assert client.get(custom_avatar_url, params={"size": 48}).status_code == 404
     assert os.path.exists(new_default_avatar_url.lstrip("/"))
     os.remove(new_default_avatar_url.lstrip("/"))
 
+    # Both the upload and the deletion are journaled and finished
+    intents = db.query(StorageIntent).order_by(StorageIntent.id).all()
+    assert [(i.operation, i.key, i.status) for i in intents] == [
+        ("write", key_from_path(custom_avatar_url), "done"),
+        ("delete", key_from_path(custom_avatar_url), "done"),
+    ]
+
 
 def test_delete_default_avatar(authorized_client):
     client = authorized_client["client"]
@@ -337,7 +460,7 @@ def test_register_creates_default_avatar(client: TestClient):
     assert response.status_code == 200
     data = response.json()
 
-    # Check that avatar URL is present and looks like a UUID-named file
+    # Check that avatar URL is present and points to a shared default avatar
     assert "avatar_url" in data
     assert data["avatar_url"].startswith("/uploads/avatars/")
     assert data["avatar_url"].endswith(".png")
@@ -0,0 +1,87 @@
+import re
+import uuid
+from urllib.parse import unquote
+
+import httpx
+
+
+class InMemoryS3:
+    """
+    A minimal in-memory stand-in for an S3-compatible server, used as an
+    `httpx.MockTransport` handler. Supports the subset of the API used by
+    `services.storage.S3Storage`.
+    """
+
+    def __init__(self):
+        self.objects = {}
+        self.uploads = {}
+
+    def transport(self) -> httpx.MockTransport:
+        return httpx.MockTransport(self.handle)
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        if not request.headers.get("authorization", "").startswith("AWS4-HMAC-SHA256"):
+            return httpx.Response(403)
+
+        _, bucket, *key_parts = request.url.path.split("/")
+        key = unquote("/".join(key_parts))
+        params = request.url.params
+
+        if request.method == "GET" and not key:
+            prefix = params.get("prefix", "")
+            contents = "".join(
+                f"<Contents><Key>{k}</Key></Contents>"
+                for k in sorted(self.objects)
+                if k.startswith(prefix)
+            )
+            return httpx.Response(
+                200, content=f"<ListBucketResult>{contents}</ListBucketResult>"
+            )
+
+        if request.method == "POST" and "uploads" in params:
+            upload_id = uuid.uuid4().hex
+            self.uploads[upload_id] = {}
+            return httpx.Response(
+                200,
+                content=(
+                    "<InitiateMultipartUploadResult>"
+                    f"<UploadId>{upload_id}</UploadId>"
+                    "</InitiateMultipartUploadResult>"
+                ),
+            )
+
+        if request.method == "PUT" and "partNumber" in params:
+            parts = self.uploads[params["uploadId"]]
+            parts[int(params["partNumber"])] = request.content
+            return httpx.Response(200, headers={"ETag": f'"{uuid.uuid4().hex}"'})
+
+        if request.method == "POST" and "uploadId" in params:
+            parts = self.uploads.pop(params["uploadId"])
+            self.objects[key] = b"".join(parts[n] for n in sorted(parts))
+            return httpx.Response(200)
+
+        if request.method == "DELETE" and "uploadId" in params:
+            self.uploads.pop(params["uploadId"], None)
+            return httpx.Response(204)
+
+        if request.method == "PUT":
+            self.objects[key] = request.content
+            return httpx.Response(200)
+
+        if key not in self.objects:
+            return httpx.Response(404)
+        data = self.objects[key]
+
+        if request.method == "HEAD":
+            return httpx.Response(200, headers={"Content-Length": str(len(data))})
+
+        if request.method == "DELETE":
+            del self.objects[key]
+            return httpx.Response(204)
+
+        match = re.match(r"bytes=(\d+)-(\d*)", request.headers.get("range", ""))
+        if match:
+            start = int(match.group(1))
+            end = int(match.group(2)) if match.group(2) else len(data) - 1
+            return httpx.Response(206, content=data[start : end + 1])
+        return httpx.Response(200, content=data)
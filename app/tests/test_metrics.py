@@ -0,0 +1,110 @@
+import logging
+
+from sqlalchemy import text
+
+from core import metrics
+from core.config import settings
+from db.instrumentation import capture_statements, redact
+from tests.conftest import engine
+
+
+def test_metrics_endpoint(authorized_client: dict):
+    auth_client = authorized_client["client"]
+    route = "/api/v1/users/me"
+    requests_before = metrics.http_requests.value(
+        method="GET", route=route, status="200"
+    )
+    queries_before = metrics.http_request_db_queries.sum(route=route)
+    db_requests_before = metrics.http_request_db_time.count(route=route)
+
+    assert auth_client.get(route).status_code == 200
+    assert auth_client.get("/static/css/does-not-exist.css").status_code == 404
+
+    response = auth_client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    body = response.text
+
+    # Routes are labelled by template, not by raw path
+    assert (
+        metrics.http_requests.value(method="GET", route=route, status="200")
+        == requests_before + 1
+    )
+    assert 'route="/static/{path}",status="404"' in body
+    assert (
+        f'http_request_duration_seconds_bucket{{method="GET",route="{route}",le="+Inf"}}'
+        in body
+    )
+    # Loading the current user takes at least one statement
+    assert metrics.http_request_db_queries.sum(route=route) > queries_before
+    assert metrics.http_request_db_time.count(route=route) == db_requests_before + 1
+    assert f'http_request_db_seconds_count{{route="{route}"}}' in body
+    assert "db_queries_total " in body
+
+    assert 'cache_hits_total{cache="avatar_glyphs"}' in body
+    assert 'threadpool_threads{state="limit"} 40' in body
+    assert 'task_queue_pending_jobs{queue="table-processing"} 0' in body
+
+
+def test_metrics_render_format():
+    registry = metrics.Registry()
+    counter = registry.counter("jobs", "Jobs.", ("kind",))
+    histogram = registry.histogram("latency_seconds", "Latency.", buckets=(0.1, 1.0))
+    counter.inc(kind='say "hi"')
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+
+    assert registry.render().splitlines() == [
+        "# HELP jobs Jobs.",
+        "# TYPE jobs counter",
+        'jobs_total{kind="say \\"hi\\""} 1',
+        "# HELP latency_seconds Latency.",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{le="0.1"} 1',
+        'latency_seconds_bucket{le="1.0"} 2',
+        'latency_seconds_bucket{le="+Inf"} 2',
+        "latency_seconds_sum 0.55",
+        "latency_seconds_count 2",
+    ]
+
+
+def test_statement_capture_flags_repeated_statements():
+    with capture_statements() as stats:
+        with engine.connect() as conn:
+            for value in (1, 2, 1):
+                conn.execute(text("SELECT :value"), {"value": value})
+            conn.execute(text("SELECT 2"))
+
+    assert stats.db_queries == 4
+    assert stats.duplicate_statements() == {"SELECT ?": 1}
+    assert stats.repeated_statements(3) == {"SELECT ?": 3}
+
+
+def test_slow_query_log_redacts_parameters(caplog, monkeypatch):
+    monkeypatch.setattr(settings, "DB_SLOW_QUERY_THRESHOLD", 0.0)
+    slow_before = metrics.db_slow_queries.value()
+    with caplog.at_level(logging.WARNING, logger="db.instrumentation"):
+        with engine.connect() as conn:
+            conn.execute(text("SELECT :secret"), {"secret": "hunter2"})
+
+    assert metrics.db_slow_queries.value() == slow_before + 1
+    [record] = caplog.records
+    assert "SELECT ? parameters=('str',)" in record.getMessage()
+    assert "hunter2" not in record.getMessage()
+    assert redact({"a": 1}) == {"a": "int"}
+    assert redact([(1,), (2,)], executemany=True) == "<2 parameter sets>"
+
+
+def test_repeated_statements_are_reported(caplog):
+    stats = metrics.RequestStats()
+    for user_id in range(3):
+        stats.record_statement("SELECT * FROM users WHERE id = ?", (user_id,), 0.0)
+    stats.record_statement("SELECT * FROM users WHERE id = ?", (0,), 0.0)
+    route = "/test/repeated"
+
+    with caplog.at_level(logging.WARNING, logger="core.metrics"):
+        metrics.check_statements(stats, route, repeated_threshold=4)
+
+    assert metrics.http_request_db_duplicates.value(route=route) == 1
+    assert metrics.http_request_db_repeated.value(route=route) == 1
+    assert len(caplog.records) == 2
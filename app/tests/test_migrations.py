@@ -0,0 +1,66 @@
+import pytest
+from alembic import command
+from alembic.autogenerate import compare_metadata
+from alembic.runtime.migration import MigrationContext
+from sqlalchemy import create_engine, inspect, text
+
+from db import migrations
+from db.base import Base
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'migrations.db'}")
+    yield engine
+    engine.dispose()
+
+
+def test_migrations_match_models(engine):
+    with pytest.raises(migrations.SchemaOutdatedError):
+        migrations.check_revision(engine)
+
+    migrations.upgrade(engine)
+    migrations.check_revision(engine)
+
+    with engine.connect() as connection:
+        context = MigrationContext.configure(
+            connection, opts={"include_name": migrations.include_name}
+        )
+        diff = compare_metadata(context, Base.metadata)
+    assert diff == []
+
+
+def test_migrations_downgrade(engine):
+    migrations.upgrade(engine)
+    with engine.begin() as connection:
+        command.downgrade(migrations.alembic_config(connection), "base")
+
+    assert migrations.current_revision(engine) is None
+    assert inspect(engine).get_table_names() == ["alembic_version"]
+
+
+def test_upgrade_from_baseline(engine):
+    # A database created by `create_all` before migrations, then stamped
+    migrations.upgrade(engine, "0001")
+    with engine.begin() as connection:
+        connection.execute(
+            text(
+                "INSERT INTO tables (table_name, original_file_name, file_path) "
+                "VALUES ('sales', 'sales.csv', 'uploads/tables/1/sales.csv')"
+            )
+        )
+
+    migrations.upgrade(engine)
+    with engine.connect() as connection:
+        status = connection.scalar(text("SELECT processing_status FROM tables"))
+    # Processed again on the next startup
+    assert status == "pending"
+
+
+def test_search_index_is_created_with_tables(engine):
+    migrations.upgrade(engine)
+    migrated = set(inspect(engine).get_table_names())
+
+    other = create_engine("sqlite://")
+    Base.metadata.create_all(other)
+    assert set(inspect(other).get_table_names()) == migrated - {"alembic_version"}
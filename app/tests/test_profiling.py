@@ -0,0 +1,134 @@
+import time
+from datetime import datetime, timezone
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from core import deps
+from core.profiling import Profile, ProfileStore, ProfilingMiddleware, profiles
+from features.users.models import User
+from tests.conftest import TestingSessionLocal
+
+
+def _busy(seconds: float) -> int:
+    total, deadline = 0, time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        total += 1
+    return total
+
+
+def _profiled_app(store: ProfileStore, **options) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/items/{item_id}")
+    def get_item(item_id: int):
+        # Sync endpoints run in the threadpool, which has to be sampled too
+        return {"item_id": item_id, "work": _busy(0.1)}
+
+    app.add_middleware(
+        ProfilingMiddleware,
+        store=store,
+        interval=0.001,
+        token="secret",
+        authorize=lambda token: token == "admin",
+        **options,
+    )
+    return app
+
+
+def test_profiling_middleware_captures_requested_profiles():
+    store = ProfileStore(max_profiles=2)
+    with TestClient(_profiled_app(store)) as client:
+        assert client.get("/items/1").status_code == 200
+        assert store.list() == []
+
+        assert (
+            client.get("/items/2", headers={"X-Profile": "secret"}).status_code == 200
+        )
+
+    [profile] = store.list()
+    assert profile.route == "/items/{item_id}"
+    assert profile.path == "/items/2"
+    assert profile.status_code == 200
+    assert profile.duration >= 0.1
+    assert profile.samples > 0
+    assert "_busy (test_profiling.py" in profile.top_functions(1)[0][0]
+    assert all(
+        line.rsplit(" ", 1)[1].isdigit() for line in profile.folded().splitlines()
+    )
+
+
+def test_profiling_header_requires_authorization():
+    store = ProfileStore(max_profiles=5)
+    with TestClient(_profiled_app(store)) as client:
+        # Anonymous clients and other users cannot request profiles
+        client.get("/items/1", headers={"X-Profile": "1"})
+        client.get(
+            "/items/1", headers={"X-Profile": "1", "Authorization": "Bearer user"}
+        )
+        client.get("/items/1", headers={"X-Profile": "wrong"})
+        assert store.list() == []
+
+        client.get(
+            "/items/2", headers={"X-Profile": "1", "Authorization": "Bearer admin"}
+        )
+    assert [profile.path for profile in store.list()] == ["/items/2"]
+
+
+def test_profile_store_keeps_slowest():
+    store = ProfileStore(max_profiles=2)
+    for duration in (0.2, 0.1, 0.3, 0.05):
+        store.add(
+            Profile(
+                id=str(duration),
+                method="GET",
+                path="/",
+                route="/",
+                status_code=200,
+                duration=duration,
+                started_at=datetime.now(timezone.utc),
+                samples=0,
+                stacks={},
+            )
+        )
+    assert [profile.duration for profile in store.list()] == [0.3, 0.2]
+    assert store.get("0.1") is None
+
+
+def test_profiles_admin_api(authorized_client: dict, db, monkeypatch):
+    auth_client = authorized_client["client"]
+    assert auth_client.get("/api/v1/admin/profiles").status_code == 403
+
+    token = auth_client.headers["Authorization"].split()[1]
+    monkeypatch.setattr(deps, "SessionLocal", TestingSessionLocal)
+    assert not deps.is_superuser_token(token)
+
+    user = db.get(User, authorized_client["user_data"]["id"])
+    user.is_superuser = True
+    db.commit()
+    assert deps.is_superuser_token(token)
+    assert not deps.is_superuser_token("not-a-token")
+
+    store = ProfileStore(max_profiles=1)
+    with TestClient(_profiled_app(store)) as client:
+        client.get("/items/1", headers={"X-Profile": "secret"})
+    [profile] = store.list()
+    profiles.clear()
+    profiles.add(profile)
+    try:
+        response = auth_client.get("/api/v1/admin/profiles")
+        assert response.status_code == 200
+        [summary] = response.json()
+        assert summary["id"] == profile.id
+        assert summary["route"] == "/items/{item_id}"
+        assert summary["top_functions"][0]["samples"] > 0
+
+        response = auth_client.get(f"/api/v1/admin/profiles/{profile.id}")
+        assert response.status_code == 200
+        assert response.text == profile.folded()
+        assert auth_client.get("/api/v1/admin/profiles/missing").status_code == 404
+
+        assert auth_client.delete("/api/v1/admin/profiles").status_code == 204
+        assert profiles.list() == []
+    finally:
+        profiles.clear()
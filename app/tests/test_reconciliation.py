@@ -0,0 +1,301 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from db.base import Base
+from features.journal.models import StorageIntent
+from features.tables.models import Table, TableColumn
+from features.users.models import User
+from services import journal
+from services.reconciliation import reconcile, replay_journal
+from services.storage import LocalStorage, S3Storage
+from tests.s3_stub import InMemoryS3
+
+
+@pytest.fixture(params=["local", "s3"])
+def storage(request, tmp_path):
+    if request.param == "local":
+        return LocalStorage(str(tmp_path / "uploads"))
+    return S3Storage(
+        endpoint_url="http://s3.test",
+        bucket="uploads",
+        access_key="test",
+        secret_key="secret",
+        transport=InMemoryS3().transport(),
+    )
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'sync.db'}")
+    Base.metadata.create_all(bind=engine)
+    yield engine
+    engine.dispose()
+
+
+def _table(user: User, name: str, snapshot: bool = False) -> Table:
+    return Table(
+        table_name=name,
+        original_file_name=f"{name}.csv",
+        file_path=f"uploads/tables/{user.id}/{name}.csv",
+        snapshot_path=(
+            f"uploads/tables/{user.id}/{name}.csv.snapshot.npz" if snapshot else None
+        ),
+        owner=user,
+        columns=[TableColumn(position=0, name="a", dtype="int8")],
+    )
+
+
+async def _populate(engine, storage):
+    custom = "avatars/00000000-0000-0000-0000-000000000001"
+    with Session(engine) as db:
+        alice = User(
+            username="alice",
+            hashed_password="-",
+            avatar_url=f"/uploads/{custom}/200.webp",
+        )
+        bob = User(
+            username="bob",
+            hashed_password="-",
+            # Uploaded avatar whose files are gone
+            avatar_url="/uploads/avatars/00000000-0000-0000-0000-000000000002/200.webp",
+        )
+        carol = User(
+            username="carol",
+            hashed_password="-",
+            # Shared default avatars are rendered on demand, even if not stored
+            avatar_url="/uploads/avatars/default/0043-123456.png",
+        )
+        db.add_all([alice, bob, carol])
+        db.flush()
+        db.add_all(
+            [_table(alice, "kept", snapshot=True), _table(bob, "lost", snapshot=True)]
+        )
+        db.commit()
+        alice_id, bob_id = alice.id, bob.id
+
+    for size in (48, 200):
+        await storage.save(f"{custom}/{size}.webp", b"webp")
+    await storage.save(f"tables/{alice_id}/kept.csv", b"a\n1\n")
+    await storage.save(f"tables/{alice_id}/kept.csv.snapshot.npz", b"snapshot")
+    # The file of "lost" is missing, only its snapshot is left
+    await storage.save(f"tables/{bob_id}/lost.csv.snapshot.npz", b"snapshot")
+    await storage.save(f"tables/{bob_id}/orphan.csv", b"a\n")
+    await storage.save("avatars/orphan.png", b"png")
+    return alice_id, bob_id
+
+
+@pytest.mark.asyncio
+async def test_reconcile(engine, storage):
+    alice_id, bob_id = await _populate(engine, storage)
+
+    report = await reconcile(engine, storage, dry_run=True, batch_size=2)
+    assert (report.users_checked, report.tables_checked) == (3, 2)
+    assert (report.avatars_reset, report.tables_deleted, report.orphan_files) == (
+        1,
+        1,
+        3,
+    )
+    assert report.files_deleted == 0
+    assert len(await storage.list_keys()) == 7
+
+    report = await reconcile(engine, storage, batch_size=2)
+    assert report.files_deleted == 3
+    assert set(report.timings) >= {"scan storage", "delete orphan files"}
+    assert sorted(await storage.list_keys()) == [
+        "avatars/00000000-0000-0000-0000-000000000001/200.webp",
+        "avatars/00000000-0000-0000-0000-000000000001/48.webp",
+        f"tables/{alice_id}/kept.csv",
+        f"tables/{alice_id}/kept.csv.snapshot.npz",
+    ]
+    with Session(engine) as db:
+        assert [t.table_name for t in db.query(Table)] == ["kept"]
+        assert db.query(TableColumn).count() == 1
+        bob = db.get(User, bob_id)
+        assert (bob.avatar_url, bob.is_default_avatar) == (None, True)
+        assert db.query(User).filter_by(username="carol").one().avatar_url
+
+    report = await reconcile(engine, storage)
+    assert (report.avatars_reset, report.tables_deleted, report.orphan_files) == (
+        0,
+        0,
+        0,
+    )
+
+
+def _record(engine, operation: str, entries, done: bool = False) -> None:
+    with Session(engine) as db:
+        intents = journal.record(db, operation, entries)
+        if done:
+            journal.mark_done(db, intents)
+        db.commit()
+
+
+@pytest.mark.asyncio
+async def test_replay_journal_recovers_interrupted_operations(engine, storage):
+    alice_id, bob_id = await _populate(engine, storage)
+    lost_avatar = "avatars/00000000-0000-0000-0000-000000000002/200.webp"
+    # Upload whose row was never created
+    await storage.save(f"tables/{alice_id}/unsaved.csv", b"a\n")
+    # Avatar upload that crashed before the user was updated
+    half_uploaded = "avatars/00000000-0000-0000-0000-000000000003"
+    for size in (48, 200):
+        await storage.save(f"{half_uploaded}/{size}.webp", b"webp")
+    _record(
+        engine,
+        journal.WRITE,
+        [
+            (journal.TABLE, f"tables/{alice_id}/unsaved.csv"),
+            (journal.TABLE, f"tables/{bob_id}/lost.csv"),
+            (journal.AVATAR, f"{half_uploaded}/200.webp"),
+            (journal.AVATAR, lost_avatar),
+        ],
+    )
+    # Finished operations are checked as well, but need no changes
+    _record(
+        engine, journal.WRITE, [(journal.TABLE, f"tables/{alice_id}/kept.csv")], True
+    )
+
+    report = await replay_journal(engine, storage, dry_run=True, grace=0)
+    assert report.journal_entries == 5
+    assert (report.avatars_reset, report.tables_deleted) == (1, 1)
+    assert len(await storage.list_keys()) == 10
+
+    report = await replay_journal(engine, storage, grace=0, batch_size=2)
+    assert (report.avatars_reset, report.tables_deleted) == (1, 1)
+    # The unsaved table, both sizes of the avatar and the snapshot of "lost"
+    assert report.files_deleted == 4
+    with Session(engine) as db:
+        assert [t.table_name for t in db.query(Table)] == ["kept"]
+        assert db.get(User, bob_id).avatar_url is None
+        # Replayed entries are pruned
+        assert db.query(StorageIntent).count() == 0
+    # The files untouched by the journal are left to the full scan
+    assert sorted(await storage.list_keys()) == [
+        "avatars/00000000-0000-0000-0000-000000000001/200.webp",
+        "avatars/00000000-0000-0000-0000-000000000001/48.webp",
+        "avatars/orphan.png",
+        f"tables/{alice_id}/kept.csv",
+        f"tables/{alice_id}/kept.csv.snapshot.npz",
+        f"tables/{bob_id}/orphan.csv",
+    ]
+
+    report = await replay_journal(engine, storage, grace=0)
+    assert report.journal_entries == 0
+
+
+@pytest.mark.asyncio
+async def test_replay_journal_deletions_and_snapshots(engine, storage):
+    alice_id, _ = await _populate(engine, storage)
+    # The row is gone, but the process died before deleting the file
+    with Session(engine) as db:
+        db.query(TableColumn).delete()
+        db.query(Table).filter_by(table_name="kept").delete()
+        db.commit()
+    _record(engine, journal.DELETE, [(journal.TABLE, f"tables/{alice_id}/kept.csv")])
+    _record(
+        engine,
+        journal.DELETE,
+        [(journal.SNAPSHOT, f"tables/{alice_id}/kept.csv.snapshot.npz")],
+    )
+
+    report = await replay_journal(engine, storage, grace=0)
+    assert report.files_deleted == 2
+    assert not await storage.exists(f"tables/{alice_id}/kept.csv")
+
+    # A referenced snapshot that is missing is dropped from the row
+    with Session(engine) as db:
+        user = db.get(User, alice_id)
+        db.add(_table(user, "fresh", snapshot=True))
+        db.commit()
+    await storage.save(f"tables/{alice_id}/fresh.csv", b"a\n1\n")
+    _record(
+        engine,
+        journal.WRITE,
+        [(journal.SNAPSHOT, f"tables/{alice_id}/fresh.csv.snapshot.npz")],
+    )
+    report = await replay_journal(engine, storage, grace=0)
+    assert report.snapshots_reset == 1
+    with Session(engine) as db:
+        fresh = db.query(Table).filter_by(table_name="fresh").one()
+        assert fresh.snapshot_path is None
+
+
+@pytest.mark.asyncio
+async def test_replay_journal_skips_operations_in_flight(engine, storage):
+    alice_id, _ = await _populate(engine, storage)
+    await storage.save(f"tables/{alice_id}/uploading.csv", b"a\n")
+    _record(
+        engine, journal.WRITE, [(journal.TABLE, f"tables/{alice_id}/uploading.csv")]
+    )
+    _record(
+        engine, journal.WRITE, [(journal.TABLE, f"tables/{alice_id}/kept.csv")], True
+    )
+
+    # The pending upload is recent, so neither it nor later entries are replayed
+    report = await replay_journal(engine, storage, grace=3600)
+    assert report.journal_entries == 0
+    assert await storage.exists(f"tables/{alice_id}/uploading.csv")
+
+    # A full scan spares its file and does not move the checkpoint past it
+    report = await reconcile(engine, storage)
+    assert report.orphan_files == 3
+    assert await storage.exists(f"tables/{alice_id}/uploading.csv")
+    with Session(engine) as db:
+        assert db.query(StorageIntent).count() == 2
+
+    report = await replay_journal(engine, storage, grace=0)
+    assert report.journal_entries == 2
+
+
+@pytest.mark.asyncio
+async def test_replay_journal_keeps_only_failed_deletions(engine, storage, monkeypatch):
+    alice_id, bob_id = await _populate(engine, storage)
+    stuck = f"tables/{bob_id}/orphan.csv"
+    _record(engine, journal.DELETE, [(journal.TABLE, stuck)])
+    await storage.save(f"tables/{alice_id}/unsaved.csv", b"a\n")
+    _record(engine, journal.WRITE, [(journal.TABLE, f"tables/{alice_id}/unsaved.csv")])
+
+    delete = storage.delete
+
+    async def failing_delete(key):
+        if key == stuck:
+            raise OSError("Permission denied")
+        return await delete(key)
+
+    monkeypatch.setattr(storage, "delete", failing_delete)
+    report = await replay_journal(engine, storage, grace=0)
+    assert (report.files_deleted, report.failed_deletions) == (1, 1)
+    # The checkpoint moves past both entries, only the failed one is kept
+    with Session(engine) as db:
+        assert [i.key for i in db.query(StorageIntent)] == [stuck]
+    _record(engine, journal.WRITE, [(journal.TABLE, f"tables/{alice_id}/kept.csv")])
+
+    monkeypatch.setattr(storage, "delete", delete)
+    report = await replay_journal(engine, storage, grace=0)
+    assert (report.journal_entries, report.files_deleted) == (2, 1)
+    assert not await storage.exists(stuck)
+    with Session(engine) as db:
+        assert db.query(StorageIntent).count() == 0
+
+
+@pytest.mark.asyncio
+async def test_reconcile_rechecks_files_stored_after_the_listing(
+    engine, storage, monkeypatch
+):
+    alice_id, bob_id = await _populate(engine, storage)
+    list_keys = storage.list_keys
+
+    async def list_then_store(prefix=""):
+        keys = await list_keys(prefix)
+        if prefix == "tables/":
+            # The file of "lost" arrives right after the listing
+            await storage.save(f"tables/{bob_id}/lost.csv", b"a\n1\n")
+        return keys
+
+    monkeypatch.setattr(storage, "list_keys", list_then_store)
+    report = await reconcile(engine, storage)
+    assert (report.avatars_reset, report.tables_deleted) == (1, 0)
+    assert await storage.exists(f"tables/{bob_id}/lost.csv.snapshot.npz")
+    with Session(engine) as db:
+        assert sorted(t.table_name for t in db.query(Table)) == ["kept", "lost"]
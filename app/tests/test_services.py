@@ -40,3 +40,265 @@ def test_convert_text_to_sql_case_insensitivity():
     expected_sql = "SELECT * FROM users;"
     result_sql = convert_text_to_sql(natural_language_query)
     assert result_sql == expected_sql
+
+
+@pytest.mark.parametrize("codec", [None, "gzip"])
+@pytest.mark.asyncio
+async def test_compression_roundtrip(tmp_path, codec):
+    """
+    Tests that data stored through a codec is read back unchanged.
+    """
+    from services import compression
+    from services.storage import LocalStorage
+
+    storage = LocalStorage(str(tmp_path))
+    key = f"tables/1/table.csv{compression.codec_suffix(codec)}"
+    payload = b"a,b\n" + b"1,2\n" * 10_000
+
+    async def upload():
+        for start in range(0, len(payload), 4096):
+            yield payload[start : start + 4096]
+
+    await storage.save(key, compression.compress_chunks(upload(), codec))
+
+    assert compression.codec_for_path(key) == codec
+    assert compression.strip_codec_suffix(key).endswith("table.csv")
+    chunks = compression.decompress_chunks(
+        storage.iter_bytes(key), compression.codec_for_path(key)
+    )
+    assert b"".join([chunk async for chunk in chunks]) == payload
+
+
+def test_infer_column_types():
+    """
+    Tests that column types are downcast to the most compact lossless dtypes.
+    """
+    import pandas as pd
+    from services.table_dtypes import infer_column_types
+
+    df = pd.DataFrame(
+        {
+            "small": [1, 2, 3, 4],
+            "negative": [-1, 200, 3, 4],
+            "missing": [1.0, None, 3.0, 4.0],
+            "fraction": [0.1, 0.2, 0.3, 0.4],
+            "city": ["Tver", "Tver", "Omsk", "Tver"],
+            "day": ["2024-01-01", "2024-01-02", "2024-01-03", None],
+            "text": ["a", "b", "c", "d"],
+        }
+    )
+    assert infer_column_types(df) == {
+        "small": "uint8",
+        "negative": "int16",
+        "missing": "UInt8",
+        "fraction": "float64",
+        "city": "category",
+        "day": "datetime64[ns]",
+        "text": "object",
+    }
+
+
+@pytest.mark.parametrize(
+    "sample, expected",
+    [
+        (
+            b"a,b\n1,2\n",
+            {"encoding": "utf-8", "delimiter": ",", "has_header": True},
+        ),
+        (
+            "Имя;Возраст\nИван;30\n".encode("cp1251"),
+            {"encoding": "cp1251", "delimiter": ";", "has_header": True},
+        ),
+        (
+            b"1\t2\n3\t4\n5\t6\n",
+            {"encoding": "utf-8", "delimiter": "\t", "has_header": False},
+        ),
+    ],
+)
+def test_sniff_dialect(sample, expected):
+    """
+    Tests that encoding, delimiter and header presence are detected.
+    """
+    from services.csv_dialect import sniff_dialect
+
+    dialect = sniff_dialect(sample)
+    assert {key: dialect[key] for key in expected} == expected
+
+
+def test_render_avatar_uses_cached_glyphs():
+    """
+    Tests that avatars are rendered from a cached glyph mask and look the
+    same as drawing the letter directly.
+    """
+    from PIL import Image, ImageChops, ImageDraw
+    from services import avatar_service
+
+    avatar_service.get_glyph_mask.cache_clear()
+    image = avatar_service.render_avatar("alice")
+    avatar_service.render_avatar("anna")
+    info = avatar_service.get_glyph_mask.cache_info()
+    assert (info.misses, info.hits) == (1, 1)
+
+    expected = Image.new("RGB", image.size, avatar_service.avatar_color("alice"))
+    ImageDraw.Draw(expected).text(
+        (100, 100),
+        "A",
+        fill="white",
+        font=avatar_service.get_font(avatar_service.FONT_SIZE),
+        anchor="mm",
+    )
+    diff = ImageChops.difference(image, expected).getextrema()
+    assert max(high for _, high in diff) <= 2
+
+
+def test_lru_cache_evicts_by_size():
+    """
+    Tests that the LRU cache evicts least recently used entries by total size.
+    """
+    from core.lru import LRUCache
+
+    cache = LRUCache(max_size=10)
+    cache.set("a", b"1234")
+    cache.set("b", b"1234")
+    assert cache.get("a") == b"1234"
+    cache.set("c", b"1234")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == b"1234" and cache.get("c") == b"1234"
+    assert cache.size == 8
+    assert (cache.hits, cache.misses) == (3, 1)
+    cache.set("big", b"x" * 11)
+    assert cache.get("big") is None
+
+
+def test_heavy_dependencies_are_imported_lazily():
+    """
+    Tests that importing the application does not import pandas, numpy or Pillow.
+    """
+    import os
+    import subprocess
+    import sys
+
+    app_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    code = (
+        "import sys, main; "
+        "print(sorted(m for m in ('pandas', 'numpy', 'PIL.Image') if m in sys.modules))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=app_dir,
+        env={**os.environ, "DATABASE_URL": "sqlite:///./sql_app.db"},
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert result.stdout.strip() == "[]"
+
+
+def test_select_table_rows():
+    import pandas as pd
+
+    from features.tables.schemas import TableQuery
+    from services.table_query import InvalidQuery, _result, select_rows
+
+    df = pd.DataFrame(
+        {
+            "city": pd.Categorical(["Tver", "Omsk", "Tver", "Perm", None]),
+            "amount": [10.0, 5.0, None, 7.5, 1.0],
+            "day": pd.to_datetime(
+                ["2024-01-01", "2024-01-02", "2024-01-03", "2024-01-04", None]
+            ),
+        }
+    )
+
+    def query(**kwargs) -> dict:
+        table_query = TableQuery(**kwargs)
+        selection = select_rows(df, table_query, table_query.limit)
+        return _result(selection.rows(), selection.total)
+
+    result = query(
+        columns=["city", "amount"],
+        filters=[{"column": "day", "op": "ge", "value": "2024-01-02"}],
+        sort=[{"column": "amount", "descending": True}],
+        limit=2,
+    )
+    assert result["total_rows"] == 3
+    assert result["rows"] == [
+        {"city": "Perm", "amount": 7.5},
+        {"city": "Omsk", "amount": 5.0},
+    ]
+
+    # Missing values never match and sort last
+    result = query(filters=[{"column": "amount", "op": "lt", "value": 8}])
+    assert [row["city"] for row in result["rows"]] == ["Omsk", "Perm", None]
+    result = query(sort=[{"column": "amount"}], offset=3, columns=["amount"])
+    assert result["rows"] == [{"amount": 10.0}, {"amount": None}]
+    result = query(filters=[{"column": "city", "op": "in", "value": ["Omsk", "Perm"]}])
+    assert result["total_rows"] == 2
+    result = query(filters=[{"column": "city", "op": "contains", "value": "ve"}])
+    assert result["total_rows"] == 2
+
+    result = query(
+        group_by=["city"],
+        aggregates=[
+            {"func": "count"},
+            {"func": "sum", "column": "amount", "alias": "total"},
+        ],
+        sort=[{"column": "total", "descending": True}],
+    )
+    assert result["columns"] == ["city", "count", "total"]
+    assert result["rows"][0] == {"city": "Tver", "count": 2, "total": 10.0}
+    assert result["total_rows"] == 4
+
+    result = query(aggregates=[{"func": "max", "column": "day"}, {"func": "count"}])
+    assert result["rows"] == [{"max_day": "2024-01-04T00:00:00", "count": 5}]
+
+    with pytest.raises(InvalidQuery):
+        query(columns=["missing"])
+    with pytest.raises(TypeError):
+        query(aggregates=[{"func": "mean", "column": "city"}])
+
+
+def test_parse_range():
+    from fastapi import HTTPException
+
+    from services.table_export import parse_range
+
+    assert parse_range("bytes=0-9", 100) == (0, 9)
+    assert parse_range("bytes=90-200", 100) == (90, 99)
+    assert parse_range("bytes=95-", 100) == (95, 99)
+    assert parse_range("bytes=-10", 100) == (90, 99)
+    assert parse_range("bytes=-500", 100) == (0, 99)
+    # The whole body is sent for what cannot be served as a single range
+    for header in ("bytes=0-1,5-6", "items=0-9", "bytes=9-0", "bytes=a-", "bytes=-"):
+        assert parse_range(header, 100) is None
+    for header in ("bytes=100-", "bytes=-0"):
+        with pytest.raises(HTTPException) as error:
+            parse_range(header, 100)
+        assert error.value.status_code == 416
+
+
+def test_table_snapshot_round_trip():
+    import numpy as np
+    import pandas as pd
+
+    from services import table_snapshot
+
+    df = pd.DataFrame(
+        {
+            "id": np.array([1, 2, 3], dtype="uint8"),
+            "amount": pd.array([10, None, 7], dtype="Int16"),
+            "flag": pd.array([True, None, False], dtype="boolean"),
+            "price": np.array([1.5, np.nan, 2.25], dtype="float32"),
+            "city": pd.Categorical(["Тверь", "Omsk", None]),
+            "note": np.array(["café", np.nan, ""], dtype=object),
+            "day": pd.to_datetime(["2024-01-01", None, "2024-01-03"]),
+            7: pd.array(["a", None, "c"], dtype="string"),
+        }
+    )
+    data = table_snapshot.dumps(df)
+    pd.testing.assert_frame_equal(table_snapshot.loads(data), df)
+
+    # Mixed Excel cells are parsed from the original file instead
+    with pytest.raises(table_snapshot.UnsupportedSnapshot):
+        table_snapshot.dumps(pd.DataFrame({"mixed": [1, "a"]}))
@@ -0,0 +1,172 @@
+import os
+import re
+
+from fastapi.testclient import TestClient
+
+
+def _asset_urls(html: str):
+    return re.findall(r'(?:href|src)="(/static/[^"]+)"', html)
+
+
+def test_pages_link_hashed_assets(client: TestClient):
+    response = client.get("/queries")
+    assert response.status_code == 200
+    urls = _asset_urls(response.text)
+    assert urls
+    for url in urls:
+        assert re.search(r"\.[0-9a-f]{12}\.(css|js)$", url), url
+
+
+def test_hashed_asset_is_immutable(client: TestClient):
+    url = _asset_urls(client.get("/login").text)[0]
+    response = client.get(url)
+    assert response.status_code == 200
+    assert "immutable" in response.headers["cache-control"]
+    etag = response.headers["etag"]
+
+    revalidated = client.get(url, headers={"If-None-Match": etag})
+    assert revalidated.status_code == 304
+    assert revalidated.content == b""
+
+
+def test_plain_asset_url_is_revalidated(client: TestClient):
+    response = client.get("/static/css/styles.css")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/css")
+    assert response.headers["cache-control"] == "no-cache"
+    assert client.get("/static/css/missing.css").status_code == 404
+
+
+def test_page_conditional_requests(client: TestClient):
+    response = client.get("/help", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    # httpx decodes the body transparently
+    assert response.headers["content-encoding"] == "gzip"
+    assert "<html" in response.text.lower()
+    etag = response.headers["etag"]
+    last_modified = response.headers["last-modified"]
+
+    assert (
+        client.get(
+            "/help", headers={"Accept-Encoding": "gzip", "If-None-Match": etag}
+        ).status_code
+        == 304
+    )
+    assert (
+        client.get("/help", headers={"If-Modified-Since": last_modified}).status_code
+        == 304
+    )
+
+    plain = client.get("/help", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in plain.headers
+    assert plain.headers["etag"] != etag
+
+
+def test_page_cache_auto_reload(tmp_path):
+    from starlette.requests import Request
+
+    from core.pages import PageCache
+
+    page = tmp_path / "page.html"
+    page.write_text("<p>first</p>")
+    request = Request({"type": "http", "headers": []})
+
+    cache = PageCache(str(tmp_path))
+    page.write_text("<p>second version</p>")
+    assert cache.response("page.html", request).body == b"<p>first</p>"
+
+    reloading = PageCache(str(tmp_path), auto_reload=True)
+    page.write_text("<p>third</p>")
+    os.utime(page, ns=(0, 10**9))
+    assert reloading.response("page.html", request).body == b"<p>third</p>"
+
+
+def test_page_last_modified_follows_static_assets(tmp_path):
+    from starlette.requests import Request
+
+    from core.http_cache import http_date
+    from core.pages import PageCache
+    from core.static_assets import StaticAssets
+
+    templates, static = tmp_path / "templates", tmp_path / "static"
+    templates.mkdir()
+    static.mkdir()
+    page = templates / "page.html"
+    page.write_text('<link href="/static/app.css">')
+    asset = static / "app.css"
+    asset.write_text("p {}")
+    for path in (page, static, asset):
+        os.utime(path, (10**9, 10**9))
+    os.utime(asset, (2 * 10**9, 2 * 10**9))
+
+    cache = PageCache(str(templates), StaticAssets(directory=str(static)))
+    checked_at = http_date(1.5 * 10**9)
+    request = Request(
+        {"type": "http", "headers": [(b"if-modified-since", checked_at.encode())]}
+    )
+    # The page links the new hashed URL, so a copy from before is stale
+    response = cache.response("page.html", request)
+    assert response.status_code == 200
+    assert response.headers["last-modified"] == http_date(2 * 10**9)
+
+
+def test_static_asset_precompressed(client: TestClient):
+    url = _asset_urls(client.get("/queries").text)[-1]
+    identity = client.get(url, headers={"Accept-Encoding": "identity"})
+    compressed = client.get(url, headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in identity.headers
+    assert compressed.headers["content-encoding"] == "gzip"
+    assert compressed.headers["vary"] == "Accept-Encoding"
+    assert compressed.content == identity.content
+    assert compressed.headers["etag"] != identity.headers["etag"]
+
+
+def test_compression_middleware():
+    import zlib
+
+    from starlette.applications import Starlette
+    from starlette.responses import JSONResponse, StreamingResponse
+    from starlette.routing import Route
+
+    from core.http_compression import CompressionMiddleware, _StreamCompressor
+
+    async def big(request):
+        return JSONResponse([{"value": i} for i in range(500)])
+
+    async def small(request):
+        return JSONResponse({"ok": True})
+
+    async def stream(request):
+        async def chunks():
+            yield b'{"rows": ['
+            yield b"1, 2, 3"
+            yield b"]}"
+
+        return StreamingResponse(chunks(), media_type="application/json")
+
+    app = Starlette(
+        routes=[Route("/big", big), Route("/small", small), Route("/stream", stream)]
+    )
+    app.add_middleware(CompressionMiddleware, minimum_size=1024)
+    gzip_client = TestClient(app, headers={"Accept-Encoding": "gzip"})
+
+    response = gzip_client.get("/big")
+    assert response.headers["content-encoding"] == "gzip"
+    assert int(response.headers["content-length"]) < len(response.content)
+    assert response.json()[499] == {"value": 499}
+
+    assert "content-encoding" not in gzip_client.get("/small").headers
+
+    response = gzip_client.get("/stream")
+    assert response.headers["content-encoding"] == "gzip"
+    assert "content-length" not in response.headers
+    assert response.json() == {"rows": [1, 2, 3]}
+
+    # Every streamed chunk is flushed, so it decodes as soon as it arrives
+    compressor = _StreamCompressor("gzip", gzip_level=6, brotli_quality=4)
+    decoder = zlib.decompressobj(31)
+    assert decoder.decompress(compressor(b'{"rows": [', final=False)) == b'{"rows": ['
+    assert decoder.decompress(compressor(b"1]}", final=True)) == b"1]}"
+
+    identity = TestClient(app, headers={"Accept-Encoding": "identity"}).get("/big")
+    assert "content-encoding" not in identity.headers
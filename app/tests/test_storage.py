@@ -0,0 +1,56 @@
+import pytest
+
+from services.storage import LocalStorage, S3Storage, key_from_path
+from tests.s3_stub import InMemoryS3
+
+
+@pytest.fixture(params=["local", "s3"])
+def storage(request, tmp_path):
+    if request.param == "local":
+        return LocalStorage(str(tmp_path))
+    return S3Storage(
+        endpoint_url="http://s3.test",
+        bucket="uploads",
+        access_key="test",
+        secret_key="secret",
+        part_size=8,
+        transport=InMemoryS3().transport(),
+    )
+
+
+async def _chunks(*chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+@pytest.mark.asyncio
+async def test_storage_roundtrip(storage):
+    """
+    Tests saving, reading, ranged reads, listing and deleting objects.
+    """
+    written = await storage.save(
+        "tables/1/data.csv", _chunks(b"col1,col2\n", b"1,2\n", b"3,4\n")
+    )
+    assert written == 18
+    await storage.save("avatars/a.png", b"png")
+
+    assert await storage.exists("tables/1/data.csv")
+    assert await storage.size("tables/1/data.csv") == 18
+    assert await storage.read_bytes("tables/1/data.csv") == b"col1,col2\n1,2\n3,4\n"
+    assert await storage.read_bytes("tables/1/data.csv", start=10, end=13) == b"1,2\n"
+    assert await storage.read_bytes("tables/1/data.csv", start=14) == b"3,4\n"
+
+    assert await storage.list_keys("tables/") == ["tables/1/data.csv"]
+    assert sorted(await storage.list_keys()) == ["avatars/a.png", "tables/1/data.csv"]
+
+    assert await storage.delete("tables/1/data.csv") is True
+    assert await storage.delete("tables/1/data.csv") is False
+    assert not await storage.exists("tables/1/data.csv")
+    with pytest.raises(FileNotFoundError):
+        await storage.read_bytes("tables/1/data.csv")
+
+
+def test_key_from_path():
+    assert key_from_path("/uploads/avatars/a.png") == "avatars/a.png"
+    assert key_from_path("uploads/tables/1/t.csv") == "tables/1/t.csv"
+    assert key_from_path("avatars/a.png") == "avatars/a.png"
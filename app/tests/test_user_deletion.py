@@ -0,0 +1,146 @@
+import time
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from db.base import Base
+from features.journal.models import StorageIntent
+from features.tables.models import Table, TableColumn
+from features.users.models import User
+from services import journal, user_deletion
+from services.storage import LocalStorage
+
+
+@pytest.fixture
+def storage(tmp_path):
+    return LocalStorage(str(tmp_path / "uploads"))
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'users.db'}")
+    Base.metadata.create_all(bind=engine)
+    yield engine
+    engine.dispose()
+
+
+async def _populate(engine, storage, users: int) -> None:
+    with Session(engine) as db:
+        for i in range(users):
+            avatar = f"avatars/00000000-0000-0000-0000-{i:012d}"
+            user = User(
+                username=f"user_{i}",
+                hashed_password="-",
+                is_active=i % 2 == 0,
+                avatar_url=f"/uploads/{avatar}/200.webp",
+                is_default_avatar=False,
+            )
+            user.tables = [
+                Table(
+                    table_name=f"t{i}",
+                    original_file_name="t.csv",
+                    file_path=f"uploads/tables/{i}/t.csv",
+                    snapshot_path=f"uploads/tables/{i}/t.csv.snapshot.npz",
+                    columns=[TableColumn(position=0, name="a", dtype="int8")],
+                )
+            ]
+            db.add(user)
+            for size in (48, 200):
+                await storage.save(f"{avatar}/{size}.webp", b"webp")
+            await storage.save(f"tables/{i}/t.csv", b"a\n1\n")
+            await storage.save(f"tables/{i}/t.csv.snapshot.npz", b"snapshot")
+        db.add(
+            User(
+                username="admin",
+                hashed_password="-",
+                is_superuser=True,
+                # Shared default avatars are never deleted
+                avatar_url="/uploads/avatars/default/0041-123456.png",
+            )
+        )
+        db.commit()
+    await storage.save("avatars/default/0041-123456.png", b"png")
+
+
+@pytest.mark.asyncio
+async def test_delete_users_by_filter(engine, storage):
+    await _populate(engine, storage, users=5)
+    where = user_deletion.user_filter(inactive_only=True)
+
+    report = await user_deletion.delete_users(engine, storage, where, dry_run=True)
+    assert (report.users_matched, report.tables_matched) == (2, 2)
+    assert report.users_deleted == 0
+
+    progress = []
+    report = await user_deletion.delete_users(
+        engine,
+        storage,
+        where,
+        batch_size=1,
+        progress=lambda r: progress.append(r.users_deleted),
+    )
+    assert progress == [1, 2]
+    assert (report.users_deleted, report.tables_deleted) == (2, 2)
+    # Two table files and two avatar sizes per user
+    assert report.files_deleted == 8
+    with Session(engine) as db:
+        assert sorted(u.username for u in db.query(User)) == [
+            "admin",
+            "user_0",
+            "user_2",
+            "user_4",
+        ]
+        assert db.query(Table).count() == db.query(TableColumn).count() == 3
+        assert {i.status for i in db.query(StorageIntent)} == {journal.DONE}
+    assert not await storage.exists("tables/1/t.csv")
+    assert await storage.exists("tables/2/t.csv")
+
+
+@pytest.mark.asyncio
+async def test_delete_all_users_keeps_superusers(engine, storage):
+    await _populate(engine, storage, users=5)
+
+    report = await user_deletion.delete_users(
+        engine, storage, user_deletion.user_filter(), batch_size=2
+    )
+    assert report.users_deleted == 5
+    with Session(engine) as db:
+        assert [u.username for u in db.query(User)] == ["admin"]
+        assert db.query(Table).count() == 0
+    assert await storage.list_keys() == ["avatars/default/0041-123456.png"]
+
+
+def test_bulk_user_deletion_api(authorized_client: dict, db):
+    client = authorized_client["client"]
+    request = {"username_prefix": "doomed_"}
+    assert client.post("/api/v1/admin/users/deletions", json=request).status_code == 403
+
+    admin = db.get(User, authorized_client["user_data"]["id"])
+    admin.is_superuser = True
+    db.add_all(
+        [User(username=f"doomed_{i}", hashed_password="-") for i in range(3)]
+        + [User(username="doomed_admin", hashed_password="-", is_superuser=True)]
+    )
+    db.commit()
+
+    # A filter or an explicit `all` is required
+    assert client.post("/api/v1/admin/users/deletions", json={}).status_code == 422
+
+    response = client.post("/api/v1/admin/users/deletions", json=request)
+    assert response.status_code == 202
+    job_id = response.json()["id"]
+    for _ in range(100):
+        status = client.get(f"/api/v1/admin/users/deletions/{job_id}").json()
+        if status["state"] in ("finished", "failed"):
+            break
+        time.sleep(0.05)
+    assert status["state"] == "finished"
+    assert (status["users_matched"], status["users_deleted"]) == (3, 3)
+
+    db.expire_all()
+    assert [u.username for u in db.query(User).order_by(User.id)] == [
+        admin.username,
+        "doomed_admin",
+    ]
+    assert client.get("/api/v1/admin/users/deletions/missing").status_code == 404
@@ -1,6 +1,15 @@
 import random
 import string
 
+from fastapi.testclient import TestClient
+
+from services import table_processing
+
 
 def random_lower_string(k=10):
     return "".join(random.choices(string.ascii_lowercase, k=k))
+
+
+def wait_for_table_processing(client: TestClient) -> None:
+    """Blocks until the background pipeline has processed all uploaded tables."""
+    client.portal.call(table_processing.queue.join)